@@ -1,350 +1,4026 @@
 # Enhanced Flask App with SharePoint Integration
-# pip install flask pandas openpyxl requests Office365-REST-Python-Client werkzeug msal
+# pip install flask pandas openpyxl requests Office365-REST-Python-Client werkzeug
+#
+# pandas, openpyxl and the SharePoint client are imported where they are
+# used rather than here, so that a cold start from the snapshot cache does
+# not pay for importing them.
 
-from flask import Flask, render_template, request, jsonify, send_file
-import pandas as pd
+from flask import Flask, render_template, request, jsonify, send_file, g
+from flask.json.provider import DefaultJSONProvider
 import json
 from collections import defaultdict
 import os
 import logging
 from datetime import datetime
-import requests
 from werkzeug.utils import secure_filename
-import openpyxl
-from openpyxl import Workbook
+import importlib.util
 import io
+import re
+import csv
+import tempfile
 import random
+import time
+import shutil
+import threading
+import queue
+import uuid
+import hashlib
+import mmap
+import pickle
+import struct
+import base64
+import gzip
+import zlib
+import functools
+import sys
+import sqlite3
+import atexit
+import math
+import multiprocessing
+import multiprocessing.connection
+from collections import Counter, OrderedDict
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from itertools import accumulate, islice
+from urllib.parse import quote, urlsplit
+from bisect import bisect_left, bisect_right, insort
 
-# SharePoint and Microsoft Graph integration
 try:
-    from office365.runtime.auth.authentication_context import AuthenticationContext
-    from office365.sharepoint.client_context import ClientContext
-    from office365.sharepoint.files.file import File
-    import msal
-    SHAREPOINT_AVAILABLE = True
+    import brotli
+    BROTLI_AVAILABLE = True
 except ImportError:
-    SHAREPOINT_AVAILABLE = False
-    print("SharePoint libraries not installed. Install with: pip install Office365-REST-Python-Client msal")
+    BROTLI_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where SHARED_SNAPSHOT is unsupported
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+class RecordJSONProvider(DefaultJSONProvider):
+    """JSON provider that also serializes compact Employee records"""
+
+    @staticmethod
+    def default(o):
+        if hasattr(o, 'to_dict'):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+app = Flask(__name__)
+app.json = RecordJSONProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+
+# Configuration
+UPLOAD_FOLDER = 'uploads'
+ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+
+# SharePoint Configuration
+SHAREPOINT_CONFIG = {
+    'site_url': os.environ.get('SHAREPOINT_SITE_URL', 'https://ibase1-my.sharepoint.com.mcas.ms'),
+    # How the client signs in:
+    #   'user'  - SharePoint sign-in with username and password through
+    #             Office365-REST-Python-Client (the default); tenant_id,
+    #             client_id and client_secret are not used
+    #   'oauth' - Azure AD password grant against token_url. Needs an app
+    #             registered in the tenant with delegated SharePoint
+    #             permissions and public client flows allowed: set tenant_id
+    #             and client_id to its ids, and client_secret if it is a
+    #             confidential app, along with username and password
+    'auth': os.environ.get('SHAREPOINT_AUTH', 'user'),
+    # OAuth token endpoint; defaults to the tenant's Azure AD endpoint
+    'token_url': os.environ.get('SHAREPOINT_TOKEN_URL'),
+    'tenant_id': 'YOUR_TENANT_ID',
+    'client_id': 'YOUR_CLIENT_ID',
+    'client_secret': 'YOUR_CLIENT_SECRET',
+    'file_url': '/personal/mayank_arya_qualitestgroup_com/_layouts/15/Doc.aspx?sourcedoc=%7BC78EB499-DAA9-47ED-AEDF-6888F709B3E0%7D&file=Profiles.xlsx',
+    'direct_file_path': '/personal/mayank_arya_qualitestgroup_com/Documents/Profiles.xlsx',
+    'username': 'sohail.islam@qualitestgroup.com',
+    'password': 'YOUR_PASSWORD'
+}
+
+# SharePoint integration: the REST client is built on requests, and the
+# default sign-in uses Office365-REST-Python-Client
+SHAREPOINT_MODULES = ('requests', 'office365') if SHAREPOINT_CONFIG['auth'] == 'user' else ('requests',)
+SHAREPOINT_AVAILABLE = all(importlib.util.find_spec(module) is not None for module in SHAREPOINT_MODULES)
+if not SHAREPOINT_AVAILABLE:
+    print("SharePoint libraries not installed. Install with: pip install requests Office365-REST-Python-Client")
+
+# Local stand-in for the SharePoint workbook (development and testing)
+PROFILES_SOURCE_FILE = os.environ.get('PROFILES_SOURCE_FILE')
+
+# Several profiles sources, separated by ';': each a local path or
+# 'sharepoint:<server-relative path>', optionally followed by '#<sheet>' to
+# read that sheet or '#*' to read every sheet (default: the first). Earlier
+# sources win when the same employee appears in more than one. Overrides
+# PROFILES_SOURCE_FILE and the SharePoint workbook when set.
+PROFILES_SOURCES = os.environ.get('PROFILES_SOURCES', '')
+
+# Processes parsing sheets in parallel when there is more than one; 0 means
+# one per CPU
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 0))
+
+# How downloaded profiles are parsed: 'stream' reads rows straight into
+# records with openpyxl/csv, 'pandas' loads a DataFrame first
+PROFILE_READER = os.environ.get('PROFILE_READER', 'stream').lower()
+
+# On-disk snapshot cache used for fast cold starts
+SNAPSHOT_CACHE_PATH = os.environ.get('SNAPSHOT_CACHE_PATH', os.path.join(UPLOAD_FOLDER, 'snapshot.bin'))
+SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get('SNAPSHOT_MAX_AGE_SECONDS', 15 * 60))
+SNAPSHOT_WRITE_DELAY_SECONDS = float(os.environ.get('SNAPSHOT_WRITE_DELAY_SECONDS', 30))
+
+# Set when several worker processes serve the app: the snapshot cache then
+# becomes the shared copy of the data, one process at a time syncs or applies
+# structure changes, and the others adopt each new version from the file and
+# the journal of structure changes next to it
+SHARED_SNAPSHOT = os.environ.get('SHARED_SNAPSHOT', '').lower() in ('1', 'true', 'yes')
+SHARED_SNAPSHOT_CHECK_SECONDS = float(os.environ.get('SHARED_SNAPSHOT_CHECK_SECONDS', 1))
+
+# Sampling profiler endpoints are only served when this is set
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# SQLite database holding connections added through the app
+CONNECTIONS_DB_PATH = os.environ.get('CONNECTIONS_DB_PATH', os.path.join(UPLOAD_FOLDER, 'connections.db'))
+
+# QT Representatives (Connection Champions)
+QT_REPRESENTATIVES = ['Lihi Segev', 'Abhijeet Bagade', 'Omri Nissim', 'Kobi Kol', 'Jillian OrRico', 'Michael Bush', 'Mayank Arya']
+QT_RELATIONSHIPS = ['Direct', 'Indirect', 'None']
+QT_RELATIONSHIP_WEIGHTS = [0.15, 0.25, 0.60]
+
+# Create upload folder if it doesn't exist
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Global variables
+snapshot = None  # current DataSnapshot, replaced wholesale by publish_snapshot()
+
+def allowed_file(filename):
+    """Check if file extension is allowed"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    """Prometheus label set text, e.g. {route="/api/search",status="200"}"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    """Cumulative histogram in the Prometheus exposition format, one series
+    per combination of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Per-bucket counts, an overflow slot for +Inf, then sum and count
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((values, list(series)) for values, series in self._series.items())
+        for values, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, values, le)} {cumulative}")
+            labels = format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class CounterMetric:
+    """Monotonic counter in the Prometheus exposition format"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{format_labels(self.label_names, values)} {count}" for values, count in items)
+        return lines
+
+request_latency = Histogram('http_request_duration_seconds', 'Time spent handling a request.',
+                            ('route', 'method', 'status'), LATENCY_BUCKETS)
+response_size = Histogram('http_response_size_bytes', 'Size of response bodies as sent.',
+                          ('route',), SIZE_BUCKETS)
+sync_phase_seconds = Histogram('sync_phase_duration_seconds',
+                               'Time spent in each phase of a profiles sync.', ('phase',), PHASE_BUCKETS)
+index_build_seconds = Histogram('snapshot_index_build_duration_seconds',
+                                'Time spent building each snapshot index.', ('index',), PHASE_BUCKETS)
+sync_runs = CounterMetric('sync_runs_total', 'Profiles syncs by outcome.', ('status',))
+sharepoint_retries = CounterMetric('sharepoint_request_retries_total',
+                                   'SharePoint requests retried, by what went wrong.', ('reason',))
+
+@contextmanager
+def timed_phase(phase):
+    """Record the duration of the enclosed block as a sync phase"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sync_phase_seconds.observe(time.perf_counter() - started, phase)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Registered before compress_response, so it runs after it and sees the
+# compressed size
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        size = response.content_length
+        if size is None and not (response.is_streamed or response.direct_passthrough):
+            size = response.calculate_content_length()
+        if size is not None:
+            response_size.observe(size, route)
+    return response
+
+def process_memory_bytes():
+    """Resident set size of this process, or None where it cannot be read"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def gauge_lines(name, help_text, value, metric_type='gauge'):
+    if value is None:
+        return []
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    snap = snapshot
+    lines = []
+    for metric in (request_latency, response_size, sync_phase_seconds, index_build_seconds, sync_runs,
+                   sharepoint_retries):
+        lines.extend(metric.render())
+
+    lines += gauge_lines('snapshot_version', 'Version of the published snapshot.', snap.version)
+    lines += gauge_lines('snapshot_employees', 'Employees in the published snapshot.', len(snap.records))
+    lines += gauge_lines('snapshot_org_roots', 'Top-level people in the org index.', len(snap.org_index.roots))
+    lines += gauge_lines('snapshot_search_trigrams', 'Distinct trigrams in the search index.',
+                         len(snap.search_index.trigrams))
+    lines += gauge_lines('snapshot_json_fragments', 'Record JSON fragments cached on the snapshot.',
+                         len(snap.fragments))
+    lines += gauge_lines('snapshot_fuzzy_index_ready', 'Whether the fuzzy name index has been built.',
+                         int(snap._fuzzy_index is not None))
+    if snap.last_sync:
+        lines += gauge_lines('snapshot_age_seconds', 'Seconds since the snapshot was loaded from the source.',
+                             round((datetime.now() - snap.last_sync).total_seconds(), 3))
+    if os.path.exists(SNAPSHOT_CACHE_PATH):
+        lines += gauge_lines('snapshot_cache_file_bytes', 'Size of the on-disk snapshot cache.',
+                             os.path.getsize(SNAPSHOT_CACHE_PATH))
+    lines += gauge_lines('process_resident_memory_bytes', 'Resident memory size in bytes.', process_memory_bytes())
+    lines += gauge_lines('process_threads', 'Live Python threads.', threading.active_count())
+
+    cache = response_cache.report()
+    for stat in ('hits', 'misses', 'not_modified', 'evictions', 'invalidations'):
+        lines += gauge_lines(f'response_cache_{stat}_total', f'Response cache {stat.replace("_", " ")}.',
+                             cache[stat], 'counter')
+    lines += gauge_lines('response_cache_entries', 'Entries held by the response cache.', cache['entries'])
+    lines += gauge_lines('response_cache_hit_ratio', 'Response cache hits per lookup.', cache['hit_ratio'])
+
+    store = connection_store.report()
+    lines += gauge_lines('connection_store_committed_total', 'Connections committed to the store.',
+                         store['committed'], 'counter')
+    lines += gauge_lines('connection_store_batches_total', 'Connection store batches committed.',
+                         store['batches'], 'counter')
+    lines += gauge_lines('connection_store_write_errors_total', 'Connection store batches that failed to commit.',
+                         store['write_errors'], 'counter')
+    lines += gauge_lines('connection_store_pending', 'Connections queued but not yet committed.', store['pending'])
+    lines += gauge_lines('connection_store_failing', 'Whether connection writes are failing and being retried.',
+                         int(store['last_error'] is not None))
+    lines += gauge_lines('profiler_running', 'Whether the sampling profiler is running.', int(profiler.running))
+    return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads on a timer while running.
+
+    Stacks are kept as collapsed "outer;inner" lines with sample counts, the
+    input format of flame graph tools. Only function names and files are
+    recorded, so the number of distinct stacks stays small.
+    """
+
+    MAX_STACKS = 20000
+
+    def __init__(self):
+        self.samples = Counter()
+        self.interval = None
+        self.started_at = None
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005):
+        """Start sampling every interval seconds; False if already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self.samples = Counter()
+            self.sample_count = 0
+            self.interval = interval
+            self.started_at = datetime.now()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling, keeping the samples collected so far"""
+        with self._lock:
+            self._stop.set()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                if key in self.samples or len(self.samples) < self.MAX_STACKS:
+                    self.samples[key] += 1
+            self.sample_count += 1
+
+    def report(self, limit=50):
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000 if self.interval else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'samples': self.sample_count,
+            'top_stacks': [{'stack': stack, 'count': count} for stack, count in self.samples.most_common(limit)]
+        }
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+profiler = SamplingProfiler()
+
+# SharePoint client
+SHAREPOINT_MAX_RETRIES = int(os.environ.get('SHAREPOINT_MAX_RETRIES', 4))
+SHAREPOINT_BACKOFF_SECONDS = float(os.environ.get('SHAREPOINT_BACKOFF_SECONDS', 0.5))
+SHAREPOINT_BACKOFF_MAX_SECONDS = 30.0
+SHAREPOINT_TIMEOUT = (10, 60)  # connect, read (seconds)
+# The load at startup blocks the import, so it makes one attempt with these
+SHAREPOINT_STARTUP_TIMEOUT = (3, 30)
+SHAREPOINT_POOL_SIZE = 8
+SHAREPOINT_DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+# Access tokens are renewed this long before they expire
+SHAREPOINT_TOKEN_MARGIN_SECONDS = 120
+# Statuses worth retrying: timeouts, throttling and server errors
+SHAREPOINT_RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+class SharePointError(IOError):
+    """A SharePoint request that failed for good"""
+
+class SharePointClient:
+    """SharePoint REST client shared by every SharePoint source and thread.
+
+    All requests go through one pooled requests session and one set of
+    credentials, renewed early when a request is rejected with 401. With
+    auth='user' (the default) the credentials are the session cookie from a
+    SharePoint username/password sign-in; with auth='oauth' they are an
+    Azure AD access token, cached until shortly before it expires and renewed
+    with the refresh token when there is one. Connection errors, timeouts, throttling and server
+    errors are retried up to max_retries times with jittered exponential
+    backoff, honouring Retry-After. Downloads stream to disk chunk by chunk
+    and resume with a Range request when the connection drops.
+
+    site_url and token_url may point at a local HTTP stand-in (with
+    auth='oauth'); it needs to answer the token POST and the two
+    GetFileByServerRelativeUrl requests.
+    """
+
+    def __init__(self, site_url, token_url, credentials, auth='user', max_retries=SHAREPOINT_MAX_RETRIES,
+                 backoff=SHAREPOINT_BACKOFF_SECONDS, pool_size=SHAREPOINT_POOL_SIZE,
+                 chunk_bytes=SHAREPOINT_DOWNLOAD_CHUNK_BYTES):
+        if auth not in ('user', 'oauth'):
+            raise ValueError(f"Unknown SharePoint auth {auth!r}; expected 'user' or 'oauth'")
+        self.site_url = site_url.rstrip('/')
+        self.token_url = token_url
+        self.credentials = credentials
+        self.auth = auth
+        self.max_retries = max_retries
+        self.timeout = SHAREPOINT_TIMEOUT
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.chunk_bytes = chunk_bytes
+        self.sleep = time.sleep
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._token = None
+        self._token_lock = threading.Lock()
+
+    def session(self):
+        """The pooled session, created on first use"""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def auth_headers(self, rejected=None):
+        """Headers that authenticate a request, fetched or renewed as needed;
+        rejected is a set of headers the server refused, which is renewed
+        unless another thread already has"""
+        with self._token_lock:
+            token = self._token
+            if token and token['headers'] != rejected and time.monotonic() < token['renew_at']:
+                return token['headers']
+            with timed_phase('auth'):
+                if self.auth == 'user':
+                    self._token = self._sign_in()
+                else:
+                    self._token = self._fetch_token(token and token.get('refresh_token'))
+            return self._token['headers']
+
+    def _sign_in(self):
+        # The SharePoint sign-in cookie has no expiry we can read, so it is
+        # kept until a request is rejected
+        from office365.runtime.auth.authentication_context import AuthenticationContext
+        from office365.runtime.http.request_options import RequestOptions
+        context = AuthenticationContext(self.site_url)
+        context.acquire_token_for_user(self.credentials['username'], self.credentials['password'])
+        request = RequestOptions(self.site_url)
+        try:
+            context.authenticate_request(request)
+        except Exception as e:
+            raise SharePointError(f"Authentication failed: {e}") from e
+        return {'headers': {'Cookie': request.headers['Cookie']}, 'renew_at': math.inf}
+
+    def _fetch_token(self, refresh_token=None):
+        site = urlsplit(self.site_url)
+        form = {'client_id': self.credentials['client_id'], 'scope': f"{site.scheme}://{site.netloc}/.default"}
+        if self.credentials.get('client_secret'):
+            form['client_secret'] = self.credentials['client_secret']
+        if refresh_token:
+            form.update(grant_type='refresh_token', refresh_token=refresh_token)
+        else:
+            form.update(grant_type='password', username=self.credentials['username'],
+                        password=self.credentials['password'])
+
+        response = self.send('POST', self.token_url, authenticate=False, data=form)
+        with response:
+            if response.status_code != 200:
+                if refresh_token:
+                    # Expired or revoked; start over from the credentials
+                    return self._fetch_token()
+                raise SharePointError(f"Authentication failed with status {response.status_code}")
+            body = response.json()
+        expires_in = int(body.get('expires_in', 3600))
+        return {
+            'headers': {'Authorization': f"Bearer {body['access_token']}"},
+            'refresh_token': body.get('refresh_token'),
+            'renew_at': time.monotonic() + max(expires_in - SHAREPOINT_TOKEN_MARGIN_SECONDS, expires_in / 2)
+        }
+
+    @contextmanager
+    def single_attempt(self, timeout=SHAREPOINT_STARTUP_TIMEOUT):
+        """Within the block, requests are not retried and use a shorter
+        timeout. This changes the client for every thread, so it is only for
+        startup, before the sync worker and request threads use it."""
+        saved = self.max_retries, self.timeout
+        self.max_retries, self.timeout = 0, timeout
+        try:
+            yield self
+        finally:
+            self.max_retries, self.timeout = saved
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry attempt (0-based): the server's
+        Retry-After when given, else a random delay of up to backoff * 2**attempt"""
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), SHAREPOINT_BACKOFF_MAX_SECONDS)
+        return random.uniform(0, min(self.backoff * 2 ** attempt, SHAREPOINT_BACKOFF_MAX_SECONDS))
+
+    def send(self, method, url, authenticate=True, headers=None, **kwargs):
+        """Response to a request, retrying transient failures.
+
+        Responses with other error statuses are returned for the caller to
+        handle; SharePointError is raised once the retries run out.
+        """
+        import requests
+        attempt = 0
+        renewed = False
+        while True:
+            request_headers = dict(headers or {})
+            credentials = None
+            if authenticate:
+                credentials = self.auth_headers()
+                request_headers.update(credentials)
+            retry_after = None
+            try:
+                response = self.session().request(method, url, headers=request_headers,
+                                                  timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, reason = e, type(e).__name__
+            else:
+                if response.status_code == 401 and authenticate and not renewed:
+                    response.close()
+                    self.auth_headers(rejected=credentials)
+                    renewed = True
+                    continue
+                if response.status_code not in SHAREPOINT_RETRY_STATUSES:
+                    return response
+                error, reason = f"status {response.status_code}", str(response.status_code)
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+
+            if attempt >= self.max_retries:
+                raise SharePointError(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+            sharepoint_retries.inc(reason)
+            logger.warning(f"SharePoint {method} {url} failed ({error}), retrying")
+            self.sleep(self.backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def file_url(self, server_relative_path):
+        escaped = quote(server_relative_path.replace("'", "''"), safe="/'")
+        return f"{self.site_url}/_api/web/GetFileByServerRelativeUrl('{escaped}')"
+
+    def file_properties(self, server_relative_path):
+        """ETag and TimeLastModified of a file"""
+        response = self.send('GET', self.file_url(server_relative_path) + '?$select=ETag,TimeLastModified',
+                             headers={'Accept': 'application/json;odata=nometadata'})
+        with response:
+            if response.status_code != 200:
+                raise SharePointError(f"Could not read {server_relative_path}: status {response.status_code}")
+            return response.json()
+
+    def download(self, server_relative_path, dest_path):
+        """Stream a file to dest_path; returns dest_path.
+
+        The file is written under a temporary name and renamed when
+        complete, so dest_path never holds a partial download.
+        """
+        import requests
+        url = self.file_url(server_relative_path) + '/$value'
+        partial_path = dest_path + '.part'
+        written = 0
+        interruptions = 0
+        try:
+            with open(partial_path, 'wb') as output:
+                while True:
+                    headers = {'Range': f"bytes={written}-"} if written else None
+                    with self.send('GET', url, headers=headers, stream=True) as response:
+                        if response.status_code == 200:
+                            if written:
+                                # The server ignored the Range header and sent it all again
+                                output.seek(0)
+                                output.truncate()
+                                written = 0
+                        elif response.status_code != 206 or \
+                                not response.headers.get('Content-Range', '').startswith(f"bytes {written}-"):
+                            raise SharePointError(
+                                f"Could not download {server_relative_path}: status {response.status_code}")
+                        length = response.headers.get('Content-Length')
+                        expected = written + int(length) if length and length.isdigit() else None
+                        try:
+                            for chunk in response.iter_content(self.chunk_bytes):
+                                output.write(chunk)
+                                written += len(chunk)
+                            if expected is not None and written < expected:
+                                raise requests.ConnectionError(f"closed after {written} of {expected} bytes")
+                        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                            if interruptions >= self.max_retries:
+                                raise SharePointError(
+                                    f"Download of {server_relative_path} kept failing: {e}") from e
+                            sharepoint_retries.inc('interrupted_download')
+                            logger.warning(f"Download of {server_relative_path} interrupted at {written} bytes")
+                            self.sleep(self.backoff_delay(interruptions))
+                            interruptions += 1
+                            continue
+                    break
+            os.replace(partial_path, dest_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return dest_path
+
+sharepoint_client = SharePointClient(
+    SHAREPOINT_CONFIG['site_url'],
+    SHAREPOINT_CONFIG['token_url'] or
+    f"https://login.microsoftonline.com/{SHAREPOINT_CONFIG['tenant_id']}/oauth2/v2.0/token",
+    SHAREPOINT_CONFIG,
+    auth=SHAREPOINT_CONFIG['auth']
+)
+
+class SharePointFileSource:
+    """Profiles workbook on SharePoint, fetched through sharepoint_client"""
+
+    name = 'SharePoint'
+
+    def __init__(self, file_path, sheet=None, client=None):
+        self.file_path = file_path
+        self.sheet = sheet
+        self.client = client or sharepoint_client
+
+    def stamp(self):
+        """ETag (or last-modified time) of the remote file"""
+        properties = self.client.file_properties(self.file_path)
+        return properties.get('ETag') or properties.get('TimeLastModified')
+
+    def download(self, dest_path):
+        """Stream the file to dest_path"""
+        logger.info(f"Attempting to download file: {self.file_path}")
+        self.client.download(self.file_path, dest_path)
+        logger.info(f"Successfully downloaded SharePoint file to: {dest_path}")
+        return dest_path
+
+class LocalFileSource:
+    """Profiles workbook on local disk, a stand-in for SharePoint"""
+
+    name = 'Local File'
+
+    def __init__(self, file_path, sheet=None):
+        self.file_path = file_path
+        self.sheet = sheet
+
+    def stamp(self):
+        """Modification time and size of the file"""
+        stat = os.stat(self.file_path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def download(self, dest_path):
+        """Copy the file to dest_path"""
+        shutil.copyfile(self.file_path, dest_path)
+        return dest_path
+
+def parse_source_spec(spec):
+    """Profiles source for one PROFILES_SOURCES entry"""
+    location, _, sheet = spec.strip().partition('#')
+    if location.startswith('sharepoint:'):
+        return SharePointFileSource(location[len('sharepoint:'):], sheet or None)
+    return LocalFileSource(location, sheet or None)
+
+def source_label(source, sheet=None):
+    """Short name of a source (or one sheet of it) in logs and merge reports"""
+    label = f"{source.name}:{os.path.basename(source.file_path)}"
+    sheet = sheet or source.sheet
+    return f"{label}#{sheet}" if sheet else label
+
+if PROFILES_SOURCES.strip():
+    profile_sources = [parse_source_spec(spec) for spec in PROFILES_SOURCES.split(';') if spec.strip()]
+    if not profile_sources:
+        logger.error(f"PROFILES_SOURCES={PROFILES_SOURCES!r} lists no sources; syncs will fail until it does")
+elif PROFILES_SOURCE_FILE:
+    profile_sources = [LocalFileSource(PROFILES_SOURCE_FILE)]
+else:
+    profile_sources = [SharePointFileSource(SHAREPOINT_CONFIG['direct_file_path'])]
+
+# Column mapping for flexible Excel structure
+COLUMN_MAPPING = {
+    'name': ['Name', 'Full Name', 'Employee Name', 'name', 'employee_name'],
+    'position': ['Position', 'Title', 'Job Title', 'Role', 'position', 'job_title'],
+    'department': ['Department', 'Dept', 'Division', 'Team', 'department'],
+    'country': ['Country', 'Nation', 'country'],
+    'location_input': ['Location', 'City', 'Office', 'Site', 'location'],
+    'manager_name': ['Manager', 'Manager Name', 'Reports To', 'manager', 'manager_name'],
+    'ldap': ['LDAP', 'Email', 'Username', 'Login', 'ldap', 'email'],
+    'phone': ['Phone', 'Mobile', 'Contact', 'phone_number'],
+    'hire_date': ['Hire Date', 'Start Date', 'Join Date', 'hire_date'],
+    'employee_id': ['ID', 'Employee ID', 'EmpID', 'employee_id']
+}
+
+# Fields that read as 'Unknown' instead of '' when the cell is empty
+UNKNOWN_DEFAULT_FIELDS = {'department', 'position', 'country', 'location_input'}
+NULL_TOKENS = ['nan', 'none', 'null']
+
+def resolve_columns(columns):
+    """Map each standard field to the first matching spreadsheet column"""
+    columns = set(columns)
+    resolved = {}
+    for standard_name, possible_names in COLUMN_MAPPING.items():
+        resolved[standard_name] = next((name for name in possible_names if name in columns), None)
+    return resolved
+
+def normalize_column(series, default):
+    """Normalize one spreadsheet column to stripped strings.
+
+    Empty cells, NaN and the 'nan'/'none'/'null' tokens become default; other
+    falsy values (0, False) become ''.
+    """
+    text = series.map(str, na_action='ignore')
+    missing = series.isna() | (text == '') | text.str.lower().isin(NULL_TOKENS)
+    falsy = ~series.fillna(True).astype(bool)
+    text = text.where(~missing, default).where(~falsy | missing, '')
+    return text.fillna(default).str.strip()
+
+# Employee records
+STORED_FIELDS = (
+    'name', 'position', 'department', 'country', 'location_input', 'manager_name', 'ldap',
+    'phone', 'hire_date', 'employee_id', 'representative_from_qt', 'relationship_with_qt',
+    'time_of_run'
+)
+DERIVED_FIELDS = ('moma_url', 'moma_photo_url', 'manager_name_input', 'manager_email')
+RECORD_FIELDS = STORED_FIELDS[:12] + DERIVED_FIELDS + ('time_of_run',)
+_RECORD_FIELD_SET = frozenset(RECORD_FIELDS)
+
+# Low-cardinality fields whose values are shared between records
+INTERNED_FIELDS = frozenset({
+    'position', 'department', 'country', 'location_input', 'manager_name',
+    'representative_from_qt', 'relationship_with_qt', 'time_of_run'
+})
+
+class Employee:
+    """One employee record, stored compactly.
+
+    Reads like the dict records it replaces (``person['name']``,
+    ``person.get(...)``). Repeated categorical strings are interned so records
+    share them, and the MOMA URLs and manager e-mail are derived on access
+    instead of being stored.
+    """
+
+    __slots__ = STORED_FIELDS
+
+    def __init__(self, name='', position='', department='', country='', location_input='',
+                 manager_name='', ldap='', phone='', hire_date='', employee_id='',
+                 representative_from_qt='', relationship_with_qt='', time_of_run=''):
+        self.name = name
+        self.position = position
+        self.department = department
+        self.country = country
+        self.location_input = location_input
+        self.manager_name = manager_name
+        self.ldap = ldap
+        self.phone = phone
+        self.hire_date = hire_date
+        self.employee_id = employee_id
+        self.representative_from_qt = representative_from_qt
+        self.relationship_with_qt = relationship_with_qt
+        self.time_of_run = time_of_run
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from a dict, interning its categorical values"""
+        values = {}
+        for field in STORED_FIELDS:
+            value = str(data.get(field) or '')
+            values[field] = sys.intern(value) if field in INTERNED_FIELDS else value
+        return cls(**values)
+
+    @property
+    def moma_url(self):
+        return f"https://moma.corp.company.com/person/{self.ldap}"
+
+    @property
+    def moma_photo_url(self):
+        return f"https://moma.corp.company.com/photos/{self.ldap}.jpg"
+
+    @property
+    def manager_name_input(self):
+        return self.manager_name
+
+    @property
+    def manager_email(self):
+        if not self.manager_name:
+            return ''
+        return f"{self.manager_name.lower().replace(' ', '.')}@company.com"
+
+    def __getitem__(self, key):
+        if key not in _RECORD_FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in STORED_FIELDS:
+            raise KeyError(f"{key} is not a stored field")
+        setattr(self, key, sys.intern(value) if key in INTERNED_FIELDS else value)
+
+    def __contains__(self, key):
+        return key in _RECORD_FIELD_SET
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self):
+        return len(RECORD_FIELDS)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in _RECORD_FIELD_SET else default
+
+    def keys(self):
+        return RECORD_FIELDS
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in RECORD_FIELDS]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+    def to_tuple(self):
+        """Stored fields only, in STORED_FIELDS order"""
+        return tuple(getattr(self, field) for field in STORED_FIELDS)
+
+    def replace(self, **changes):
+        """Copy of the record with some stored fields changed"""
+        person = Employee(*self.to_tuple())
+        for field, value in changes.items():
+            person[field] = value
+        return person
+
+    def __repr__(self):
+        return f"Employee({self.name!r}, ldap={self.ldap!r})"
+
+def fill_missing_ldaps(records):
+    """Give records without an LDAP one made from the name: first.last, or
+    the whole name. Runs after sources are merged, so a made-up LDAP never
+    stops a record from matching its row in another sheet."""
+    for person in records:
+        name = person['name']
+        if not person['ldap'] and name:
+            parts = name.lower().split()
+            person['ldap'] = f"{parts[0]}.{parts[-1]}" if len(parts) >= 2 else name.lower().replace(' ', '.')
+    return records
+
+def normalize_dataframe(df):
+    """Turn a profiles sheet into employee records, one column at a time.
+
+    Returns the records and the seconds spent in each stage.
+    """
+    import pandas as pd
+    timings = {}
+    started = time.perf_counter()
+    resolved = resolve_columns(df.columns)
+    timings['resolve'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    out = {}
+    for standard_name, column in resolved.items():
+        default = 'Unknown' if standard_name in UNKNOWN_DEFAULT_FIELDS else ''
+        if column is None:
+            out[standard_name] = pd.Series(default, index=df.index, dtype=object)
+        else:
+            out[standard_name] = normalize_column(df[column], default)
+    timings['normalize'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Randomly assign QT representative and relationship
+    out['representative_from_qt'] = random.choices(QT_REPRESENTATIVES, k=len(df))
+    out['relationship_with_qt'] = random.choices(
+        QT_RELATIONSHIPS,
+        weights=QT_RELATIONSHIP_WEIGHTS,
+        k=len(df)
+    )
+
+    # MOMA URLs and manager fields are derived by Employee when read
+    out['time_of_run'] = [datetime.now().strftime('%Y-%m-%d')] * len(df)
+    timings['derive'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = []
+    for field in STORED_FIELDS:
+        column = out[field]
+        if isinstance(column, pd.Series):
+            column = column.tolist()
+        if field in INTERNED_FIELDS:
+            column = list(map(sys.intern, column))
+        columns.append(column)
+    records = [Employee(*values) for values in zip(*columns)]
+    timings['emit'] = time.perf_counter() - started
+
+    logger.info("Ingestion stages: " + ", ".join(
+        f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+    return records, timings
+
+# Streaming profiles reader
+PROFILE_READ_CHUNK_ROWS = 1000
+
+def iter_sheet_rows(source, is_csv, sheet=None):
+    """Rows of a .csv, or of a sheet of an .xlsx (the first unless sheet
+    names one), as sequences of cell values; source is a path or a binary
+    file object"""
+    if is_csv:
+        if isinstance(source, str):
+            with open(source, newline='', encoding='utf-8-sig') as text:
+                yield from csv.reader(text)
+        else:
+            yield from csv.reader(io.TextIOWrapper(source, encoding='utf-8-sig', newline=''))
+        return
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def workbook_sheet_names(path):
+    """Names of the sheets of an .xlsx, in workbook order"""
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+def sheet_columns(header):
+    """Position of each standard field's column in a header row, or None"""
+    positions = {}
+    for position, title in enumerate(header or ()):
+        if title is not None:
+            positions.setdefault(str(title), position)
+    return {field: positions.get(column) for field, column in resolve_columns(positions).items()}
+
+def normalize_cell(value, default):
+    """normalize_column for a single cell"""
+    if value is None or value != value:
+        return default
+    text = str(value)
+    if text == '' or text.lower() in NULL_TOKENS:
+        return default
+    if not value:
+        return ''
+    return text.strip()
+
+def cell(row, position):
+    return row[position] if position is not None and position < len(row) else None
+
+def is_blank_row(row):
+    return all(value is None or value == '' for value in row)
+
+def read_profile_rows(path, sheet=None):
+    """Employee records read straight from a profiles sheet, without pandas.
+
+    Gives the same records as normalize_dataframe(pd.read_excel(path)), but
+    cells keep the text they hold instead of going through pandas' type
+    inference (which turns the text '0' into an empty field and whole
+    numbers in columns with gaps into floats), and blank rows are skipped.
+    Rows are handled a chunk at a time, so only the records and one chunk of
+    rows are held in memory. Returns the records and the seconds spent
+    reading and normalizing.
+    """
+    timings = {'read': 0.0, 'normalize': 0.0}
+    started = time.perf_counter()
+    rows = iter_sheet_rows(path, path.lower().endswith('.csv'), sheet)
+    header = next(rows, None)
+    # COLUMN_MAPPING lists the first Employee fields, in order
+    columns = [(position, 'Unknown' if field in UNKNOWN_DEFAULT_FIELDS else '', field in INTERNED_FIELDS)
+               for field, position in sheet_columns(header).items()]
+    time_of_run = sys.intern(datetime.now().strftime('%Y-%m-%d'))
+    records = []
+    timings['read'] += time.perf_counter() - started
+
+    while True:
+        started = time.perf_counter()
+        chunk = list(islice(rows, PROFILE_READ_CHUNK_ROWS))
+        timings['read'] += time.perf_counter() - started
+        if not chunk:
+            break
+
+        started = time.perf_counter()
+        chunk = [row for row in chunk if not is_blank_row(row)]
+        representatives = random.choices(QT_REPRESENTATIVES, k=len(chunk))
+        relationships = random.choices(QT_RELATIONSHIPS, weights=QT_RELATIONSHIP_WEIGHTS, k=len(chunk))
+        for row, representative, relationship in zip(chunk, representatives, relationships):
+            values = []
+            for position, default, interned in columns:
+                value = normalize_cell(cell(row, position), default)
+                values.append(sys.intern(value) if interned else value)
+            records.append(Employee(*values, representative, relationship, time_of_run))
+        timings['normalize'] += time.perf_counter() - started
+
+    sheet_name = f"{os.path.basename(path)}#{sheet}" if sheet else os.path.basename(path)
+    logger.info(f"Streamed {len(records)} rows from {sheet_name}: " + ", ".join(
+        f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+    return records, timings
+
+def read_profiles(path, sheet=None):
+    """Employee records and stage timings from a downloaded profiles file.
+
+    Missing LDAPs are left empty here; fill_missing_ldaps makes them up once
+    every source is merged.
+    """
+    if PROFILE_READER != 'pandas':
+        return read_profile_rows(path, sheet)
+
+    import pandas as pd
+    started = time.perf_counter()
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path, sheet_name=sheet or 0)
+    read_seconds = time.perf_counter() - started
+    logger.info(f"Loaded Excel file with {len(df)} rows and columns: {list(df.columns)}")
+    records, timings = normalize_dataframe(df)
+    timings['read'] = read_seconds
+    return records, timings
+
+# Snapshots and sync
+class DataSnapshot:
+    """Employee records plus the indexes derived from them.
+
+    A snapshot is never modified after it is published; a sync builds a new
+    one and swaps the module-level reference in a single assignment, so a
+    request that reads ``snapshot`` once sees consistent data throughout.
+    """
+
+    def __init__(self, records, version, source, last_sync=None, timings=None, indexes=None):
+        self.records = records
+        self.version = version
+        self.source = source
+        self.last_sync = last_sync
+        self.timings = dict(timings or {})
+        self.fragments = JsonFragmentCache()
+        # (device, inode) of the snapshot cache file the records are views of
+        self.cache_file = None
+        self._fuzzy_index = None
+        self._fuzzy_lock = threading.Lock()
+        self._intro_index = None
+        self._intro_lock = threading.Lock()
+        if indexes is not None:
+            self.__dict__.update(indexes)
+            return
+        for attribute, index_type in SNAPSHOT_INDEXES.items():
+            started = time.perf_counter()
+            setattr(self, attribute, index_type(records))
+            self.timings[attribute] = time.perf_counter() - started
+            index_build_seconds.observe(self.timings[attribute], attribute)
+        logger.info(f"Built snapshot v{version}: search index over {len(records)} employees "
+                    f"({len(self.search_index.trigrams)} trigrams), "
+                    f"org index with {len(self.org_index.roots)} roots")
+
+    @property
+    def fuzzy_index(self):
+        """Typo-tolerant name index, built on first use"""
+        if self._fuzzy_index is None:
+            with self._fuzzy_lock:
+                if self._fuzzy_index is None:
+                    started = time.perf_counter()
+                    self._fuzzy_index = FuzzyNameIndex(self.records)
+                    index_build_seconds.observe(time.perf_counter() - started, 'fuzzy_index')
+                    logger.info(f"Built fuzzy index for snapshot v{self.version} over "
+                                f"{len(self._fuzzy_index.tokens)} name tokens "
+                                f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return self._fuzzy_index
+
+    @property
+    def intro_index(self):
+        """Warm-introduction path index, built on first use"""
+        if self._intro_index is None:
+            with self._intro_lock:
+                if self._intro_index is None:
+                    started = time.perf_counter()
+                    self._intro_index = IntroPathIndex(self.org_index)
+                    index_build_seconds.observe(time.perf_counter() - started, 'intro_index')
+                    logger.info(f"Built intro path index for snapshot v{self.version} "
+                                f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return self._intro_index
+
+    def warm_lazy_indexes(self):
+        """Build the fuzzy and intro path indexes on a background thread"""
+        def build():
+            self.fuzzy_index
+            self.intro_index
+        threading.Thread(target=build, name='lazy-indexes', daemon=True).start()
+
+_publish_lock = threading.Lock()
+
+# Shared snapshot layout
+#
+# The snapshot cache holds records and indexes as flat buffers: int arrays,
+# UTF-8 string tables with end offsets, and lists of int lists in CSR form.
+# A process reading the cache uses them in place, through memoryviews of the
+# read-only mapped file, so every worker mapping the same file shares one
+# copy of the data in the page cache. The classes below stand in for the
+# lists and dicts an index is built with, supporting the read-only protocol
+# the index code uses on them.
+
+def array_copy(typecode, values):
+    """Writable array with the items of values: a list, an array or a
+    memoryview of one"""
+    copy = array(typecode)
+    if isinstance(values, memoryview):
+        copy.frombytes(values.cast('B'))
+    else:
+        copy.extend(values)
+    return copy
+
+def int_typecode(values):
+    """Smallest of 'i' and 'q' that holds every int in values, or None"""
+    low, high = min(values, default=0), max(values, default=0)
+    if -2 ** 31 <= low and high < 2 ** 31:
+        return 'i'
+    if -2 ** 63 <= low and high < 2 ** 63:
+        return 'q'
+    return None
+
+def is_int_sequence(value):
+    return (isinstance(value, (array, memoryview)) or
+            isinstance(value, (list, tuple)) and all(type(item) is int for item in value))
+
+class StringTable(Sequence):
+    """Read-only list of strings held as one UTF-8 buffer and the end offset
+    of each string; items are decoded when read"""
+
+    __slots__ = ('ends', 'data')
+
+    def __init__(self, ends, data):
+        self.ends = ends
+        self.data = data
+
+    @classmethod
+    def build(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        return cls(array('q', accumulate(map(len, encoded))), b''.join(encoded))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.ends)
+            if i < 0:
+                raise IndexError('string table index out of range')
+        return str(self.data[self.ends[i - 1] if i else 0:self.ends[i]], 'utf-8')
+
+    def __iter__(self):
+        data, start = self.data, 0
+        for end in self.ends:
+            yield str(data[start:end], 'utf-8')
+            start = end
+
+class CodedStrings(Sequence):
+    """Read-only list of strings drawn from a few distinct values, held as
+    one value code per item"""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self, values, codes):
+        self.values = values
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+class ListTable(Sequence):
+    """Read-only list of int lists in CSR form: item i is the slice of items
+    between ends[i - 1] and ends[i].
+
+    Assigning an item records the new list in an overlay, and copy() shares
+    the buffers, so a copy with a few items changed costs only the overlay.
+    """
+
+    __slots__ = ('ends', 'items', 'replaced')
+
+    def __init__(self, ends, items, replaced=None):
+        self.ends = ends
+        self.items = items
+        self.replaced = replaced
+
+    @classmethod
+    def build(cls, lists, typecode):
+        ends, items = array('q'), array(typecode)
+        for values in lists:
+            if isinstance(values, array) and values.typecode != typecode:
+                values = values.tolist()
+            items.extend(values)
+            ends.append(len(items))
+        return cls(ends, items)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if self.replaced:
+            values = self.replaced.get(i)
+            if values is not None:
+                return values
+        if i < 0:
+            i += len(self.ends)
+            if i < 0:
+                raise IndexError('list table index out of range')
+        return self.items[self.ends[i - 1] if i else 0:self.ends[i]]
+
+    def __setitem__(self, i, values):
+        if self.replaced is None:
+            self.replaced = {}
+        self.replaced[i] = values
+
+    def copy(self):
+        return ListTable(self.ends, self.items, dict(self.replaced or {}))
+
+class StringKeyMap(Mapping):
+    """Read-only mapping from strings to the items of values (an int array
+    or a ListTable).
+
+    The keys are a StringTable indexed by an open-addressing hash table:
+    slots holds key positions plus one (0 when empty), starting at the
+    CRC-32 of the UTF-8 key and probing linearly. CRC-32 rather than hash()
+    gives the same table in every process.
+    """
+
+    __slots__ = ('keys_table', 'values', 'slots')
+
+    def __init__(self, keys_table, values, slots):
+        self.keys_table = keys_table
+        self.values = values
+        self.slots = slots
+
+    @classmethod
+    def build(cls, keys, values):
+        keys_table = StringTable.build(keys)
+        # At most two thirds full
+        size = 1 << (len(keys) + len(keys) // 2).bit_length()
+        slots, mask = array('i', bytes(4 * size)), size - 1
+        for position, key in enumerate(keys):
+            slot = zlib.crc32(key.encode('utf-8')) & mask
+            while slots[slot]:
+                slot = slot + 1 & mask
+            slots[slot] = position + 1
+        return cls(keys_table, values, slots)
+
+    def _find(self, key):
+        """Position of key in keys_table, or -1"""
+        if type(key) is not str:
+            return -1
+        encoded = key.encode('utf-8')
+        slots, mask = self.slots, len(self.slots) - 1
+        ends, data = self.keys_table.ends, self.keys_table.data
+        slot = zlib.crc32(encoded) & mask
+        while position := slots[slot]:
+            position -= 1
+            if data[ends[position - 1] if position else 0:ends[position]] == encoded:
+                return position
+            slot = slot + 1 & mask
+        return -1
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self.values[position]
+
+    def get(self, key, default=None):
+        position = self._find(key)
+        return self.values[position] if position >= 0 else default
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        return iter(self.keys_table)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+    def items(self):
+        return zip(self.keys_table, self.values)
+
+class RecordTable(Sequence):
+    """Employee records held by column, one CodedStrings or StringTable per
+    STORED_FIELDS field; a record is built when it is read"""
+
+    __slots__ = ('columns', '_readers')
+
+    def __init__(self, columns):
+        self.columns = columns
+        # The buffers of each column, read inline by __getitem__
+        self._readers = [(column.values, column.codes, None, None) if isinstance(column, CodedStrings)
+                         else (None, None, column.ends, column.data) for column in columns]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return Employee(*[values[codes[i]] if values is not None
+                          else str(data[ends[i - 1] if i else 0:ends[i]], 'utf-8')
+                          for values, codes, ends, data in self._readers])
+
+    def __iter__(self):
+        return (Employee(*values) for values in zip(*self.columns))
+
+class PatchedRecords(Sequence):
+    """Records with a few of them replaced ({position: record}), sharing
+    the rest with the records they were copied from"""
+
+    __slots__ = ('base', 'replaced')
+
+    def __init__(self, base, replaced):
+        if isinstance(base, PatchedRecords):
+            base, replaced = base.base, {**base.replaced, **replaced}
+        self.base = base
+        self.replaced = replaced
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        person = self.replaced.get(i)
+        return self.base[i] if person is None else person
+
+    def __iter__(self):
+        replaced = self.replaced
+        for i, person in enumerate(self.base):
+            yield replaced.get(i, person)
+
+class ReorderedRecords(Sequence):
+    """records[order[i]] for every i, without copying the records"""
+
+    __slots__ = ('records', 'order')
+
+    def __init__(self, records, order):
+        self.records = records
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.records[self.order[i]]
+
+    def __iter__(self):
+        return map(self.records.__getitem__, self.order)
+
+class SnapshotLayoutWriter:
+    """Turns records and indexes into a picklable layout tree plus the
+    buffers it refers to.
+
+    Index attributes are stored by shape: arrays as themselves, lists of
+    strings as a StringTable, lists of ints as an array, lists of int lists
+    as a ListTable, dicts from strings to ints or int lists as a
+    StringKeyMap (an int value among lists is stored as a one-item list),
+    other lists, tuples, dicts and app objects item by item, app functions
+    by name, and anything else pickled into the tree. Each stand-in reads like what it replaces.
+    """
+
+    ALIGNMENT = 8
+
+    def __init__(self):
+        self.buffers = []
+        self.size = 0
+
+    def add(self, values):
+        """Store a buffer; returns its (offset, length, typecode) reference"""
+        view = memoryview(values)
+        typecode = view.format if view.format in ('i', 'q') else 'B'
+        reference = (self.size, view.nbytes, typecode)
+        self.buffers.append(view.cast('B'))
+        self.size += view.nbytes + -view.nbytes % self.ALIGNMENT
+        return reference
+
+    def write(self, output):
+        """Write the buffers, starting at an aligned offset of output"""
+        output.write(bytes(-output.tell() % self.ALIGNMENT))
+        for buffer in self.buffers:
+            output.write(buffer)
+            output.write(bytes(-buffer.nbytes % self.ALIGNMENT))
+
+    def records(self, records):
+        """Layout of a list of Employee records, one column per stored field"""
+        if isinstance(records, RecordTable):
+            columns = records.columns
+        else:
+            columns = list(zip(*(person.to_tuple() for person in records))) or [()] * len(STORED_FIELDS)
+        nodes = []
+        for field, column in zip(STORED_FIELDS, columns):
+            if isinstance(column, CodedStrings):
+                nodes.append(('coded', list(column.values), self.add(column.codes)))
+            elif field in INTERNED_FIELDS:
+                codes = {}
+                column_codes = array('i', (codes.setdefault(value, len(codes)) for value in column))
+                nodes.append(('coded', list(codes), self.add(column_codes)))
+            else:
+                nodes.append(self.freeze(column if isinstance(column, StringTable) else StringTable.build(column)))
+        return ('records', nodes)
+
+    def index(self, index):
+        """Layout of an index object, without the records it links to"""
+        return ('object', type(index).__name__, {attribute: self.freeze(value)
+                                                 for attribute, value in index.__dict__.items()
+                                                 if attribute != 'records'})
+
+    def freeze(self, value):
+        if isinstance(value, (array, memoryview)):
+            return ('array', self.add(value))
+        if isinstance(value, StringTable):
+            return ('strings', self.add(value.ends), self.add(value.data))
+        if isinstance(value, ListTable) and not value.replaced:
+            return ('lists', self.add(value.ends), self.add(value.items))
+        if isinstance(value, StringKeyMap):
+            return ('keys', self.freeze(value.keys_table), self.freeze(value.values), self.freeze(value.slots))
+        if isinstance(value, (list, tuple, ListTable)) and len(value):
+            if all(type(item) is str for item in value):
+                return self.freeze(StringTable.build(value))
+            if all(type(item) is int for item in value) and int_typecode(value):
+                return self.freeze(array(int_typecode(value), value))
+            if all(is_int_sequence(item) for item in value) and self.items_typecode(value):
+                return self.freeze(ListTable.build(value, self.items_typecode(value)))
+            return ('tuple' if isinstance(value, tuple) else 'list', [self.freeze(item) for item in value])
+        if isinstance(value, dict) and value:
+            if all(type(key) is str for key in value):
+                keys, values = list(value), list(value.values())
+                if all(type(item) is int for item in values) and int_typecode(values):
+                    return self.freeze(StringKeyMap.build(keys, array(int_typecode(values), values)))
+                if all(type(item) is int or is_int_sequence(item) for item in values):
+                    values = [[item] if type(item) is int else item for item in values]
+                    typecode = self.items_typecode(values)
+                    if typecode:
+                        return self.freeze(StringKeyMap.build(keys, ListTable.build(values, typecode)))
+            return ('dict', [(key, self.freeze(item)) for key, item in value.items()])
+        if getattr(value, '__module__', None) == __name__:
+            # App classes and functions are looked up by name, so the cache
+            # does not depend on how app.py was imported
+            if callable(value):
+                return ('global', value.__name__)
+            if hasattr(value, '__dict__'):
+                return self.index(value)
+        return ('value', value)
+
+    @staticmethod
+    def items_typecode(lists):
+        """Typecode for the items of a ListTable holding lists, or None"""
+        typecode, plain = 'i', []
+        for values in lists:
+            if isinstance(values, (array, memoryview)):
+                if (values.typecode if isinstance(values, array) else values.format) != 'i':
+                    typecode = 'q'
+            else:
+                plain.extend(values)
+        plain_typecode = int_typecode(plain)
+        if plain_typecode is None:
+            return None
+        return 'q' if 'q' in (typecode, plain_typecode) else 'i'
+
+def thaw_layout(node, data):
+    """Object for a layout node, reading its buffers from data in place"""
+    kind = node[0]
+
+    def buffer(reference):
+        offset, length, typecode = reference
+        return data[offset:offset + length].cast(typecode)
+
+    if kind == 'array':
+        return buffer(node[1])
+    if kind == 'strings':
+        return StringTable(buffer(node[1]), buffer(node[2]))
+    if kind == 'lists':
+        return ListTable(buffer(node[1]), buffer(node[2]))
+    if kind == 'keys':
+        return StringKeyMap(*[thaw_layout(item, data) for item in node[1:]])
+    if kind == 'records':
+        return RecordTable(tuple(
+            CodedStrings([sys.intern(value) for value in column[1]], buffer(column[2])) if column[0] == 'coded'
+            else thaw_layout(column, data)
+            for column in node[1]))
+    if kind == 'list':
+        return [thaw_layout(item, data) for item in node[1]]
+    if kind == 'tuple':
+        return tuple(thaw_layout(item, data) for item in node[1])
+    if kind == 'dict':
+        return {key: thaw_layout(item, data) for key, item in node[1]}
+    if kind == 'global':
+        return globals()[node[1]]
+    if kind == 'object':
+        value_type = globals()[node[1]]
+        value = value_type.__new__(value_type)
+        value.__dict__.update({attribute: thaw_layout(item, data) for attribute, item in node[2].items()})
+        return value
+    return node[1]
+
+# Snapshot cache layout: magic, format version, header length, JSON header
+# (source stamp/hash and metadata), the length of the pickled layout tree of
+# the records and indexes, the tree, then the buffers it refers to (see
+# SnapshotLayoutWriter), which readers map and use in place.
+SNAPSHOT_MAGIC = b'SSNAP'
+SNAPSHOT_FORMAT_VERSION = 8
+SNAPSHOT_PREFIX = struct.Struct('<5sHI')
+SNAPSHOT_LAYOUT_LENGTH = struct.Struct('<Q')
+
+# Indexes built on first use, cached when they have been
+LAZY_SNAPSHOT_INDEXES = ('_fuzzy_index', '_intro_index')
+
+# Held, always inside the snapshot file lock, while the cache file is replaced
+_cache_write_lock = threading.Lock()
+
+def save_snapshot_cache(snap, stamp, source_hash, path=SNAPSHOT_CACHE_PATH, replace_if=None):
+    """Write snap to the snapshot cache, replacing any previous file atomically.
+
+    The file is written without holding any lock and only swapped in under
+    the snapshot file lock and then _cache_write_lock, the order syncs take
+    them in. The previous file is kept instead when replace_if() is false
+    or, with SHARED_SNAPSHOT, when another process has since written a newer
+    version. Returns True if snap was saved.
+    """
+    header = json.dumps({
+        'version': snap.version,
+        'source': snap.source,
+        'last_sync': snap.last_sync.isoformat() if snap.last_sync else None,
+        'stamp': stamp,
+        'source_hash': source_hash
+    }).encode('utf-8')
+    started = time.perf_counter()
+    indexes = {attribute: getattr(snap, attribute) for attribute in (*SNAPSHOT_INDEXES, *LAZY_SNAPSHOT_INDEXES)}
+    writer = SnapshotLayoutWriter()
+    layout = pickle.dumps({
+        'records': writer.records(snap.records),
+        'timings': snap.timings,
+        'indexes': {attribute: writer.index(index) for attribute, index in indexes.items() if index is not None}
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(header)))
+        cache_file.write(header)
+        cache_file.write(SNAPSHOT_LAYOUT_LENGTH.pack(len(layout)))
+        cache_file.write(layout)
+        writer.write(cache_file)
+    with snapshot_file_lock(), _cache_write_lock:
+        if replace_if is not None and not replace_if():
+            os.remove(temp_path)
+            logger.info(f"Not caching snapshot v{snap.version}, it has been replaced")
+            return False
+        current = read_snapshot_header(path) if SHARED_SNAPSHOT else None
+        if current and current['version'] > snap.version:
+            os.remove(temp_path)
+            logger.info(f"Not caching snapshot v{snap.version}, the cache already holds v{current['version']}")
+            return False
+        os.replace(temp_path, path)
+        trim_snapshot_changes(snap.version)
+    logger.info(f"Saved snapshot v{snap.version} cache to {path} "
+                f"({os.path.getsize(path)} bytes, {(time.perf_counter() - started) * 1000:.1f}ms)")
+    return True
+
+def read_snapshot_cache(path=SNAPSHOT_CACHE_PATH):
+    """Load a cached snapshot and its header, or (None, None) if unusable.
+
+    The records and indexes are views of the mapped file rather than copies,
+    so processes reading the same file share its pages. The mapping stays
+    open for as long as any of them is referenced.
+    """
+    if not os.path.exists(path):
+        return None, None
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as cache_file:
+            stat = os.fstat(cache_file.fileno())
+            if os.name == 'nt':
+                # Windows cannot replace a file while it is mapped
+                data = memoryview(cache_file.read())
+            else:
+                data = memoryview(mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, format_version, header_length = SNAPSHOT_PREFIX.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            logger.warning(f"Ignoring snapshot cache {path}: unsupported format")
+            return None, None
+        offset = SNAPSHOT_PREFIX.size
+        header = json.loads(bytes(data[offset:offset + header_length]))
+        offset += header_length
+        layout_length, = SNAPSHOT_LAYOUT_LENGTH.unpack_from(data, offset)
+        offset += SNAPSHOT_LAYOUT_LENGTH.size
+        state = pickle.loads(data[offset:offset + layout_length])
+        offset += layout_length
+        sections = data[offset + -offset % SnapshotLayoutWriter.ALIGNMENT:]
+        records = thaw_layout(state['records'], sections)
+        indexes = {attribute: thaw_layout(node, sections) for attribute, node in state['indexes'].items()}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot cache {path}: {str(e)}")
+        return None, None
+
+    for index in indexes.values():
+        index.relink(records)
+    snap = DataSnapshot(
+        records, header['version'], header['source'],
+        datetime.fromisoformat(header['last_sync']) if header['last_sync'] else None,
+        state['timings'], indexes=indexes
+    )
+    snap.cache_file = (stat.st_dev, stat.st_ino)
+    logger.info(f"Loaded snapshot v{snap.version} cache from {path} "
+                f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return snap, header
+
+def read_snapshot_header(path=SNAPSHOT_CACHE_PATH):
+    """JSON header of the snapshot cache without loading the snapshot, or None"""
+    try:
+        with open(path, 'rb') as cache_file:
+            magic, format_version, header_length = SNAPSHOT_PREFIX.unpack(cache_file.read(SNAPSHOT_PREFIX.size))
+            if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+                return None
+            return json.loads(cache_file.read(header_length))
+    except (OSError, ValueError, struct.error):
+        return None
+
+# Structure changes made with SHARED_SNAPSHOT since the snapshot cache was
+# last written, one JSON line each: the version the change was made on, the
+# version it made and its moves as [person, manager] pairs. Other processes
+# apply them to their own snapshot instead of reloading the cache, which is
+# rewritten in the background once changes stop.
+SNAPSHOT_CHANGES_PATH = f"{SNAPSHOT_CACHE_PATH}.changes"
+
+def read_snapshot_changes(path=SNAPSHOT_CHANGES_PATH):
+    """Journaled structure changes, oldest first"""
+    changes = []
+    try:
+        with open(path, encoding='utf-8') as changes_file:
+            for line in changes_file:
+                try:
+                    changes.append(json.loads(line))
+                except ValueError:
+                    # A line still being appended
+                    break
+    except OSError:
+        pass
+    return changes
+
+def append_snapshot_change(parent, version, moves, path=SNAPSHOT_CHANGES_PATH):
+    """Journal the moves that turned snapshot v{parent} into v{version}"""
+    line = json.dumps({'parent': parent, 'version': version, 'moves': sorted(moves.items())})
+    with open(path, 'a', encoding='utf-8') as changes_file:
+        changes_file.write(line + '\n')
+
+def trim_snapshot_changes(version, path=SNAPSHOT_CHANGES_PATH):
+    """Keep only the journaled changes that follow on from snapshot v{version},
+    now in the cache. Callers hold the snapshot file lock.
+
+    Without SHARED_SNAPSHOT nothing is journaled, and the snapshot written
+    already has every change read at startup.
+    """
+    if not os.path.exists(path):
+        return
+    changes = []
+    if SHARED_SNAPSHOT:
+        for change in read_snapshot_changes(path):
+            if change['parent'] == (changes[-1]['version'] if changes else version):
+                changes.append(change)
+    if not changes:
+        os.remove(path)
+        return
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as changes_file:
+        changes_file.writelines(json.dumps(change) + '\n' for change in changes)
+    os.replace(temp_path, path)
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def publish_snapshot(records, source, last_sync=None, timings=None):
+    """Build indexes for records and make them the current snapshot"""
+    global snapshot
+    records = [person if isinstance(person, Employee) else Employee.from_dict(person)
+               for person in records]
+    with _publish_lock:
+        new_snapshot = DataSnapshot(records, next_snapshot_version(), source, last_sync, timings)
+        snapshot = new_snapshot
+    new_snapshot.warm_lazy_indexes()
+    return new_snapshot
+
+def next_snapshot_version():
+    """Version for a new snapshot: above the current one and, with
+    SHARED_SNAPSHOT, above any another process has written"""
+    version = snapshot.version if snapshot else 0
+    if SHARED_SNAPSHOT:
+        header = read_snapshot_header()
+        if header:
+            version = max(version, header['version'])
+        changes = read_snapshot_changes()
+        if changes:
+            version = max(version, changes[-1]['version'])
+    return version + 1
+
+def publish_cached_snapshot(cached, header):
+    """Make a snapshot read from the cache current, with its source stamp"""
+    global snapshot
+    with _publish_lock:
+        snapshot = cached
+    cached.warm_lazy_indexes()
+    sync_state['stamp'] = header['stamp']
+    sync_state['source_hash'] = header['source_hash']
+
+def load_cached_snapshot():
+    """Publish the on-disk snapshot cache, if any, with the structure changes
+    journaled since; refresh it in the background when stale"""
+    cached, header = read_snapshot_cache()
+    if cached is None:
+        return False
+
+    publish_cached_snapshot(apply_snapshot_changes(cached), header)
+
+    # The cache file is touched whenever a sync confirms it is still current
+    age = time.time() - os.path.getmtime(SNAPSHOT_CACHE_PATH)
+    if age > SNAPSHOT_MAX_AGE_SECONDS:
+        logger.info(f"Snapshot cache is {age:.0f}s old, refreshing in the background")
+        sync_worker.submit()
+    return True
+
+_file_lock_state = threading.local()
+
+@contextmanager
+def snapshot_file_lock():
+    """Hold the cross-process lock on the snapshot cache.
+
+    Taken (after _sync_lock) around syncs and structure changes, so that
+    with SHARED_SNAPSHOT only one process at a time changes the data and
+    none works from a version older than the file's, and around replacing
+    the cache file. A thread already holding it takes it again at no cost.
+    A no-op without SHARED_SNAPSHOT.
+    """
+    if not SHARED_SNAPSHOT or fcntl is None or getattr(_file_lock_state, 'held', False):
+        yield
+        return
+    with open(f"{SNAPSHOT_CACHE_PATH}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _file_lock_state.held = True
+        try:
+            yield
+        finally:
+            _file_lock_state.held = False
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def adopt_shared_snapshot():
+    """Catch up with the versions other processes have written; returns True
+    if the current snapshot was replaced.
+
+    A snapshot cache file other than the one the current snapshot was read
+    from is loaded, whether it holds a newer version or a rewrite of one this
+    process already has, so that every process maps the same file. The
+    journaled structure changes are then applied on top. Callers hold
+    _sync_lock. Fallback data is always replaced, since it was never written
+    to the file.
+    """
+    global snapshot
+    if not SHARED_SNAPSHOT:
+        return False
+    current = snapshot if snapshot and snapshot.last_sync else None
+    header = None
+    try:
+        stat = os.stat(SNAPSHOT_CACHE_PATH)
+    except OSError:
+        stat = None
+    if stat and (current is None or current.cache_file != (stat.st_dev, stat.st_ino)):
+        cached, header = read_snapshot_cache()
+        if cached is not None:
+            cached = apply_snapshot_changes(cached)
+            if current is None or cached.version >= current.version:
+                if current is not None and cached.version == current.version:
+                    cached.fragments = current.fragments
+                publish_cached_snapshot(cached, header)
+                logger.info(f"Adopted snapshot v{cached.version} written by another process")
+                return cached.version != (current.version if current else None)
+    if current is None:
+        return False
+    latest = apply_snapshot_changes(current)
+    if latest is current:
+        return False
+    with _publish_lock:
+        snapshot = latest
+    latest.warm_lazy_indexes()
+    logger.info(f"Applied structure changes up to v{latest.version} made by another process")
+    return True
+
+_follow_state = {'checked_at': 0.0, 'file_id': None}
+_follow_lock = threading.Lock()
+
+def _follow_shared_snapshot():
+    try:
+        with _sync_lock:
+            adopt_shared_snapshot()
+    finally:
+        _follow_lock.release()
+
+@app.before_request
+def follow_shared_snapshot():
+    """With SHARED_SNAPSHOT, check the cache file for versions written by
+    other processes, at most every SHARED_SNAPSHOT_CHECK_SECONDS.
+
+    A new version is loaded on a background thread; requests keep being
+    served from the current snapshot until it is published.
+    """
+    if not SHARED_SNAPSHOT:
+        return
+    now = time.monotonic()
+    if now - _follow_state['checked_at'] < SHARED_SNAPSHOT_CHECK_SECONDS:
+        return
+    _follow_state['checked_at'] = now
+    try:
+        stat = os.stat(SNAPSHOT_CACHE_PATH)
+    except OSError:
+        return
+    # The cache file is replaced, never rewritten, so a new version has a new
+    # inode; the journal grows with every structure change
+    try:
+        changes = os.stat(SNAPSHOT_CHANGES_PATH)
+        changes_id = (changes.st_ino, changes.st_size)
+    except OSError:
+        changes_id = None
+    file_id = (stat.st_ino, stat.st_size, changes_id)
+    if file_id == _follow_state['file_id'] or not _follow_lock.acquire(blocking=False):
+        return
+    _follow_state['file_id'] = file_id
+    threading.Thread(target=_follow_shared_snapshot, name='snapshot-follower', daemon=True).start()
+
+def mark_snapshot_cache_current():
+    """Record that the cached snapshot still matches the source"""
+    if os.path.exists(SNAPSHOT_CACHE_PATH):
+        os.utime(SNAPSHOT_CACHE_PATH)
+
+def write_snapshot_cache(snap):
+    """Persist snap with the current source stamp, logging instead of failing.
+
+    Nothing is written once snap has been replaced by a newer snapshot. With
+    SHARED_SNAPSHOT the lazy indexes are built first, so that they are
+    shared through the file too, and this process then switches to the file's
+    copy like the others, freeing the one it built.
+    """
+    global snapshot
+    if snap is not snapshot:
+        logger.info(f"Not caching snapshot v{snap.version}, it has been replaced")
+        return
+    try:
+        if SHARED_SNAPSHOT:
+            snap.fuzzy_index
+            snap.intro_index
+        with timed_phase('cache_write'):
+            saved = save_snapshot_cache(snap, sync_state['stamp'], sync_state['source_hash'],
+                                        replace_if=lambda: snap is snapshot)
+    except Exception as e:
+        logger.error(f"Could not write snapshot cache: {str(e)}")
+        return
+    if saved and SHARED_SNAPSHOT:
+        mapped, _ = read_snapshot_cache()
+        with _publish_lock:
+            if mapped is not None and mapped.version == snap.version and snapshot is snap:
+                mapped.fragments = snap.fragments
+                snapshot = mapped
+
+_cache_timer = None
+_cache_timer_lock = threading.Lock()
+
+def write_snapshot_cache_later(delay=SNAPSHOT_WRITE_DELAY_SECONDS):
+    """Persist the current snapshot once nothing has changed for delay seconds.
+
+    Pickling a large snapshot holds the GIL for its whole duration, so a run
+    of structure changes is written once rather than after every change.
+    """
+    global _cache_timer
+    with _cache_timer_lock:
+        if _cache_timer is not None:
+            _cache_timer.cancel()
+        _cache_timer = threading.Timer(delay, lambda: write_snapshot_cache(snapshot))
+        _cache_timer.name = 'snapshot-cache'
+        _cache_timer.daemon = True
+        _cache_timer.start()
+
+def record_key(person):
+    """Stable identity of an employee across syncs"""
+    if person.get('employee_id'):
+        return ('employee_id', person['employee_id'])
+    if person.get('ldap'):
+        return ('ldap', person['ldap'])
+    return ('name', person.get('name', ''))
+
+def merge_with_snapshot(records, current):
+    """Diff freshly loaded records against the current snapshot.
+
+    Unchanged employees keep their existing record objects, and changed ones
+    keep their QT assignment, so a sync only alters what actually moved.
+    Returns the merged records and added/changed/removed/kept counts.
+    """
+    diff = {'added': 0, 'changed': 0, 'removed': 0, 'kept': 0}
+    if current is None:
+        diff['added'] = len(records)
+        return records, diff
+
+    previous = {record_key(person): person for person in current.records}
+    merged = []
+    for person in records:
+        old = previous.pop(record_key(person), None)
+        if old is None:
+            diff['added'] += 1
+            merged.append(person)
+        elif all(old.get(field) == person[field] for field in COLUMN_MAPPING):
+            diff['kept'] += 1
+            merged.append(old)
+        else:
+            diff['changed'] += 1
+            person['representative_from_qt'] = old.get('representative_from_qt', person['representative_from_qt'])
+            person['relationship_with_qt'] = old.get('relationship_with_qt', person['relationship_with_qt'])
+            merged.append(person)
+    diff['removed'] = len(previous)
+    return merged, diff
+
+# Conflicting field values listed in a sync's merge report
+MERGE_MAX_CONFLICTS = 100
+
+def source_download_path(source, number, count):
+    """Where a sync downloads source number of count"""
+    extension = '.csv' if source.file_path.lower().endswith('.csv') else '.xlsx'
+    suffix = f'_{number + 1}' if count > 1 else ''
+    return os.path.join(UPLOAD_FOLDER, f'sharepoint_profiles{suffix}{extension}')
+
+def fetch_source(source, dest_path):
+    """Download a source to dest_path; returns the path and its SHA-256"""
+    with timed_phase('download'):
+        path = source.download(dest_path)
+    with timed_phase('hash'):
+        return path, file_sha256(path)
+
+def sheet_jobs(sources, paths):
+    """(label, path, sheet) for every sheet to read from the downloaded
+    sources, in source order"""
+    jobs = []
+    for source, path in zip(sources, paths):
+        if source.sheet == '*' and not path.lower().endswith('.csv'):
+            jobs.extend((source_label(source, name), path, name) for name in workbook_sheet_names(path))
+        else:
+            jobs.append((source_label(source), path, source.sheet))
+    return jobs
+
+def read_sheet_in_worker(connection, path, sheet):
+    """Send read_profiles' result (or error) for one sheet back to the parent"""
+    try:
+        connection.send(('ok', read_profiles(path, sheet)))
+    except Exception as e:
+        connection.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+def parse_sheets(jobs):
+    """read_profiles for every (label, path, sheet) job, in job order.
+
+    Jobs are spread over up to INGEST_WORKERS forked processes, so reading
+    many sources takes about as long as reading the largest one. Workers are
+    forked with their job rather than sent it pickled, as a pool would:
+    unpickling would import this module in each worker, which deadlocks
+    when the first sync runs while the module is still being imported.
+    Without fork, the sheets are read one after another.
+    """
+    workers = min(len(jobs), INGEST_WORKERS or os.cpu_count() or 1)
+    if workers < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [read_profiles(path, sheet) for _, path, sheet in jobs]
+
+    context = multiprocessing.get_context('fork')
+    results = [None] * len(jobs)
+    pending = list(enumerate(jobs))[::-1]
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                position, (_, path, sheet) = pending.pop()
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=read_sheet_in_worker, args=(sender, path, sheet),
+                                          name=f'profiles-reader-{position}', daemon=True)
+                process.start()
+                sender.close()
+                running[receiver] = (position, process)
+            for receiver in multiprocessing.connection.wait(list(running)):
+                position, process = running.pop(receiver)
+                try:
+                    status, result = receiver.recv()
+                except EOFError:
+                    status, result = 'error', 'reader process exited without a result'
+                receiver.close()
+                process.join()
+                if status != 'ok':
+                    raise RuntimeError(f"Reading {jobs[position][0]} failed: {result}")
+                results[position] = result
+    finally:
+        for receiver, (_, process) in running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+    return results
+
+def identity_keys(person):
+    """employee_id, ldap and normalized name of a record, '' when missing"""
+    return person.get('employee_id', ''), person.get('ldap', ''), normalize_name(person.get('name', ''))
+
+def find_duplicate(merged, by_key, keys):
+    """Position in merged of the record keys identify, or None.
+
+    Records match on employee_id; failing that on ldap, then normalized
+    name, unless their employee_ids or ldaps differ.
+    """
+    employee_id, ldap, _ = keys
+    for level, key in enumerate(keys):
+        match = by_key[level].get(key) if key else None
+        if match is None:
+            continue
+        other_id, other_ldap, _ = identity_keys(merged[match])
+        if level == 0 or ((not employee_id or not other_id or employee_id == other_id) and
+                          (not ldap or not other_ldap or ldap == other_ldap)):
+            return match
+    return None
+
+def dedupe_records(batches):
+    """Merge the records read from several sheets, one record per employee.
+
+    batches is a list of (label, records) in priority order. A record that
+    find_duplicate matches to one from an earlier batch is folded into it:
+    the earlier record is kept, its empty fields are filled from the later
+    one, and fields where both hold different values are counted as
+    conflicts. Rows within one batch are never merged with each other.
+    Returns the records and a report of duplicates and conflicts.
+    """
+    merged, origins = [], []
+    by_key = ({}, {}, {})
+    report = {'sources': [], 'duplicates': 0, 'conflicts': 0, 'conflict_samples': []}
+    for number, (label, records) in enumerate(batches):
+        stats = {'source': label, 'rows': len(records), 'duplicates': 0, 'conflicts': 0}
+        touched = []
+        for person in records:
+            match = find_duplicate(merged, by_key, identity_keys(person)) if number else None
+            if match is None:
+                touched.append(len(merged))
+                merged.append(person)
+                origins.append(label)
+                continue
+            stats['duplicates'] += 1
+            touched.append(match)
+            kept = merged[match]
+            for field in COLUMN_MAPPING:
+                value, current = person[field], kept[field]
+                empty = 'Unknown' if field in UNKNOWN_DEFAULT_FIELDS else ''
+                if value == current or value == empty:
+                    continue
+                if current == empty:
+                    kept[field] = value
+                    continue
+                stats['conflicts'] += 1
+                if len(report['conflict_samples']) < MERGE_MAX_CONFLICTS:
+                    report['conflict_samples'].append({
+                        'name': kept['name'], 'field': field,
+                        'kept': current, 'kept_from': origins[match],
+                        'discarded': value, 'discarded_from': label
+                    })
+        # Keys are registered once the batch is done, so later batches
+        # match this one's rows but its own rows do not match each other
+        if number < len(batches) - 1:
+            for position in touched:
+                for index, key in zip(by_key, identity_keys(merged[position])):
+                    if key:
+                        index.setdefault(key, position)
+        report['duplicates'] += stats['duplicates']
+        report['conflicts'] += stats['conflicts']
+        report['sources'].append(stats)
+    return merged, report
+
+def print_load_summary(snap):
+    """Print a summary of a freshly loaded snapshot"""
+    records = snap.records
+    print("=" * 60)
+    print("SHAREPOINT DATA LOADED SUCCESSFULLY")
+    print("=" * 60)
+    print(f"Total employees: {len(records)}")
+    print(f"Departments: {len(set(emp.get('department', 'Unknown') for emp in records))}")
+    print(f"Countries: {len(set(emp.get('country', 'Unknown') for emp in records))}")
+    print(f"Last sync: {snap.last_sync}")
+    
+    # QT Representative distribution
+    qt_dist = {}
+    rel_dist = {}
+    for emp in records:
+        rep = emp.get('representative_from_qt', 'Unknown')
+        rel = emp.get('relationship_with_qt', 'Unknown')
+        qt_dist[rep] = qt_dist.get(rep, 0) + 1
+        rel_dist[rel] = rel_dist.get(rel, 0) + 1
+    
+    print("\nQT Representative Distribution:")
+    for rep, count in sorted(qt_dist.items()):
+        print(f"  {rep}: {count} employees")
+    
+    print("\nRelationship Distribution:")
+    for rel, count in sorted(rel_dist.items()):
+        print(f"  {rel}: {count} employees")
+    print("=" * 60)
+
+# Source stamp and content hash of the workbooks behind the current
+# snapshot, the merge report of the last sync that read them, and the last
+# sync failure
+sync_state = {'stamp': None, 'source_hash': None, 'last_checked': None, 'merge': None, 'last_error': None}
+_sync_lock = threading.Lock()
+
+def load_data_from_sharepoint(force=False):
+    """Load organizational data directly from SharePoint Excel file.
+
+    The download is skipped when the file's ETag/modification stamp matches
+    the one already loaded, unless force is set. When the sync fails, the
+    current snapshot stays published (status 'failed'); only a process with
+    no data yet falls back to the built-in records. Returns a summary dict.
+    """
+    with timed_phase('total'):
+        result = _sync_from_source(force)
+    sync_runs.inc(result['status'])
+    return result
+
+def _sync_from_source(force):
+    with _sync_lock, snapshot_file_lock():
+        try:
+            if adopt_shared_snapshot() and not force:
+                # Another process synced while this one waited for the lock
+                return {'status': 'unchanged', 'version': snapshot.version,
+                        'employees_count': len(snapshot.records)}
+            
+            sources = profile_sources
+            if not sources:
+                raise ValueError("No profiles sources configured: PROFILES_SOURCES lists none")
+            source_name = ' + '.join(dict.fromkeys(source.name for source in sources))
+            logger.info(f"Loading data from {', '.join(map(source_label, sources))}...")
+            
+            # Sources are checked and downloaded side by side
+            with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix='profiles-fetch') as pool:
+                with timed_phase('check'):
+                    stamps = list(pool.map(lambda source: source.stamp(), sources))
+                stamp = '|'.join(stamps) if all(stamps) else None
+                sync_state['last_checked'] = datetime.now()
+                if not force and stamp and stamp == sync_state['stamp'] and snapshot and snapshot.last_sync:
+                    logger.info("Source files unchanged, skipping download")
+                    mark_snapshot_cache_current()
+                    return {'status': 'unchanged', 'version': snapshot.version,
+                            'employees_count': len(snapshot.records)}
+                
+                destinations = [source_download_path(source, number, len(sources))
+                                for number, source in enumerate(sources)]
+                fetched = list(pool.map(fetch_source, sources, destinations))
+            file_paths = [path for path, _ in fetched]
+            source_hash = fetched[0][1] if len(fetched) == 1 else hashlib.sha256(
+                '\n'.join(digest for _, digest in fetched).encode()).hexdigest()
+            if not force and source_hash == sync_state['source_hash'] and snapshot and snapshot.last_sync:
+                logger.info("Source file content unchanged, skipping parse")
+                sync_state['stamp'] = stamp
+                write_snapshot_cache(snapshot)
+                return {'status': 'unchanged', 'version': snapshot.version,
+                        'employees_count': len(snapshot.records)}
+            
+            jobs = sheet_jobs(sources, file_paths)
+            parsed = parse_sheets(jobs)
+            timings = Counter()
+            for _, sheet_timings in parsed:
+                timings.update(sheet_timings)
+            timings = dict(timings)
+            sync_phase_seconds.observe(timings['read'], 'parse')
+            sync_phase_seconds.observe(sum(timings.values()) - timings['read'], 'normalize')
+            
+            with timed_phase('dedupe'):
+                normalized_data, merge_report = dedupe_records(
+                    [(label, records) for (label, _, _), (records, _) in zip(jobs, parsed)])
+                fill_missing_ldaps(normalized_data)
+            for stats, (_, sheet_timings) in zip(merge_report['sources'], parsed):
+                stats['parse_ms'] = round(sum(sheet_timings.values()) * 1000, 1)
+            sync_state['merge'] = merge_report
+            if merge_report['duplicates']:
+                logger.info(f"Merged {merge_report['duplicates']} duplicate rows across sources "
+                            f"({merge_report['conflicts']} conflicting values)")
+            
+            current = snapshot if snapshot and snapshot.last_sync else None
+            with timed_phase('merge'):
+                merged, diff = merge_with_snapshot(normalized_data, current)
+            sync_state['stamp'] = stamp
+            sync_state['source_hash'] = source_hash
+            if current and not (diff['added'] or diff['changed'] or diff['removed']):
+                logger.info("Source rows unchanged, keeping snapshot")
+                write_snapshot_cache(current)
+                return {'status': 'unchanged', 'version': current.version,
+                        'employees_count': len(current.records), 'diff': diff, 'merge': merge_report}
+            
+            with timed_phase('index_build'):
+                new_snapshot = publish_snapshot(merged, source_name, datetime.now(), timings)
+            write_snapshot_cache(new_snapshot)
+            print_load_summary(new_snapshot)
+            logger.info(f"Successfully loaded {len(merged)} employees from {source_name} ({diff})")
+            return {'status': 'updated', 'version': new_snapshot.version,
+                    'employees_count': len(merged), 'diff': diff, 'merge': merge_report}
+            
+        except Exception as e:
+            logger.error(f"Error loading from SharePoint: {str(e)}")
+            print(f"SharePoint load failed: {str(e)}")
+            sync_state['last_error'] = {'error': str(e), 'at': datetime.now().isoformat()}
+            if snapshot and snapshot.source != 'Fallback Data':
+                # Keep serving the last good data; the next sync tries again
+                logger.warning(f"Keeping snapshot version {snapshot.version} from {snapshot.source}")
+                return {'status': 'failed', 'version': snapshot.version,
+                        'employees_count': len(snapshot.records), 'error': str(e)}
+            print("Loading fallback data...")
+            sync_state['stamp'] = None
+            sync_state['source_hash'] = None
+            new_snapshot = publish_snapshot(load_fallback_data(), 'Fallback Data')
+            return {'status': 'fallback', 'version': new_snapshot.version,
+                    'employees_count': len(new_snapshot.records), 'error': str(e)}
+
+def load_fallback_data():
+    """Fallback data when SharePoint is not available"""
+    print("=" * 60)
+    print("USING FALLBACK DATA - SHAREPOINT NOT AVAILABLE")
+    print("=" * 60)
+    print("To use live SharePoint data, please:")
+    print("1. Update SharePoint credentials in SHAREPOINT_CONFIG")
+    print("2. Ensure you have access to the SharePoint file")
+    print("3. Install required packages: pip install requests Office365-REST-Python-Client")
+    print("=" * 60)
+    
+    return [
+        {
+            'name': 'Mayank Arya',
+            'position': 'SharePoint Administrator',
+            'department': 'IT',
+            'country': 'India',
+            'ldap': 'mayank.arya',
+            'moma_url': 'https://moma.corp.company.com/person/mayank.arya',
+            'manager_name': '',
+            'manager_email': '',
+            'moma_photo_url': 'https://moma.corp.company.com/photos/mayank.arya.jpg',
+            'manager_name_input': '',
+            'location_input': 'Mumbai',
+            'time_of_run': datetime.now().strftime('%Y-%m-%d'),
+            'relationship_with_qt': 'Direct',
+            'representative_from_qt': 'Mayank Arya'
+        }
+    ]
+
+class SyncWorker:
+    """Runs SharePoint syncs on a background thread, one at a time.
+
+    Requests made while a job is still queued share that job instead of
+    stacking up duplicate downloads.
+    """
+
+    MAX_JOBS = 50
+
+    def __init__(self, sync_function):
+        self.sync_function = sync_function
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = None
+        self._thread = None
+
+    def submit(self, force=False):
+        """Queue a sync and return a copy of its job record"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending['force'] = self._pending['force'] or force
+                return dict(self._pending)
+
+            job = {
+                'job_id': uuid.uuid4().hex[:12],
+                'status': 'queued',
+                'force': force,
+                'requested_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None
+            }
+            self.jobs[job['job_id']] = job
+            while len(self.jobs) > self.MAX_JOBS:
+                del self.jobs[next(iter(self.jobs))]
+            self._pending = job
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sharepoint-sync', daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+            return dict(job)
+
+    def get(self, job_id):
+        """Copy of a job record, or None if unknown"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._pending = None
+                job['status'] = 'running'
+                job['started_at'] = datetime.now().isoformat()
+            try:
+                result = self.sync_function(force=job['force'])
+                status = 'failed' if result.get('status') in ('failed', 'fallback') else 'completed'
+            except Exception as e:
+                logger.error(f"Sync job {job['job_id']} failed: {str(e)}")
+                result = {'status': 'error', 'error': str(e)}
+                status = 'failed'
+            with self._lock:
+                job['status'] = status
+                job['result'] = result
+                job['finished_at'] = datetime.now().isoformat()
+
+sync_worker = SyncWorker(load_data_from_sharepoint)
+
+def sync_sharepoint_data(force=False):
+    """Manual sync function to refresh data from SharePoint in the background"""
+    logger.info("Manual SharePoint sync requested")
+    return sync_worker.submit(force=force)
+
+def hierarchy_node(org, i):
+    """Tree node for person i, with report counts but no children attached"""
+    person = org.records[i]
+    return {
+        'name': person['name'],
+        'position': person['position'],
+        'department': person['department'],
+        'country': person['country'],
+        'location': person.get('location_input', ''),
+        'photo_url': person.get('moma_photo_url', ''),
+        'relationship_with_qt': person.get('relationship_with_qt', 'None'),
+        'representative_from_qt': person.get('representative_from_qt', 'No'),
+        'child_count': len(org.children[i]),
+        'descendant_count': org.subtree_size(i) - 1,
+        'children': []
+    }
+
+def build_subtree(org, root, depth=None, max_children=None, version=None):
+    """Tree under root, at most depth levels deep and max_children wide.
+
+    Nodes whose children were cut off get has_more_children and a
+    children_cursor for /api/hierarchy/<name>/children.
+    """
+    root_node = hierarchy_node(org, root)
+    stack = [(root, root_node, 0)]
+    while stack:
+        i, node, level = stack.pop()
+        children = org.children[i]
+        if depth is not None and level >= depth:
+            shown = ()
+        elif max_children is not None:
+            shown = children[:max_children]
+        else:
+            shown = children
+        # Children are attached in name order before their own subtrees are
+        # built, so the stack order does not affect the output.
+        for child in shown:
+            child_node = hierarchy_node(org, child)
+            node['children'].append(child_node)
+            stack.append((child, child_node, level + 1))
+        if len(shown) < len(children):
+            node['has_more_children'] = True
+            node['children_cursor'] = encode_cursor(version, len(shown))
+    return root_node
+
+def build_hierarchy_tree(org, root_person=None, depth=None, max_children=None, version=None):
+    """Build a hierarchical tree structure from an org index"""
+    if root_person:
+        root = org.index.get(root_person)
+        if root is None:
+            return None
+        return build_subtree(org, root, depth, max_children, version)
+    else:
+        return [build_subtree(org, root, depth, max_children, version) for root in org.roots]
+
+def parse_tree_limits(args):
+    """depth and max_children query parameters; raises ValueError if invalid"""
+    limits = {}
+    for name, minimum in (('depth', 0), ('max_children', 1)):
+        value = args.get(name)
+        if value in (None, ''):
+            limits[name] = None
+            continue
+        try:
+            limits[name] = int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+        if limits[name] < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+    return limits['depth'], limits['max_children']
+
+def normalize_name(name):
+    """Normalize name for comparison"""
+    return name.lower().strip()
+
+# Search index
+SEARCH_FIELDS = ('name', 'department', 'position', 'location_input')
+
+RANK_EXACT_NAME = 0
+RANK_NAME_PREFIX = 1
+RANK_TOKEN = 2
+RANK_SUBSTRING = 3
+
+# Fields with a bitmap per value, by the query parameter that filters on them
+FACET_FIELDS = {
+    'department': 'department',
+    'country': 'country',
+    'location': 'location_input',
+    'relationship': 'relationship_with_qt',
+    'representative': 'representative_from_qt'
+}
+
+# Set bit positions for every byte value, and runs of bytes that have any
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+_NONZERO_BYTES = re.compile(b'[^\x00]+')
+
+def ids_to_bitmap(ids, size):
+    """Bitmap (an int) with the bits of ids set, for ids below size"""
+    bits = bytearray((size + 7) // 8)
+    for doc_id in ids:
+        bits[doc_id >> 3] |= 1 << (doc_id & 7)
+    return int.from_bytes(bits, 'little')
+
+def bitmap_ids(bitmap):
+    """Set bit positions of bitmap, ascending"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    ids = []
+    for run in _NONZERO_BYTES.finditer(data):
+        for position in range(run.start(), run.end()):
+            base = position << 3
+            ids.extend(base + bit for bit in _BYTE_BITS[data[position]])
+    return ids
+
+def _trigrams(text):
+    """Return the set of 3-character substrings of text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    """Trigram index over the searchable employee fields.
+
+    Documents are numbered in name order, so every postings list is already
+    sorted by name and results never need a full re-sort. Each value of a
+    FACET_FIELDS field has a bitmap of its documents, so filters and facet
+    counts are bitwise ANDs and popcounts.
+    """
+
+    def __init__(self, data):
+        order = sorted(range(len(data)), key=lambda i: data[i]['name'])
+        self.order = array('i', order)
+        # Inverse of order: doc id of the record at each snapshot position
+        self.doc_ids = array('i', bytes(4 * len(order)))
+        for doc_id, i in enumerate(order):
+            self.doc_ids[i] = doc_id
+        self.records = ReorderedRecords(data, self.order)
+        self.names = []
+        # Lowercased fields joined with NUL so a query can never match across
+        # two fields; each field is prefixed with a space to mark word starts.
+        self.haystacks = []
+        self.trigrams = defaultdict(list)
+        facet_ids = {field: defaultdict(list) for field in FACET_FIELDS.values()}
+
+        for doc_id, i in enumerate(order):
+            person = data[i]
+            fields = [str(person.get(field) or '').lower() for field in SEARCH_FIELDS]
+            self.names.append(fields[0].strip())
+            self.haystacks.append('\x00'.join(' ' + field for field in fields))
+
+            grams = set()
+            for field in fields:
+                grams |= _trigrams(field)
+            for gram in grams:
+                self.trigrams[gram].append(doc_id)
+
+            for field, values in facet_ids.items():
+                values[person.get(field, '')].append(doc_id)
+
+        self.trigrams = {gram: array('i', ids) for gram, ids in self.trigrams.items()}
+        self.facets = {field: {value: ids_to_bitmap(ids, len(self.records)) for value, ids in values.items()}
+                       for field, values in facet_ids.items()}
+
+    def __len__(self):
+        return len(self.records)
+
+    def relink(self, data):
+        """Reattach records after loading the index from the snapshot cache.
+
+        Names and haystacks are decoded into this process: matching them in
+        place in the file is several times slower. The rest stays shared.
+        """
+        self.records = ReorderedRecords(data, self.order)
+        self.names = list(self.names)
+        self.haystacks = list(self.haystacks)
+
+    def doc_id(self, i):
+        """Doc id of the record at position i of the snapshot's records"""
+        return self.doc_ids[i]
+
+    def with_records(self, data, changed):
+        """Copy of the index for data, which differs from the indexed records
+        only at the positions in changed and not in any searchable field"""
+        index = SearchIndex.__new__(SearchIndex)
+        index.__dict__.update(self.__dict__)
+        index.records = ReorderedRecords(data, self.order)
+        return index
+
+    def _candidates(self, query):
+        """Doc ids that may contain query, or None when every doc is a candidate"""
+        grams = _trigrams(query)
+        if not grams:
+            return None
+
+        postings = []
+        for gram in grams:
+            ids = self.trigrams.get(gram)
+            if ids is None:
+                return set()
+            postings.append(ids)
+
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+    def _rank(self, doc_id, query):
+        """Rank a matching doc: exact name > name prefix > token > substring"""
+        name = self.names[doc_id]
+        if name == query:
+            return RANK_EXACT_NAME
+        if name.startswith(query):
+            return RANK_NAME_PREFIX
+        if ' ' + query in self.haystacks[doc_id]:
+            return RANK_TOKEN
+        return RANK_SUBSTRING
+
+    def facet_bitmap(self, field, values):
+        """Bitmap of the docs whose field has any of values"""
+        bitmap = 0
+        facet = self.facets[field]
+        for value in values:
+            bitmap |= facet.get(value, 0)
+        return bitmap
+
+    def filter_mask(self, filters):
+        """filter_bitmap as little-endian bytes, for testing single doc ids
+        (doc_id in the mask when mask[doc_id >> 3] >> (doc_id & 7) & 1), or
+        None when there are no filters"""
+        selected = self.filter_bitmap(filters)
+        if selected is None:
+            return None
+        return selected.to_bytes((len(self.records) + 7) // 8, 'little')
+
+    def filter_bitmap(self, filters):
+        """Bitmap of the docs matching every field of filters ({field: values}),
+        or None when there are no filters"""
+        bitmap = None
+        for field, values in (filters or {}).items():
+            selected = self.facet_bitmap(field, values)
+            bitmap = selected if bitmap is None else bitmap & selected
+        return bitmap
+
+    def search_ids(self, query='', filters=None):
+        """Doc ids of records matching query and filters, best rank first
+        and by name within a rank.
+
+        filters maps FACET_FIELDS fields to lists of values; a record has to
+        match one value of every field given.
+        """
+        query = query.lower().strip()
+
+        selected = self.filter_bitmap(filters)
+        candidates = self._candidates(query) if query else None
+        if candidates is None:
+            doc_ids = range(len(self.records)) if selected is None else bitmap_ids(selected)
+        else:
+            if selected is not None:
+                mask = selected.to_bytes((len(self.records) + 7) // 8, 'little')
+                candidates = [doc_id for doc_id in candidates if mask[doc_id >> 3] >> (doc_id & 7) & 1]
+            doc_ids = sorted(candidates)
+
+        if not query:
+            return doc_ids
+
+        # Bucket by rank; doc_ids are in name order so each bucket stays sorted
+        buckets = ([], [], [], [])
+        haystacks = self.haystacks
+        for doc_id in doc_ids:
+            if query in haystacks[doc_id]:
+                buckets[self._rank(doc_id, query)].append(doc_id)
+        return [doc_id for bucket in buckets for doc_id in bucket]
+
+    def facet_counts(self, query='', filters=None, doc_ids=None):
+        """{field: {value: matches}} for every facet field.
+
+        Counts for a field apply the query and the filters on every other
+        field but not its own, so they show what selecting another value of
+        that field would add. doc_ids, when given, are the docs the query
+        matched (as found by another index) and query is not searched.
+        """
+        size = len(self.records)
+        if doc_ids is not None:
+            matches = ids_to_bitmap(doc_ids, size)
+        elif query.strip():
+            matches = ids_to_bitmap(self.search_ids(query), size)
+        else:
+            matches = (1 << size) - 1
+        selected = {field: self.facet_bitmap(field, values) for field, values in (filters or {}).items()}
+
+        counts = {}
+        for field, facet in self.facets.items():
+            base = matches
+            for other, bitmap in selected.items():
+                if other != field:
+                    base &= bitmap
+            counts[field] = {value: count for value, bitmap in facet.items()
+                             if (count := (base & bitmap).bit_count())}
+        return counts
+
+# Org graph index
+NO_PARENT = -1
+
+def location_rollup_key(person):
+    """Map bucket of a person: location, country and QT relationship"""
+    location = (person.get('location_input') or '').strip() or 'Unknown'
+    relationship = (person.get('relationship_with_qt') or '').lower()
+    if relationship not in ('direct', 'indirect'):
+        relationship = 'none'
+    return (location, person.get('country') or '', relationship)
+
+def department_rollup_key(person):
+    return person.get('department') or 'Unknown'
+
+class SubtreeCounts:
+    """Per-value counts of one field over any subtree of an OrgIndex.
+
+    For every value the entry labels of the people having it are kept
+    sorted, and a subtree covers exactly the labels between its root's entry
+    and exit, so counting a value under a manager is two bisects. A whole
+    rollup costs O(values * log n) whatever the subtree size; subtrees with
+    fewer people than there are values are counted directly instead.
+    """
+
+    def __init__(self, org, key):
+        self.key = key
+        self.labels = {}
+        self._shared = set()
+        for i in org.order:
+            value = key(org.records[i])
+            labels = self.labels.get(value)
+            if labels is None:
+                labels = self.labels[value] = array('q')
+            labels.append(org.entry[i])
+
+    def counts(self, org, i):
+        """{value: people with it} over i and everyone under i"""
+        start, end = org._span(i)
+        if end - start <= len(self.labels):
+            return Counter(self.key(org.records[j]) for j in org.order[start:end])
+        low, high = org.entry[i], org.exit[i]
+        counts = {}
+        for value, labels in self.labels.items():
+            count = bisect_right(labels, high) - bisect_left(labels, low)
+            if count:
+                counts[value] = count
+        return counts
+
+    def members(self, org, i, values, offset=0, limit=None):
+        """Number of people under i (i included) having any of values, and
+        the offset..offset+limit ones of them in preorder"""
+        low, high = org.entry[i], org.exit[i]
+        found = []
+        for value in values:
+            labels = self.labels.get(value)
+            if labels:
+                found.extend(labels[bisect_left(labels, low):bisect_right(labels, high)])
+        found.sort()
+        page = found[offset:] if limit is None else found[offset:offset + limit]
+        return len(found), [org.order[bisect_left(org.entries, label)] for label in page]
+
+    def copy(self):
+        """Copy sharing the label arrays until they are modified"""
+        counts = SubtreeCounts.__new__(SubtreeCounts)
+        counts.key = self.key
+        counts.labels = dict(self.labels)
+        counts._shared = set(self.labels)
+        return counts
+
+    def relabel(self, org, low, high, people):
+        """Update for people, whose labels were all between low and high,
+        having been given new entry labels"""
+        moved = {}
+        for j in people:
+            moved.setdefault(self.key(org.records[j]), []).append(org.entry[j])
+        for value, new_labels in moved.items():
+            labels = self.labels[value]
+            if value in self._shared:
+                labels = self.labels[value] = array('q', labels)
+                self._shared.discard(value)
+            del labels[bisect_left(labels, low):bisect_right(labels, high)]
+            new_labels.sort()
+            position = bisect_left(labels, new_labels[0])
+            labels[position:position] = array('q', new_labels)
+
+class OrgIndex:
+    """Manager/report graph with DFS entry/exit labels.
+
+    Entering and leaving each person in a DFS gets increasing labels spaced
+    LABEL_GAP apart, so i reports to m exactly when
+    ``entry[m] < entry[i] < exit[m]``. ``order`` lists people in DFS order
+    with their entry labels in ``entries``; a subtree is the contiguous slice
+    between the bisect positions of its entry and exit labels, which makes
+    subordinate listing O(subtree) and ancestry checks O(1). The gaps let a
+    moved subtree be relabelled at its destination without renumbering
+    anyone else. ``rollups`` count field values per subtree on the same
+    labels.
+    """
+
+    LABEL_GAP = 1 << 32
+
+    # Field rollups kept for every subtree, by name
+    ROLLUPS = {'location': location_rollup_key, 'department': department_rollup_key}
+
+    # Larger batches of manager changes renumber the whole forest once
+    # instead of relabelling each moved subtree
+    INCREMENTAL_MOVE_LIMIT = 64
+
+    def __init__(self, data):
+        self.records = data
+        self.names = [person['name'] for person in data]
+        self.index = {}
+        self.lookup_index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+            self.lookup_index.setdefault(normalize_name(name), i)
+
+        self.parent = array('i', [NO_PARENT]) * len(data)
+        self.children = [[] for _ in data]
+        self.roots = []
+        for i, person in enumerate(data):
+            manager = self.index.get(person.get('manager_name') or '')
+            if manager is None or manager == i:
+                self.roots.append(i)
+            else:
+                self.parent[i] = manager
+                self.children[manager].append(i)
+        for reports in self.children:
+            reports.sort(key=self.names.__getitem__)
+
+        self.depth = array('i', bytes(4 * len(data)))
+        self.entry = array('q', bytes(8 * len(data)))
+        self.exit = array('q', bytes(8 * len(data)))
+        self.order = array('i')
+        visited = [False] * len(data)
+        label = 0
+        for root in self.roots:
+            label = self._number(root, visited, label)
+        # People caught in a reporting cycle are unreachable from any root;
+        # break each cycle at its first member so they still get numbered.
+        for i in range(len(data)):
+            if not visited[i]:
+                self.children[self.parent[i]].remove(i)
+                self.parent[i] = NO_PARENT
+                self.roots.append(i)
+                label = self._number(i, visited, label)
+        self.entries = array('q', (self.entry[i] for i in self.order))
+        self.rollups = {name: SubtreeCounts(self, key) for name, key in self.ROLLUPS.items()}
+
+    def _number(self, root, visited, label):
+        """Assign depth and entry/exit labels to the subtree under root,
+        continuing after label; returns the last label used"""
+        stack = [(root, False)]
+        while stack:
+            i, leaving = stack.pop()
+            label += self.LABEL_GAP
+            if leaving:
+                self.exit[i] = label
+                continue
+            visited[i] = True
+            self.entry[i] = label
+            self.order.append(i)
+            if self.parent[i] != NO_PARENT:
+                self.depth[i] = self.depth[self.parent[i]] + 1
+            else:
+                self.depth[i] = 0
+            stack.append((i, True))
+            for child in reversed(self.children[i]):
+                if not visited[child]:
+                    stack.append((child, False))
+        return label
+
+    def __len__(self):
+        return len(self.records)
+
+    def relink(self, data):
+        """Reattach records after loading the index from the snapshot cache.
+
+        The rollup label arrays are then views of the file, copied before
+        they are modified.
+        """
+        self.records = data
+        for counts in self.rollups.values():
+            counts._shared = set(counts.labels)
+
+    def find(self, name):
+        """Index of the first person whose normalized name matches, or None"""
+        return self.lookup_index.get(normalize_name(name))
+
+    def _span(self, i):
+        """Start and end positions of i's subtree in order"""
+        return bisect_left(self.entries, self.entry[i]), bisect_left(self.entries, self.exit[i])
+
+    def subtree(self, i):
+        """Indexes of i and everyone under i, in preorder"""
+        start, end = self._span(i)
+        return self.order[start:end].tolist()
+
+    def subtree_size(self, i):
+        """Number of people in i's subtree, including i"""
+        start, end = self._span(i)
+        return end - start
+
+    def is_under(self, i, manager):
+        """True if i reports to manager directly or indirectly"""
+        return self.entry[manager] < self.entry[i] < self.exit[manager]
+
+    def with_managers(self, data, moves):
+        """Copy of the index with people moved under new managers.
+
+        moves maps a person to their new manager, or NO_PARENT to make them a
+        root, and must not create a cycle. Only the child lists that change
+        are copied. Up to INCREMENTAL_MOVE_LIMIT moves between existing
+        managers relabel just the moved subtrees; anything else is renumbered
+        in a single pass.
+        """
+        org = OrgIndex.__new__(OrgIndex)
+        org.__dict__.update(self.__dict__)
+        org.records = data
+        org.parent = array_copy('i', self.parent)
+        org.children = self.children.copy()
+        org.roots = list(self.roots)
+        org.depth = array_copy('i', self.depth)
+        org.entry = array_copy('q', self.entry)
+        org.exit = array_copy('q', self.exit)
+        org.order = array_copy('i', self.order)
+        org.entries = array_copy('q', self.entries)
+        org.rollups = {name: counts.copy() for name, counts in self.rollups.items()}
+
+        incremental = len(moves) <= self.INCREMENTAL_MOVE_LIMIT
+        for i, manager in moves.items():
+            if incremental and (NO_PARENT in (manager, org.parent[i]) or org.is_under(manager, i)):
+                # Root changes and moves that are only valid once the rest of
+                # the batch is applied need the full renumbering
+                incremental = False
+            if incremental:
+                incremental = org._splice(i, manager)
+            else:
+                org._reparent(i, manager)
+        if not incremental:
+            org.order = array('i')
+            visited = [False] * len(data)
+            label = 0
+            for root in org.roots:
+                label = org._number(root, visited, label)
+            org.entries = array('q', (org.entry[i] for i in org.order))
+            org.rollups = {name: SubtreeCounts(org, key) for name, key in self.ROLLUPS.items()}
+        return org
+
+    def _reparent(self, i, manager):
+        """Move i under manager in the parent, children and roots lists only"""
+        previous = self.parent[i]
+        if previous == NO_PARENT:
+            self.roots.remove(i)
+        else:
+            self.children[previous] = [child for child in self.children[previous] if child != i]
+        if manager == NO_PARENT:
+            insort(self.roots, i)
+        else:
+            reports = list(self.children[manager])
+            insort(reports, i, key=self.names.__getitem__)
+            self.children[manager] = reports
+        self.parent[i] = manager
+
+    def _splice(self, i, manager):
+        """Move i's subtree under manager, relabelling only that subtree.
+
+        Returns False if the labels at the destination are too close together
+        to fit it; the move is then only recorded in the parent and children
+        lists and the caller has to renumber.
+        """
+        if self.parent[i] == manager:
+            return True
+        start, end = self._span(i)
+        self._reparent(i, manager)
+
+        # The subtree goes between the sibling before it and the one after
+        siblings = self.children[manager]
+        k = siblings.index(i)
+        low = self.exit[siblings[k - 1]] if k else self.entry[manager]
+        high = self.entry[siblings[k + 1]] if k + 1 < len(siblings) else self.exit[manager]
+        step = (high - low) // (2 * (end - start) + 1)
+        if step < 1:
+            return False
+
+        old_low, old_high = self.entry[i], self.exit[i]
+        del self.order[start:end]
+        del self.entries[start:end]
+        shift = self.depth[manager] + 1 - self.depth[i]
+        block = []
+        label = low
+        stack = [(i, False)]
+        while stack:
+            j, leaving = stack.pop()
+            label += step
+            if leaving:
+                self.exit[j] = label
+                continue
+            self.entry[j] = label
+            self.depth[j] += shift
+            block.append(j)
+            stack.append((j, True))
+            stack.extend((child, False) for child in reversed(self.children[j]))
+        position = bisect_left(self.entries, self.entry[i])
+        self.order[position:position] = array('i', block)
+        self.entries[position:position] = array('q', (self.entry[j] for j in block))
+        for counts in self.rollups.values():
+            counts.relabel(self, old_low, old_high, block)
+        return True
+
+# JSON responses
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+COMPRESS_MIN_BYTES = 1024
+
+class JsonFragmentCache:
+    """Encoded JSON for individual records, reused across requests.
+
+    Lives on a snapshot, so publishing new data discards it. Stops caching
+    once MAX_FRAGMENTS entries are held rather than evicting.
+    """
+
+    MAX_FRAGMENTS = 200000
+
+    def __init__(self):
+        self._fragments = {}
+
+    def get(self, doc_id, records, fields=None):
+        """JSON text for records[doc_id], projected onto fields when given.
+
+        The record is only read on a miss, since reading one from a mapped
+        snapshot builds it.
+        """
+        key = (doc_id, fields)
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            person = records[doc_id]
+            if fields is None:
+                fragment = app.json.dumps(person)
+            else:
+                fragment = app.json.dumps({field: person[field] for field in fields if field in person})
+            if len(self._fragments) < self.MAX_FRAGMENTS:
+                self._fragments[key] = fragment
+        return fragment
+
+    def copy_without(self, doc_ids):
+        """New cache holding every fragment except those for doc_ids"""
+        cache = JsonFragmentCache()
+        cache._fragments = {key: fragment for key, fragment in self._fragments.items()
+                            if key[0] not in doc_ids}
+        return cache
+
+    def __len__(self):
+        return len(self._fragments)
+
+def parse_fields(value):
+    """Validated tuple of requested record fields, or None for all of them"""
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in RECORD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+def encode_cursor(version, offset):
+    return base64.urlsafe_b64encode(f"{version}:{offset}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, version):
+    """Offset stored in a cursor; raises ValueError if malformed or from older data"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_version, offset = base64.urlsafe_b64decode(padded).decode().split(':')
+        cursor_version, offset = int(cursor_version), int(offset)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_version != version:
+        raise ValueError("Cursor refers to data that has since been refreshed")
+    return offset
+
+def json_response(body, status=200, headers=None):
+    """Response for already-encoded JSON text"""
+    response = app.response_class(body, status=status, mimetype=app.json.mimetype)
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress larger JSON responses with brotli or gzip, as the client accepts"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    accepted = request.headers.get('Accept-Encoding', '').lower()
+    response.vary.add('Accept-Encoding')
+    if BROTLI_AVAILABLE and 'br' in accepted:
+        encoding = 'br'
+    elif 'gzip' in accepted:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=4)
+    else:
+        data = gzip.compress(data, compresslevel=5)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Response cache
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))
+
+class ResponseCache:
+    """Bounded LRU of encoded responses for the current snapshot version.
+
+    Entries from an older snapshot are dropped the first time a newer
+    version is seen, so a sync or structure change invalidates everything.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, version, entry):
+        with self._lock:
+            if version != self.version:
+                # Built from a snapshot that has since been replaced
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def count_not_modified(self):
+        """Count a request answered 304 from a cached entry's ETag"""
+        with self._lock:
+            self.stats['not_modified'] += 1
+
+    def _reset(self, version):
+        if self._entries:
+            self.stats['invalidations'] += 1
+        self._entries.clear()
+        self.version = version
+
+    def report(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'snapshot_version': self.version,
+                'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else None
+            }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+def snapshot_cached(view):
+    """Serve a per-person view from response_cache with ETag revalidation.
+
+    The wrapped view is called as view(snap, person_name) and returns
+    (payload, status); only 200 responses are cached.
+    """
+    @functools.wraps(view)
+    def wrapper(person_name):
+        snap = snapshot
+        key = (view.__name__, normalize_name(person_name), request.query_string)
+        entry = response_cache.get(key, snap.version)
+        if entry is None:
+            payload, status = view(snap, person_name)
+            if status != 200:
+                return jsonify(payload), status
+            body = app.json.dumps(payload)
+            entry = (hashlib.sha1(body.encode('utf-8')).hexdigest(), body)
+            response_cache.put(key, snap.version, entry)
+
+        etag, body = entry
+        response = json_response(body)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response_cache.count_not_modified()
+        return response
+    return wrapper
+
+# Autocomplete index
+AUTOCOMPLETE_DEFAULT_LIMIT = 8
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+class AutocompleteIndex:
+    """Sorted prefix tables over names and LDAPs for top-k autocomplete.
+
+    Each tier is a sorted key list with a parallel doc-id array, so a lookup
+    is one bisect plus at most k steps per tier regardless of org size.
+    """
+
+    def __init__(self, data):
+        full_names, later_tokens, ldaps = [], [], []
+        for doc_id, person in enumerate(data):
+            name = normalize_name(person.get('name') or '')
+            if name:
+                full_names.append((name, doc_id))
+                # Every word after the first starts a key, so "segev" finds "Lihi Segev"
+                for position, char in enumerate(name):
+                    if char == ' ' and name[position + 1:position + 2] not in ('', ' '):
+                        later_tokens.append((name[position + 1:], doc_id))
+            ldap = normalize_name(person.get('ldap') or '')
+            if ldap:
+                ldaps.append((ldap, doc_id))
+
+        self.tiers = []
+        for entries in (full_names, later_tokens, ldaps):
+            entries.sort()
+            self.tiers.append(([key for key, _ in entries], array('i', (doc_id for _, doc_id in entries))))
+
+    def relink(self, data):
+        """Nothing to reattach; the index only holds doc ids"""
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_DEFAULT_LIMIT):
+        """Doc ids whose name, later name word or LDAP starts with prefix.
 
-# Configuration
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+        Full-name matches come first, then word and LDAP matches, each in
+        alphabetical order.
+        """
+        prefix = normalize_name(prefix)
+        if not prefix or limit <= 0:
+            return []
 
-# SharePoint Configuration
-SHAREPOINT_CONFIG = {
-    'site_url': 'https://ibase1-my.sharepoint.com.mcas.ms',
-    'tenant_id': 'YOUR_TENANT_ID',
-    'client_id': 'YOUR_CLIENT_ID',
-    'client_secret': 'YOUR_CLIENT_SECRET',
-    'file_url': '/personal/mayank_arya_qualitestgroup_com/_layouts/15/Doc.aspx?sourcedoc=%7BC78EB499-DAA9-47ED-AEDF-6888F709B3E0%7D&file=Profiles.xlsx',
-    'direct_file_path': '/personal/mayank_arya_qualitestgroup_com/Documents/Profiles.xlsx',
-    'username': 'sohail.islam@qualitestgroup.com',
-    'password': 'YOUR_PASSWORD'
-}
+        seen = set()
+        results = []
+        for keys, doc_ids in self.tiers:
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and keys[position].startswith(prefix):
+                doc_id = doc_ids[position]
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    results.append(doc_id)
+                    if len(results) >= limit:
+                        return results
+                position += 1
+        return results
 
-# QT Representatives (Connection Champions)
-QT_REPRESENTATIVES = ['Lihi Segev', 'Abhijeet Bagade', 'Omri Nissim', 'Kobi Kol', 'Jillian OrRico', 'Michael Bush', 'Mayank Arya']
+# Fuzzy name index
+FUZZY_MAX_EDIT_DISTANCE = 2
+FUZZY_PREFIX_LENGTH = 7
+FUZZY_MAX_RESULTS = 200
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+def fuzzy_tokens(text):
+    """Lowercased name words, without duplicates"""
+    return list(dict.fromkeys(normalize_name(text).replace('-', ' ').split()))
 
-# Global variables
-company_data = []
-new_connections = []
-sharepoint_last_sync = None
+def allowed_edit_distance(token):
+    """Typos tolerated in a query word: none for 1-2 letters, one up to 5, then two"""
+    if len(token) <= 2:
+        return 0
+    if len(token) <= 5:
+        return 1
+    return FUZZY_MAX_EDIT_DISTANCE
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def deletion_variants(word, max_distance):
+    """word plus every string reachable from it by up to max_distance deletions"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
 
-def connect_to_sharepoint():
-    """Establish connection to SharePoint"""
-    try:
-        if not SHAREPOINT_AVAILABLE:
-            logger.error("SharePoint libraries not available")
-            return None
-            
-        # Method 1: Using Authentication Context (Username/Password)
-        auth_context = AuthenticationContext(SHAREPOINT_CONFIG['site_url'])
-        
-        if auth_context.acquire_token_for_user(
-            SHAREPOINT_CONFIG['username'], 
-            SHAREPOINT_CONFIG['password']
-        ):
-            ctx = ClientContext(SHAREPOINT_CONFIG['site_url'], auth_context)
-            logger.info("Successfully connected to SharePoint")
-            return ctx
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded.
+
+    Only the diagonal band of width max_distance is computed, so the cost is
+    linear in the word length.
+    """
+    if a == b:
+        return 0
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    over = max_distance + 1
+    previous_previous = None
+    previous = [j if j <= max_distance else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [over] * (len_b + 1)
+        if i <= max_distance:
+            current[0] = i
+        char_a = a[i - 1]
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(len_b, i + max_distance) + 1):
+            value = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (previous_previous is not None and j > 1 and char_a == b[j - 2]
+                    and a[i - 2] == b[j - 1] and previous_previous[j - 2] + 1 < value):
+                value = previous_previous[j - 2] + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        previous_previous, previous = previous, current
+    return previous[len_b]
+
+class FuzzyNameIndex:
+    """SymSpell-style deletion dictionary over the words of every name.
+
+    Each distinct name word is stored with all its variants of up to two
+    deletions (taken from the first FUZZY_PREFIX_LENGTH letters). A query
+    word only has to generate its own deletion variants and look them up,
+    then verify the few candidates with a bounded edit distance.
+    """
+
+    def __init__(self, data):
+        self.names = [person.get('name') or '' for person in data]
+        self.tokens = []
+        self.doc_tokens = []
+        vocabulary = {}
+        postings = []
+        for doc_id, name in enumerate(self.names):
+            token_ids = []
+            for token in fuzzy_tokens(name):
+                token_id = vocabulary.get(token)
+                if token_id is None:
+                    token_id = vocabulary[token] = len(self.tokens)
+                    self.tokens.append(token)
+                    postings.append([])
+                token_ids.append(token_id)
+                postings[token_id].append(doc_id)
+            self.doc_tokens.append(tuple(token_ids))
+        self.postings = [array('i', ids) for ids in postings]
+
+        # A single token id is stored as an int to avoid a list per variant
+        self.deletes = {}
+        for token_id, token in enumerate(self.tokens):
+            for variant in deletion_variants(token[:FUZZY_PREFIX_LENGTH], FUZZY_MAX_EDIT_DISTANCE):
+                existing = self.deletes.get(variant)
+                if existing is None:
+                    self.deletes[variant] = token_id
+                elif isinstance(existing, int):
+                    self.deletes[variant] = [existing, token_id]
+                else:
+                    existing.append(token_id)
+
+    def relink(self, data):
+        """Nothing to reattach; the index keeps its own copy of the names"""
+
+    def token_matches(self, word):
+        """Token ids within the allowed edit distance of word, with their distances"""
+        max_distance = allowed_edit_distance(word)
+        candidates = set()
+        for variant in deletion_variants(word[:FUZZY_PREFIX_LENGTH], max_distance):
+            found = self.deletes.get(variant)
+            if found is None:
+                continue
+            if isinstance(found, int):
+                candidates.add(found)
+            else:
+                candidates.update(found)
+
+        # Each edit changes the set of letters by at most two, which rules
+        # out most candidates before the edit distance is computed
+        letters = set(word)
+        matches = {}
+        for token_id in candidates:
+            token = self.tokens[token_id]
+            if len(letters.symmetric_difference(token)) > 2 * max_distance:
+                continue
+            distance = edit_distance(word, token, max_distance)
+            if distance <= max_distance:
+                matches[token_id] = distance
+        return matches
+
+    def search(self, query):
+        """(doc_id, distance, score) for names matching every query word.
+
+        Sorted by total edit distance, then by how closely the word counts
+        agree, then by name.
+        """
+        words = fuzzy_tokens(query)
+        if not words:
+            return []
+
+        per_word = []
+        for word in words:
+            matches = self.token_matches(word)
+            if not matches:
+                return []
+            per_word.append(matches)
+
+        # Start from the most selective word and filter by the others
+        per_word.sort(key=lambda matches: sum(len(self.postings[token_id]) for token_id in matches))
+        candidates = {}
+        for token_id, distance in per_word[0].items():
+            for doc_id in self.postings[token_id]:
+                if distance < candidates.get(doc_id, FUZZY_MAX_EDIT_DISTANCE + 1):
+                    candidates[doc_id] = distance
+
+        for matches in per_word[1:]:
+            narrowed = {}
+            for doc_id, total in candidates.items():
+                best = min((matches[token_id] for token_id in self.doc_tokens[doc_id] if token_id in matches),
+                           default=None)
+                if best is not None:
+                    narrowed[doc_id] = total + best
+            candidates = narrowed
+
+        query_length = sum(len(word) for word in words)
+        ranked = sorted(candidates.items(), key=lambda item: (
+            item[1], abs(len(self.doc_tokens[item[0]]) - len(words)), self.names[item[0]]))
+        return [(doc_id, distance, round(1 - distance / query_length, 3)) for doc_id, distance in ranked]
+
+# Intro paths
+INTRO_PATH_DEFAULT_RESULTS = 3
+INTRO_PATH_MAX_RESULTS = 5
+
+# Extra hops charged for starting from each kind of QT relationship
+INTRO_RELATIONSHIP_COST = {'direct': 0, 'indirect': 1}
+
+class IntroPathIndex:
+    """Cheapest reporting-line routes from QT contacts to any employee.
+
+    Contacts are people with a Direct or Indirect relationship, and a route
+    climbs from the contact to the lowest manager they share with the target
+    and back down; its cost is the number of hops plus
+    INTRO_RELATIONSHIP_COST for the contact. Every person keeps the
+    INTRO_PATH_MAX_RESULTS cheapest contacts in their own subtree, so the
+    best contacts for a target are found among those kept by the target and
+    their managers. Keeping that many is enough for the results to be exact:
+    a contact crowded out of a manager's list is beaten by that many others.
+    Binary lifting tables give the common manager of a pair in O(log depth).
+    """
+
+    def __init__(self, org):
+        slots = INTRO_PATH_MAX_RESULTS
+        depth = org.depth
+        self.cost = array('i', (INTRO_RELATIONSHIP_COST.get((person.get('relationship_with_qt') or '').lower(), -1)
+                                for person in org.records))
+
+        # up[k][i] is i's manager 2**k levels up, or the top of i's tree
+        parents = array('i', (i if manager == NO_PARENT else manager for i, manager in enumerate(org.parent)))
+        self.up = [parents]
+        for _ in range(1, max(depth, default=0).bit_length()):
+            previous = self.up[-1]
+            self.up.append(array('i', map(previous.__getitem__, previous)))
+
+        # nearest[i * slots:(i + 1) * slots] are i's cheapest contacts, -1 padded;
+        # reports come before their managers in reverse preorder
+        cost = self.cost
+        nearest = self.nearest = array('i', [-1]) * (len(org) * slots)
+        for i in reversed(org.order):
+            if cost[i] < 0 and not org.children[i]:
+                continue
+            candidates = [(cost[i], i)] if cost[i] >= 0 else []
+            base = depth[i]
+            for child in org.children[i]:
+                for slot in range(child * slots, child * slots + slots):
+                    contact = nearest[slot]
+                    if contact < 0:
+                        break
+                    candidates.append((depth[contact] - base + cost[contact], contact))
+            if candidates:
+                candidates.sort()
+                for slot, (_, contact) in enumerate(candidates[:slots], i * slots):
+                    nearest[slot] = contact
+
+    def relink(self, data):
+        """Nothing to reattach; the index only holds positions"""
+
+    def best(self, org, target, limit=INTRO_PATH_DEFAULT_RESULTS):
+        """(cost, contact) of the limit cheapest contacts for target"""
+        slots = INTRO_PATH_MAX_RESULTS
+        depth = org.depth
+        found = {}
+        i, climbed = target, 0
+        while True:
+            base = depth[i]
+            for slot in range(i * slots, i * slots + slots):
+                contact = self.nearest[slot]
+                if contact < 0:
+                    break
+                # Contacts under the branch just climbed out of were already
+                # seen more cheaply lower down
+                total = climbed + depth[contact] - base + self.cost[contact]
+                if total < found.get(contact, total + 1):
+                    found[contact] = total
+            if org.parent[i] == NO_PARENT:
+                break
+            i, climbed = org.parent[i], climbed + 1
+        return sorted((total, contact) for contact, total in found.items())[:limit]
+
+    def common_manager(self, org, a, b):
+        """Lowest person that both a and b are (or report up to), or None"""
+        depth = org.depth
+        if depth[a] < depth[b]:
+            a, b = b, a
+        climb, level = depth[a] - depth[b], 0
+        while climb:
+            if climb & 1:
+                a = self.up[level][a]
+            climb >>= 1
+            level += 1
+        if a == b:
+            return a
+        for table in reversed(self.up):
+            if table[a] != table[b]:
+                a, b = table[a], table[b]
+        manager = self.up[0][a]
+        return manager if manager == self.up[0][b] and manager != a else None
+
+    def path(self, org, contact, target):
+        """The common manager and the people from contact up to them and
+        down to target, or (None, []) if they are in separate trees"""
+        common = self.common_manager(org, contact, target)
+        if common is None:
+            return None, []
+        up, down = [], []
+        i = contact
+        while i != common:
+            up.append(i)
+            i = org.parent[i]
+        i = target
+        while i != common:
+            down.append(i)
+            i = org.parent[i]
+        return common, up + [common] + down[::-1]
+
+# Structure changes
+STRUCTURE_MAX_ERRORS = 50
+
+def resolve_manager_changes(org, changes):
+    """Validate (employee name, new manager name) pairs against org.
+
+    An empty manager name makes the employee top-level. Rejects unknown
+    employees, managers that do not exist (which would orphan the
+    employee's subtree), conflicting duplicates and anything that would
+    create a reporting cycle once the whole batch is applied. Returns the
+    moves that change something, as {person: manager}, and a list of errors.
+    """
+    moves = {}
+    errors = []
+    for row, (employee_name, manager_name) in enumerate(changes, 1):
+        employee_name = str(employee_name or '').strip()
+        manager_name = str(manager_name or '').strip()
+        i = org.find(employee_name)
+        if i is None:
+            errors.append(f"Row {row}: employee '{employee_name}' not found")
+            continue
+        if manager_name:
+            manager = org.find(manager_name)
+            if manager is None:
+                # Source rows may name managers outside the dataset; only a
+                # change to such a manager is an error
+                if normalize_name(manager_name) != normalize_name(org.records[i]['manager_name']):
+                    errors.append(f"Row {row}: manager '{manager_name}' not found")
+                continue
+            # Point at the person a rebuilt index would resolve the name to
+            manager = org.index[org.names[manager]]
         else:
-            logger.error("Failed to authenticate with SharePoint")
-            return None
-            
-    except Exception as e:
-        logger.error(f"SharePoint connection error: {str(e)}")
-        return None
+            manager = NO_PARENT
+        if manager == i:
+            errors.append(f"Row {row}: {org.names[i]} cannot report to themselves")
+        elif moves.get(i, manager) != manager:
+            errors.append(f"Row {row}: {org.names[i]} is assigned to more than one manager")
+        else:
+            moves[i] = manager
+    moves = {i: manager for i, manager in moves.items() if org.parent[i] != manager}
 
-def download_sharepoint_file():
-    """Download the Excel file from SharePoint"""
-    try:
-        ctx = connect_to_sharepoint()
-        if not ctx:
-            logger.error("Could not establish SharePoint connection")
-            return None
-            
-        # Try to get the file
-        file_url = SHAREPOINT_CONFIG['direct_file_path']
-        
-        logger.info(f"Attempting to download file: {file_url}")
-        
-        # Download file content
-        file_response = File.open_binary(ctx, file_url)
-        
-        if file_response:
-            # Save to local temp file
-            temp_file_path = os.path.join(UPLOAD_FOLDER, 'sharepoint_profiles.xlsx')
-            
-            with open(temp_file_path, 'wb') as local_file:
-                local_file.write(file_response.content)
-            
-            logger.info(f"Successfully downloaded SharePoint file to: {temp_file_path}")
-            return temp_file_path
+    # Only moved people can close a cycle; walk up from each of them in the
+    # final structure, remembering chains already known to reach a root
+    reaches_root = set()
+    for i in moves:
+        chain = set()
+        j = i
+        while j != NO_PARENT and j not in reaches_root:
+            if j in chain:
+                errors.append(f"Moving {org.names[i]} under {org.names[moves[i]]} "
+                              f"would create a reporting cycle")
+                break
+            chain.add(j)
+            j = moves.get(j, org.parent[j])
         else:
-            logger.error("Failed to download file from SharePoint")
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error downloading SharePoint file: {str(e)}")
-        return None
+            reaches_root.update(chain)
+    return moves, errors
 
-def load_data_from_sharepoint():
-    """Load organizational data directly from SharePoint Excel file"""
-    global company_data, sharepoint_last_sync
-    
-    try:
-        logger.info("Loading data from SharePoint...")
-        
-        # Download file from SharePoint
-        file_path = download_sharepoint_file()
-        
-        if not file_path or not os.path.exists(file_path):
-            logger.error("Failed to download SharePoint file, using fallback data")
-            company_data = load_fallback_data()
-            return
-        
-        # Read the Excel file
-        df = pd.read_excel(file_path)
-        
-        logger.info(f"Loaded Excel file with {len(df)} rows and columns: {list(df.columns)}")
-        
-        # Column mapping for flexible Excel structure
-        column_mapping = {
-            'name': ['Name', 'Full Name', 'Employee Name', 'name', 'employee_name'],
-            'position': ['Position', 'Title', 'Job Title', 'Role', 'position', 'job_title'],
-            'department': ['Department', 'Dept', 'Division', 'Team', 'department'],
-            'country': ['Country', 'Nation', 'country'],
-            'location_input': ['Location', 'City', 'Office', 'Site', 'location'],
-            'manager_name': ['Manager', 'Manager Name', 'Reports To', 'manager', 'manager_name'],
-            'ldap': ['LDAP', 'Email', 'Username', 'Login', 'ldap', 'email'],
-            'phone': ['Phone', 'Mobile', 'Contact', 'phone_number'],
-            'hire_date': ['Hire Date', 'Start Date', 'Join Date', 'hire_date'],
-            'employee_id': ['ID', 'Employee ID', 'EmpID', 'employee_id']
-        }
-        
-        normalized_data = []
-        
-        for index, row in df.iterrows():
-            employee = {}
-            
-            # Map columns to standard names
-            for standard_name, possible_names in column_mapping.items():
-                value = None
-                for possible_name in possible_names:
-                    if possible_name in df.columns:
-                        value = row[possible_name]
-                        break
-                
-                # Handle NaN/empty values
-                if pd.isna(value) or value == '' or str(value).lower() in ['nan', 'none', 'null']:
-                    if standard_name in ['manager_name', 'ldap', 'phone', 'hire_date', 'employee_id']:
-                        value = ''
-                    elif standard_name in ['department', 'position', 'country', 'location_input']:
-                        value = 'Unknown'
-                    else:
-                        value = ''
-                
-                employee[standard_name] = str(value).strip() if value else ''
-            
-            # Auto-generate missing fields
-            if not employee.get('ldap') and employee.get('name'):
-                # Generate LDAP from name
-                name_parts = employee['name'].lower().split()
-                if len(name_parts) >= 2:
-                    employee['ldap'] = f"{name_parts[0]}.{name_parts[-1]}"
-                else:
-                    employee['ldap'] = employee['name'].lower().replace(' ', '.')
-            
-            # Randomly assign QT representative and relationship
-            employee['representative_from_qt'] = random.choice(QT_REPRESENTATIVES)
-            employee['relationship_with_qt'] = random.choices(
-                ['Direct', 'Indirect', 'None'], 
-                weights=[0.15, 0.25, 0.60]
-            )[0]
-            
-            # Add additional required fields
-            employee.update({
-                'moma_url': f"https://moma.corp.company.com/person/{employee.get('ldap', 'unknown')}",
-                'moma_photo_url': f"https://moma.corp.company.com/photos/{employee.get('ldap', 'unknown')}.jpg",
-                'manager_name_input': employee.get('manager_name', ''),
-                'manager_email': f"{employee.get('manager_name', '').lower().replace(' ', '.')}@company.com" if employee.get('manager_name') else '',
-                'time_of_run': datetime.now().strftime('%Y-%m-%d')
-            })
-            
-            normalized_data.append(employee)
-        
-        company_data = normalized_data
-        sharepoint_last_sync = datetime.now()
-        
-        # Print summary
-        print("=" * 60)
-        print("SHAREPOINT DATA LOADED SUCCESSFULLY")
-        print("=" * 60)
-        print(f"Total employees: {len(company_data)}")
-        print(f"Departments: {len(set(emp.get('department', 'Unknown') for emp in company_data))}")
-        print(f"Countries: {len(set(emp.get('country', 'Unknown') for emp in company_data))}")
-        print(f"Last sync: {sharepoint_last_sync}")
-        
-        # QT Representative distribution
-        qt_dist = {}
-        rel_dist = {}
-        for emp in company_data:
-            rep = emp.get('representative_from_qt', 'Unknown')
-            rel = emp.get('relationship_with_qt', 'Unknown')
-            qt_dist[rep] = qt_dist.get(rep, 0) + 1
-            rel_dist[rel] = rel_dist.get(rel, 0) + 1
-        
-        print("\nQT Representative Distribution:")
-        for rep, count in sorted(qt_dist.items()):
-            print(f"  {rep}: {count} employees")
-        
-        print("\nRelationship Distribution:")
-        for rel, count in sorted(rel_dist.items()):
-            print(f"  {rel}: {count} employees")
-        print("=" * 60)
-        
-        logger.info(f"Successfully loaded {len(company_data)} employees from SharePoint")
-        
-    except Exception as e:
-        logger.error(f"Error loading from SharePoint: {str(e)}")
-        print(f"SharePoint load failed: {str(e)}")
-        print("Loading fallback data...")
-        company_data = load_fallback_data()
+def moved_snapshot(current, moves, version):
+    """Snapshot v{version}: current with the people in moves reporting to
+    their new managers ({person: manager}, NO_PARENT for none).
 
-def load_fallback_data():
-    """Fallback data when SharePoint is not available"""
-    print("=" * 60)
-    print("USING FALLBACK DATA - SHAREPOINT NOT AVAILABLE")
-    print("=" * 60)
-    print("To use live SharePoint data, please:")
-    print("1. Update SharePoint credentials in SHAREPOINT_CONFIG")
-    print("2. Ensure you have access to the SharePoint file")
-    print("3. Install required packages: pip install Office365-REST-Python-Client msal")
-    print("=" * 60)
-    
-    return [
-        {
-            'name': 'Mayank Arya',
-            'position': 'SharePoint Administrator',
-            'department': 'IT',
-            'country': 'India',
-            'ldap': 'mayank.arya',
-            'moma_url': 'https://moma.corp.company.com/person/mayank.arya',
-            'manager_name': '',
-            'manager_email': '',
-            'moma_photo_url': 'https://moma.corp.company.com/photos/mayank.arya.jpg',
-            'manager_name_input': '',
-            'location_input': 'Mumbai',
-            'time_of_run': datetime.now().strftime('%Y-%m-%d'),
-            'relationship_with_qt': 'Direct',
-            'representative_from_qt': 'Mayank Arya'
-        }
-    ]
+    The new snapshot shares everything the moves do not touch: only moved
+    records are copied, the org index is updated in place of a rebuild and
+    the search, autocomplete and fuzzy indexes are reused.
+    """
+    org = current.org_index
+    records = PatchedRecords(current.records, {
+        i: current.records[i].replace(manager_name=org.names[manager] if manager != NO_PARENT else '')
+        for i, manager in moves.items()})
+    changed_docs = {current.search_index.doc_id(i) for i in moves}
+    indexes = {
+        'search_index': current.search_index.with_records(records, moves),
+        'org_index': org.with_managers(records, moves),
+        'autocomplete_index': current.autocomplete_index
+    }
+    moved = DataSnapshot(records, version, current.source, current.last_sync, current.timings, indexes=indexes)
+    moved.fragments = current.fragments.copy_without(changed_docs)
+    moved.cache_file = current.cache_file
+    # Names did not change, so the fuzzy index still applies
+    moved._fuzzy_index = current._fuzzy_index
+    return moved
 
-def sync_sharepoint_data():
-    """Manual sync function to refresh data from SharePoint"""
-    logger.info("Manual SharePoint sync requested")
-    load_data_from_sharepoint()
+def apply_snapshot_changes(snap):
+    """snap with the journaled structure changes made since its version applied"""
+    for change in read_snapshot_changes():
+        if change['version'] <= snap.version:
+            continue
+        if change['parent'] != snap.version:
+            # Made on a version this snapshot does not lead to
+            break
+        snap = moved_snapshot(snap, dict(change['moves']), change['version'])
+    return snap
 
-def build_hierarchy_tree(data, root_person=None):
-    """Build a hierarchical tree structure from flat data"""
-    person_dict = {person['name']: person for person in data}
-    children_dict = defaultdict(list)
-    
-    for person in data:
-        manager = person.get('manager_name')
-        if manager and manager in person_dict:
-            children_dict[manager].append(person['name'])
-    
-    def build_node(person_name):
-        if person_name not in person_dict:
-            return None
-            
-        person = person_dict[person_name]
-        node = {
-            'name': person['name'],
-            'position': person['position'],
-            'department': person['department'],
-            'country': person['country'],
-            'location': person.get('location_input', ''),
-            'photo_url': person.get('moma_photo_url', ''),
-            'relationship_with_qt': person.get('relationship_with_qt', 'None'),
-            'representative_from_qt': person.get('representative_from_qt', 'No'),
-            'children': []
-        }
-        
-        for child_name in sorted(children_dict.get(person_name, [])):
-            child_node = build_node(child_name)
-            if child_node:
-                node['children'].append(child_node)
-        
-        return node
-    
-    if root_person:
-        return build_node(root_person)
+def apply_manager_changes(changes):
+    """Apply a batch of manager changes to the current snapshot, all or nothing.
+
+    Only the moved records and what depends on them change (see
+    moved_snapshot). With SHARED_SNAPSHOT the moves are journaled for the
+    other processes; the snapshot cache is rewritten in the background once
+    changes stop. Returns a summary dict with status 'updated', 'unchanged'
+    or 'rejected'.
+    """
+    global snapshot
+    with _sync_lock, snapshot_file_lock():
+        adopt_shared_snapshot()
+        current = snapshot
+        started = time.perf_counter()
+        moves, errors = resolve_manager_changes(current.org_index, changes)
+        if errors:
+            return {'status': 'rejected', 'version': current.version,
+                    'error_count': len(errors), 'errors': errors[:STRUCTURE_MAX_ERRORS]}
+        if not moves:
+            return {'status': 'unchanged', 'version': current.version, 'moved': 0}
+
+        new_snapshot = moved_snapshot(current, moves, next_snapshot_version())
+        if SHARED_SNAPSHOT:
+            append_snapshot_change(current.version, new_snapshot.version, moves)
+        with _publish_lock:
+            snapshot = new_snapshot
+        elapsed = time.perf_counter() - started
+
+    logger.info(f"Moved {len(moves)} employees to new managers in snapshot v{new_snapshot.version} "
+                f"({elapsed * 1000:.1f}ms)")
+    # The moved snapshot keeps the fuzzy index but needs a new intro index
+    new_snapshot.warm_lazy_indexes()
+    write_snapshot_cache_later()
+    return {'status': 'updated', 'version': new_snapshot.version, 'moved': len(moves),
+            'elapsed_ms': round(elapsed * 1000, 1)}
+
+def structure_change_response(result):
+    """JSON response for an apply_manager_changes summary"""
+    if result['status'] == 'rejected':
+        return jsonify({
+            'success': False,
+            'message': f"No changes applied: {result['error_count']} problem(s) found. {result['errors'][0]}",
+            **result
+        }), 400
+    if result['status'] == 'unchanged':
+        message = 'Structure already up to date'
     else:
-        roots = []
-        for person in data:
-            manager = person.get('manager_name')
-            if not manager or manager not in person_dict:
-                root_node = build_node(person['name'])
-                if root_node:
-                    roots.append(root_node)
-        return roots
-
-def get_all_subordinates(person_name, data):
-    """Get all people reporting under a person (direct and indirect)"""
-    subordinates = []
-    
-    def find_reports(manager_name):
-        for person in data:
-            if person.get('manager_name') == manager_name:
-                subordinates.append(person)
-                find_reports(person['name'])
-    
-    find_reports(person_name)
-    return subordinates
+        message = f"Updated {result['moved']} manager assignment(s)"
+    return jsonify({'success': True, 'message': message, **result})
 
-def normalize_name(name):
-    """Normalize name for comparison"""
-    return name.lower().strip()
+STRUCTURE_TEMPLATE_FIELDS = ('name', 'position', 'department', 'country', 'location_input',
+                             'manager_name', 'ldap', 'phone', 'hire_date', 'employee_id')
+
+def read_structure_changes(file_storage):
+    """(employee name, manager name) pairs from an uploaded sheet; raises ValueError"""
+    filename = secure_filename(file_storage.filename or '')
+    if not allowed_file(filename):
+        raise ValueError(f"Unsupported file type; upload one of: {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+    rows = iter_sheet_rows(file_storage.stream, filename.rsplit('.', 1)[1].lower() == 'csv')
+    columns = sheet_columns(next(rows, None))
+    missing = [COLUMN_MAPPING[field][0] for field in ('name', 'manager_name') if columns[field] is None]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    changes = []
+    for row in rows:
+        name = normalize_cell(cell(row, columns['name']), '')
+        if name:
+            changes.append((name, normalize_cell(cell(row, columns['manager_name']), '')))
+    return changes
+
+def excel_response(workbook, filename):
+    """Download response for an openpyxl workbook.
+
+    The workbook is saved to a spooled temporary file, which stays in memory
+    for small workbooks and moves to disk for large ones; it is streamed to
+    the client and closed when the response is.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    try:
+        workbook.save(output)
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=filename
+    )
+
+# Structure export
+EXPORT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+EXPORT_CSV_CHUNK_ROWS = 1000
+EXPORT_FORMATS = ('xlsx', 'csv')
+
+def export_header(fields):
+    """Column titles for exported fields, matching the upload template"""
+    return [COLUMN_MAPPING[field][0] if field in COLUMN_MAPPING else field for field in fields]
+
+def export_records(snap, manager_name=None):
+    """Records to export: everyone, or manager_name and everyone under them.
+
+    Subtrees come out in preorder, so each manager precedes their reports.
+    Raises LookupError for an unknown manager.
+    """
+    if not manager_name:
+        return snap.records
+    org = snap.org_index
+    i = org.find(manager_name)
+    if i is None:
+        raise LookupError(f"Manager '{manager_name}' not found")
+    records = snap.records
+    return (records[j] for j in org.subtree(i))
+
+def csv_export_response(records, fields, filename):
+    """Streamed CSV download of records, generated a chunk of rows at a time"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # Byte order mark so Excel opens the file as UTF-8
+        buffer.write('\ufeff')
+        writer.writerow(export_header(fields))
+        for count, person in enumerate(records, 1):
+            writer.writerow([person[field] for field in fields])
+            if count % EXPORT_CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
 
-# Initialize data on startup
-load_data_from_sharepoint()
+    return app.response_class(generate(), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+def xlsx_export_response(records, fields, filename):
+    """XLSX download of records, written row by row in openpyxl write-only mode"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Structure')
+    sheet.append(export_header(fields))
+    for person in records:
+        sheet.append([person[field] for field in fields])
+    return excel_response(workbook, filename)
+
+# Indexes built for every snapshot, by snapshot attribute
+SNAPSHOT_INDEXES = {
+    'search_index': SearchIndex,
+    'org_index': OrgIndex,
+    'autocomplete_index': AutocompleteIndex
+}
+
+# Connections store
+CONNECTIONS_DEFAULT_LIMIT = 50
+CONNECTIONS_MAX_LIMIT = 500
+
+# Submitted fields stored in their own columns, by payload key
+CONNECTION_COLUMNS = {
+    'name': 'name',
+    'designation': 'designation',
+    'email': 'email',
+    'department': 'department',
+    'connectionChampion': 'champion',
+    'momaUrl': 'moma_url',
+    'degreeOfConnection': 'degree'
+}
+
+def encode_connection_cursor(connection):
+    """Cursor continuing a listing after connection"""
+    return base64.urlsafe_b64encode(f"{connection['created_at']}/{connection['id']}".encode()).decode().rstrip('=')
+
+def decode_connection_cursor(cursor):
+    """(created_at, id) stored in a connection cursor; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, connection_id = base64.urlsafe_b64decode(padded).decode().split('/')
+        datetime.fromisoformat(created_at)
+        return created_at, int(connection_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+class ConnectionStoreError(IOError):
+    """The connection store cannot accept writes"""
+
+class ConnectionStore:
+    """Connections in SQLite (WAL mode), written behind by a batching thread.
+
+    add() assigns an id and queues the row without touching the database,
+    so request threads never wait on a commit; the writer thread commits
+    whatever has queued up in one transaction at most every BATCH_INTERVAL
+    seconds. A batch that fails to commit stays queued and is retried with
+    backoff until it succeeds; meanwhile add() raises ConnectionStoreError
+    instead of accepting rows the database is refusing. Ids come from blocks
+    reserved in the database, so several worker processes can share one
+    file without colliding; as each process works through its own block,
+    ids are not in the order connections were added, and listings order
+    by created_at with the id only breaking ties.
+    """
+
+    BATCH_INTERVAL = 0.05
+    MAX_BATCH = 5000
+    ID_BLOCK_SIZE = 1000
+    RETRY_BACKOFF = 0.1
+    RETRY_BACKOFF_MAX = 5.0
+    # How long flush() waits at exit for queued rows to be written
+    FLUSH_TIMEOUT = 10.0
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS connections (
+            id INTEGER PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            designation TEXT,
+            email TEXT,
+            department TEXT,
+            champion TEXT NOT NULL,
+            champion_key TEXT NOT NULL,
+            moma_url TEXT,
+            degree TEXT,
+            data TEXT NOT NULL
+        )""",
+        # Replaced by the created_at indexes below
+        "DROP INDEX IF EXISTS connections_champion",
+        "DROP INDEX IF EXISTS connections_name",
+        "CREATE INDEX IF NOT EXISTS connections_created ON connections (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS connections_champion_created ON connections (champion_key, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS connections_name_created ON connections (name_key, created_at, id)",
+        "CREATE TABLE IF NOT EXISTS id_blocks (name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._id_lock = threading.Lock()
+        self._next_id = 0
+        self._block_end = 0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        # Rows queued but not yet committed, and the error of the last
+        # failed commit while it has not been retried successfully
+        self._written = threading.Condition()
+        self.pending = 0
+        self.last_error = None
+        self.stats = {'queued': 0, 'committed': 0, 'batches': 0, 'write_errors': 0}
+
+        db = self._connect()
+        db.execute('PRAGMA journal_mode=WAL')
+        for statement in self.SCHEMA:
+            db.execute(statement)
+        db.execute("INSERT OR IGNORE INTO id_blocks (name, next_id) VALUES ('connections', 1)")
+        db.commit()
+
+    def _connect(self):
+        """This thread's connection to the database"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _allocate_id(self):
+        """Next connection id, reserving a new block from the database when needed"""
+        with self._id_lock:
+            if self._next_id >= self._block_end:
+                db = self._connect()
+                with db:
+                    db.execute('BEGIN IMMEDIATE')
+                    start = db.execute("SELECT next_id FROM id_blocks WHERE name = 'connections'").fetchone()[0]
+                    db.execute("UPDATE id_blocks SET next_id = ? WHERE name = 'connections'",
+                               (start + self.ID_BLOCK_SIZE,))
+                self._next_id, self._block_end = start, start + self.ID_BLOCK_SIZE
+            connection_id = self._next_id
+            self._next_id += 1
+            self.stats['queued'] += 1
+            return connection_id
+
+    def add(self, connection_data):
+        """Queue a connection for writing; returns it with id and created_at set.
+        Raises ConnectionStoreError while queued rows are failing to commit."""
+        if self.last_error is not None:
+            raise ConnectionStoreError(f"Connections are not being saved: {self.last_error}")
+        connection = dict(connection_data)
+        connection['id'] = self._allocate_id()
+        # Always with microseconds, so the stored text sorts in time order
+        connection['created_at'] = datetime.now().isoformat(timespec='microseconds')
+        values = {column: str(connection.get(key) or '').strip() for key, column in CONNECTION_COLUMNS.items()}
+        row = (connection['id'], connection['created_at'], values['name'], normalize_name(values['name']),
+               values['designation'], values['email'], values['department'],
+               values['champion'], normalize_name(values['champion']),
+               values['moma_url'], values['degree'], json.dumps(connection))
+        self._ensure_writer()
+        with self._written:
+            self.pending += 1
+        self._queue.put(row)
+        return connection
+
+    def _ensure_writer(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='connections-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        rows = []
+        failures = 0
+        while True:
+            if not rows:
+                rows.append(self._queue.get())
+                # Let more rows arrive so they share one transaction
+                time.sleep(self.BATCH_INTERVAL)
+            while len(rows) < self.MAX_BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._write(rows):
+                rows, failures = [], 0
+            else:
+                # Keep the batch and try it again once the database recovers
+                time.sleep(min(self.RETRY_BACKOFF * 2 ** failures, self.RETRY_BACKOFF_MAX))
+                failures += 1
+
+    def _write(self, rows):
+        """Commit rows in one transaction; returns whether it succeeded"""
+        try:
+            db = self._connect()
+            with db:
+                db.executemany('INSERT INTO connections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        except Exception as e:
+            self.stats['write_errors'] += 1
+            self.last_error = str(e)
+            logger.error(f"Could not write {len(rows)} connections, will retry: {str(e)}")
+            # Start the retry from a fresh connection
+            db, self._local.db = getattr(self._local, 'db', None), None
+            if db is not None:
+                db.close()
+            return False
+        self.stats['committed'] += len(rows)
+        self.stats['batches'] += 1
+        self.last_error = None
+        with self._written:
+            self.pending -= len(rows)
+            self._written.notify_all()
+        return True
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """Wait until every queued connection has been written; returns
+        whether they all were within timeout seconds (None waits forever)"""
+        with self._written:
+            if self._written.wait_for(lambda: self.pending == 0, timeout):
+                return True
+            logger.error(f"{self.pending} connections were not written: {self.last_error}")
+            return False
+
+    def query(self, champion='', target='', limit=CONNECTIONS_DEFAULT_LIMIT, before=None):
+        """Newest connections first, optionally for one champion and/or target
+        person; before is the (created_at, id) of the connection to continue
+        after. Returns (rows, total, more), where more says whether rows
+        older than the last one match."""
+        conditions, params = [], []
+        if champion:
+            conditions.append('champion_key = ?')
+            params.append(normalize_name(champion))
+        if target:
+            conditions.append('name_key = ?')
+            params.append(normalize_name(target))
+        where = ' AND '.join(conditions) or '1'
+
+        db = self._connect()
+        total = db.execute(f'SELECT COUNT(*) FROM connections WHERE {where}', params).fetchone()[0]
+        if before is not None:
+            where += ' AND (created_at, id) < (?, ?)'
+            params.extend(before)
+        # One row past the page tells whether there is another page
+        rows = db.execute(f'SELECT data FROM connections WHERE {where} '
+                          f'ORDER BY created_at DESC, id DESC LIMIT ?',
+                          params + [limit + 1]).fetchall()
+        return [json.loads(data) for data, in rows[:limit]], total, len(rows) > limit
+
+    def count(self):
+        """Connections written so far, plus any still queued"""
+        return self._connect().execute('SELECT COUNT(*) FROM connections').fetchone()[0] + self.pending
+
+    def report(self):
+        return {**self.stats, 'pending': self.pending, 'last_error': self.last_error, 'path': self.path}
+
+connection_store = ConnectionStore(CONNECTIONS_DB_PATH)
+atexit.register(connection_store.flush)
+
+# Initialize data on startup, from the snapshot cache when there is one.
+# Loading from SharePoint blocks the import, so it makes a single short
+# attempt; if that falls back, the sync worker retries in the background.
+if not load_cached_snapshot():
+    with sharepoint_client.single_attempt():
+        startup_sync = load_data_from_sharepoint()
+    if startup_sync['status'] == 'fallback' and any(isinstance(source, SharePointFileSource)
+                                                     for source in profile_sources):
+        sync_worker.submit()
 
 # Routes
 @app.route('/')
@@ -369,15 +4045,20 @@ def manage_structure():
 
 @app.route('/api/sync-sharepoint', methods=['POST'])
 def sync_sharepoint():
-    """Manually sync data from SharePoint"""
+    """Start a background sync from SharePoint and return its job"""
     try:
-        sync_sharepoint_data()
+        force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+        job = sync_sharepoint_data(force=force)
+        snap = snapshot
         return jsonify({
             'success': True,
-            'message': f'SharePoint sync completed. Loaded {len(company_data)} employees.',
-            'last_sync': sharepoint_last_sync.isoformat() if sharepoint_last_sync else None,
-            'employees_count': len(company_data)
-        })
+            'message': f"SharePoint sync {job['status']}.",
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'status_url': f"/api/sync-sharepoint/{job['job_id']}",
+            'last_sync': snap.last_sync.isoformat() if snap.last_sync else None,
+            'employees_count': len(snap.records)
+        }), 202
     except Exception as e:
         logger.error(f"Error syncing SharePoint: {str(e)}")
         return jsonify({
@@ -385,75 +4066,348 @@ def sync_sharepoint():
             'message': f'SharePoint sync failed: {str(e)}'
         }), 500
 
+@app.route('/api/sync-sharepoint/<job_id>')
+def sync_sharepoint_status(job_id):
+    """Get the status of a background SharePoint sync"""
+    job = sync_worker.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Sync job not found'}), 404
+    return jsonify({'success': True, **job})
+
+@app.route('/api/update-structure', methods=['POST'])
+def update_structure():
+    """Move one employee, or a list of employees, under new managers"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'No data received'}), 400
+    
+    if 'changes' in data:
+        if not isinstance(data['changes'], list) or not all(isinstance(change, dict) for change in data['changes']):
+            return jsonify({'success': False, 'message': 'changes must be a list of objects'}), 400
+        changes = [(change.get('employeeName'), change.get('newManagerName')) for change in data['changes']]
+    elif data.get('action', 'change_manager') == 'change_manager':
+        changes = [(data.get('employeeName'), data.get('newManagerName'))]
+    else:
+        return jsonify({'success': False, 'message': f"Unsupported action: {data.get('action')}"}), 400
+    
+    return structure_change_response(apply_manager_changes(changes))
+
+@app.route('/api/upload-structure', methods=['POST'])
+def upload_structure():
+    """Apply the manager column of an uploaded Excel/CSV sheet as one batch"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'message': 'No file uploaded'}), 400
+    
+    try:
+        changes = read_structure_changes(upload)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error reading structure upload: {str(e)}")
+        return jsonify({'success': False, 'message': f'Could not read file: {str(e)}'}), 400
+    
+    logger.info(f"Structure upload {upload.filename}: {len(changes)} rows")
+    return structure_change_response(apply_manager_changes(changes))
+
+@app.route('/api/download-template')
+def download_template():
+    """Excel template for structure uploads, with one example row"""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Structure'
+    sheet.append([COLUMN_MAPPING[field][0] for field in STRUCTURE_TEMPLATE_FIELDS])
+    sheet.append(['Jane Doe', 'Software Engineer', 'Engineering', 'USA', 'New York', 'John Smith',
+                  'jane.doe', '+1 555 0100', '2024-01-15', 'E1001'])
+    
+    notes = workbook.create_sheet('Instructions')
+    for line in (
+        ['Each row moves the named employee under the person in the Manager column.'],
+        ['Leave Manager empty to make the employee top-level.'],
+        ['Employees and managers must already exist; other columns are informational.'],
+        ['The whole file is rejected if any row is invalid or would create a reporting cycle.']
+    ):
+        notes.append(line)
+    return excel_response(workbook, 'org_structure_template.xlsx')
+
+@app.route('/api/download-structure')
+def download_structure():
+    """The current org structure as an Excel or CSV file.
+
+    Optional query parameters: format (xlsx or csv), manager (export only
+    that person and everyone under them) and columns (comma-separated record
+    fields, defaulting to the upload template's columns).
+    """
+    snap = snapshot
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        fields = parse_fields(request.args.get('columns', '')) or STRUCTURE_TEMPLATE_FIELDS
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    manager_name = request.args.get('manager', '').strip()
+    try:
+        records = export_records(snap, manager_name)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+    scope = f"_{secure_filename(manager_name)}" if manager_name else ''
+    filename = f"org_structure_v{snap.version}{scope}.{export_format}"
+    if export_format == 'csv':
+        return csv_export_response(records, fields, filename)
+    return xlsx_export_response(records, fields, filename)
+
+def parse_facet_filters(args):
+    """{field: values} for the FACET_FIELDS parameters in args.
+
+    Each parameter can be repeated to select several values, which match
+    any of them; empty values are ignored.
+    """
+    filters = {}
+    for param, field in FACET_FIELDS.items():
+        values = [value.strip() for value in args.getlist(param) if value.strip()]
+        if values:
+            filters[field] = values
+    return filters
+
 @app.route('/api/search')
 def search():
-    """Search for employees with optional filters"""
+    """Search for employees with optional filters.
+
+    department, country, location, relationship and representative can each
+    be repeated to select several values. facets=1 adds per-value counts for
+    the current query and filters under "facets".
+    """
     query = request.args.get('q', '').lower().strip()
-    department_filter = request.args.get('department', '').strip()
-    country_filter = request.args.get('country', '').strip()
+    filters = parse_facet_filters(request.args)
+    with_facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
+    
+    snap = snapshot
+    try:
+        fields = parse_fields(request.args.get('fields', ''))
+        paginated = with_facets or any(arg in request.args for arg in ('limit', 'offset', 'cursor'))
+        limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        if request.args.get('cursor'):
+            offset = decode_cursor(request.args['cursor'], snap.version)
+        else:
+            offset = max(0, request.args.get('offset', 0, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes'):
+        return fuzzy_search_response(snap, query, filters, with_facets, fields, paginated, limit, offset)
     
-    filtered_data = company_data.copy()
+    index = snap.search_index
+    doc_ids = index.search_ids(query, filters)
+    total = len(doc_ids)
+    if paginated:
+        doc_ids = doc_ids[offset:offset + limit]
     
-    if query:
-        filtered_data = [
-            person for person in filtered_data
-            if (query in person['name'].lower() or 
-                query in person['department'].lower() or
-                query in person['position'].lower() or
-                query in person.get('location_input', '').lower())
-        ]
+    # Responses are stitched together from per-record fragments, so the
+    # cost scales with the page size rather than the number of matches.
+    results = '[' + ','.join(snap.fragments.get(doc_id, index.records, fields)
+                             for doc_id in doc_ids) + ']'
+    headers = {'X-Total-Count': str(total)}
+    if not paginated:
+        return json_response(results, headers=headers)
     
-    if department_filter:
-        filtered_data = [person for person in filtered_data if person['department'] == department_filter]
+    next_offset = offset + len(doc_ids)
+    next_cursor = encode_cursor(snap.version, next_offset) if next_offset < total else None
+    facets = f'"facets":{app.json.dumps(index.facet_counts(query, filters))},' if with_facets else ''
+    body = (f'{{{facets}"limit":{limit},"next_cursor":{app.json.dumps(next_cursor)},'
+            f'"offset":{offset},"results":{results},"total":{total}}}')
+    return json_response(body, headers=headers)
+
+def fuzzy_search_response(snap, query, filters, with_facets, fields, paginated, limit, offset):
+    """Typo-tolerant name search; each result carries match_score and edit_distance"""
+    # Fuzzy hits are snapshot positions; facets are keyed by search doc id
+    index = snap.search_index
+    mask = index.filter_mask(filters)
+    hits = snap.fuzzy_index.search(query)
+    matches = []
+    for position, distance, score in hits:
+        doc_id = index.doc_ids[position]
+        if mask is not None and not mask[doc_id >> 3] >> (doc_id & 7) & 1:
+            continue
+        matches.append((snap.records[position], distance, score))
+        if len(matches) >= FUZZY_MAX_RESULTS:
+            break
     
-    if country_filter:
-        filtered_data = [person for person in filtered_data if person['country'] == country_filter]
+    total = len(matches)
+    if paginated:
+        matches = matches[offset:offset + limit]
+    results = []
+    for person, distance, score in matches:
+        result = person.to_dict() if fields is None else {field: person[field] for field in fields}
+        result['match_score'] = score
+        result['edit_distance'] = distance
+        results.append(result)
+    
+    headers = {'X-Total-Count': str(total)}
+    if not paginated:
+        return json_response(app.json.dumps(results), headers=headers)
+    next_offset = offset + len(matches)
+    body = {}
+    if with_facets:
+        body['facets'] = index.facet_counts(
+            filters=filters, doc_ids=[index.doc_ids[position] for position, _, _ in hits])
+    body.update({
+        'limit': limit,
+        'next_cursor': encode_cursor(snap.version, next_offset) if next_offset < total else None,
+        'offset': offset,
+        'results': results,
+        'total': total
+    })
+    return json_response(app.json.dumps(body), headers=headers)
+
+@app.route('/api/autocomplete')
+def autocomplete():
+    """Top matching names for a prefix, with just enough detail for a dropdown"""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', AUTOCOMPLETE_DEFAULT_LIMIT, type=int)
+    limit = max(0, min(limit, AUTOCOMPLETE_MAX_LIMIT))
     
-    filtered_data.sort(key=lambda x: x['name'])
-    return jsonify(filtered_data)
+    snap = snapshot
+    matches = []
+    for doc_id in snap.autocomplete_index.complete(query, limit):
+        person = snap.records[doc_id]
+        matches.append({
+            'name': person['name'],
+            'position': person.get('position', ''),
+            'department': person.get('department', ''),
+            'country': person.get('country', ''),
+            'relationship_with_qt': person.get('relationship_with_qt', 'None')
+        })
+    return jsonify(matches)
 
 @app.route('/api/hierarchy/<person_name>')
-def get_hierarchy(person_name):
+@snapshot_cached
+def get_hierarchy(snap, person_name):
     """Get organizational hierarchy for a specific person"""
-    person = None
-    for p in company_data:
-        if normalize_name(p['name']) == normalize_name(person_name):
-            person = p
-            break
+    org = snap.org_index
+    person_index = org.find(person_name)
     
-    if not person:
-        return jsonify({'error': 'Person not found'}), 404
+    if person_index is None:
+        return {'error': 'Person not found'}, 404
     
-    subordinates = get_all_subordinates(person['name'], company_data)
-    all_people = [person] + subordinates
-    hierarchy = build_hierarchy_tree(all_people, person['name'])
+    try:
+        depth, max_children = parse_tree_limits(request.args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    person = org.records[person_index]
+    hierarchy = build_hierarchy_tree(org, person['name'], depth, max_children, snap.version)
     
     if not hierarchy:
-        return jsonify({'error': 'Could not build hierarchy'}), 500
+        return {'error': 'Could not build hierarchy'}, 500
+    
+    return hierarchy, 200
+
+@app.route('/api/hierarchy/<person_name>/children')
+@snapshot_cached
+def get_hierarchy_children(snap, person_name):
+    """Get one page of a person's direct reports, for expanding a tree node"""
+    org = snap.org_index
+    person_index = org.find(person_name)
     
-    return jsonify(hierarchy)
+    if person_index is None:
+        return {'error': 'Person not found'}, 404
+    
+    try:
+        depth, max_children = parse_tree_limits(request.args)
+        limit = max(1, min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+        cursor = request.args.get('cursor')
+        offset = decode_cursor(cursor, snap.version) if cursor else 0
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    children = org.children[person_index]
+    page = children[offset:offset + limit]
+    next_offset = offset + len(page)
+    return {
+        'name': org.names[person_index],
+        'total': len(children),
+        'children': [build_subtree(org, child, depth if depth is not None else 0, max_children, snap.version)
+                     for child in page],
+        'next_cursor': encode_cursor(snap.version, next_offset) if next_offset < len(children) else None
+    }, 200
 
 @app.route('/api/map-data/<person_name>')
-def get_map_data(person_name):
-    """Get geographic distribution data for map visualization"""
-    person = None
-    for p in company_data:
-        if normalize_name(p['name']) == normalize_name(person_name):
-            person = p
-            break
+@snapshot_cached
+def get_map_data(snap, person_name):
+    """Employee counts per location, country and department under a person.
+
+    Counts come from the org index rollups, so the response has one entry
+    per location however large the subtree is; the people at a location are
+    fetched a page at a time from /api/map-data/<name>/people.
+    """
+    org = snap.org_index
+    person_index = org.find(person_name)
+    
+    if person_index is None:
+        return {'error': 'Person not found'}, 404
+    
+    locations = {}
+    countries = Counter()
+    for (location, country, relationship), count in org.rollups['location'].counts(org, person_index).items():
+        bucket = locations.get(location)
+        if bucket is None:
+            bucket = locations[location] = {'location': location, 'count': 0, 'direct': 0, 'indirect': 0,
+                                            'none': 0, 'countries': Counter()}
+        bucket['count'] += count
+        bucket[relationship] += count
+        bucket['countries'][country] += count
+        countries[country] += count
+    
+    map_data = []
+    for bucket in locations.values():
+        bucket['country'] = bucket.pop('countries').most_common(1)[0][0]
+        map_data.append(bucket)
+    map_data.sort(key=lambda x: (-x['count'], x['location']))
+    
+    departments = org.rollups['department'].counts(org, person_index)
+    return {
+        'name': org.names[person_index],
+        'total': org.subtree_size(person_index),
+        'locations': map_data,
+        'countries': [{'country': country, 'count': count}
+                      for country, count in sorted(countries.items(), key=lambda x: (-x[1], x[0]))],
+        'departments': [{'department': department, 'count': count}
+                        for department, count in sorted(departments.items(), key=lambda x: (-x[1], x[0]))]
+    }, 200
+
+@app.route('/api/map-data/<person_name>/people')
+@snapshot_cached
+def get_map_people(snap, person_name):
+    """One page of the people at a location under a person, for a map marker"""
+    org = snap.org_index
+    person_index = org.find(person_name)
     
-    if not person:
-        return jsonify({'error': 'Person not found'}), 404
+    if person_index is None:
+        return {'error': 'Person not found'}, 404
     
-    subordinates = get_all_subordinates(person['name'], company_data)
-    all_people = [person] + subordinates
+    location = request.args.get('location', '').strip()
+    if not location:
+        return {'error': 'location is required'}, 400
+    try:
+        limit = max(1, min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+        cursor = request.args.get('cursor')
+        offset = decode_cursor(cursor, snap.version) if cursor else 0
+    except ValueError as e:
+        return {'error': str(e)}, 400
     
-    location_data = defaultdict(list)
-    for p in all_people:
-        location = p.get('location_input', 'Unknown')
-        if not location or location.strip() == '':
-            location = 'Unknown'
-        location_data[location].append({
+    rollup = org.rollups['location']
+    values = [value for value in rollup.labels if value[0] == location]
+    total, page = rollup.members(org, person_index, values, offset, limit)
+    next_offset = offset + len(page)
+    people = []
+    for i in page:
+        p = org.records[i]
+        people.append({
             'name': p['name'],
             'position': p['position'],
             'department': p['department'],
@@ -461,73 +4415,139 @@ def get_map_data(person_name):
             'relationship_with_qt': p.get('relationship_with_qt', 'None'),
             'representative_from_qt': p.get('representative_from_qt', 'No')
         })
+    return {
+        'location': location,
+        'total': total,
+        'people': people,
+        'next_cursor': encode_cursor(snap.version, next_offset) if next_offset < total else None
+    }, 200
+
+@app.route('/api/intro-path/<person_name>')
+@snapshot_cached
+def get_intro_paths(snap, person_name):
+    """Best warm introduction routes from QT contacts to a person"""
+    org = snap.org_index
+    target = org.find(person_name)
     
-    map_data = []
-    for location, people in location_data.items():
-        map_data.append({
-            'location': location,
-            'count': len(people),
-            'people': people,
-            'country': people[0]['country'] if people else ''
-        })
+    if target is None:
+        return {'error': 'Person not found'}, 404
+    
+    limit = request.args.get('limit', INTRO_PATH_DEFAULT_RESULTS, type=int)
+    limit = max(1, min(limit, INTRO_PATH_MAX_RESULTS))
     
-    map_data.sort(key=lambda x: x['count'], reverse=True)
-    return jsonify(map_data)
+    intro = snap.intro_index
+    paths = []
+    for cost, contact in intro.best(org, target, limit):
+        common, people = intro.path(org, contact, target)
+        contact_person = org.records[contact]
+        paths.append({
+            'contact': contact_person['name'],
+            'relationship_with_qt': contact_person['relationship_with_qt'],
+            'representative_from_qt': contact_person['representative_from_qt'],
+            'hops': len(people) - 1,
+            'cost': cost,
+            'common_manager': org.names[common],
+            'path': [{
+                'name': org.records[i]['name'],
+                'position': org.records[i]['position'],
+                'department': org.records[i]['department'],
+                'relationship_with_qt': org.records[i]['relationship_with_qt']
+            } for i in people]
+        })
+    return {'target': org.names[target], 'paths': paths}, 200
 
 @app.route('/api/filters')
 def get_filters():
-    """Get available filter options for departments and countries"""
-    departments = list(set(person['department'] for person in company_data if person.get('department')))
-    countries = list(set(person['country'] for person in company_data if person.get('country')))
+    """Filter options for every search facet, with how many employees have each"""
+    facets = snapshot.search_index.facets
+    options = {param: sorted(value for value in facets[field] if value)
+               for param, field in FACET_FIELDS.items()}
     
     return jsonify({
-        'departments': sorted(departments),
-        'countries': sorted(countries)
+        'departments': options['department'],
+        'countries': options['country'],
+        'locations': options['location'],
+        'relationships': options['relationship'],
+        'representatives': options['representative'],
+        'counts': {param: {value: facets[field][value].bit_count() for value in options[param]}
+                   for param, field in FACET_FIELDS.items()}
     })
 
 @app.route('/api/add-connection', methods=['POST'])
 def add_connection_api():
     """Add a new connection and store it"""
     try:
-        connection_data = request.get_json()
+        connection_data = request.get_json(silent=True)
         
         if not connection_data:
             return jsonify({'success': False, 'message': 'No data received'}), 400
         
-        connection_data['id'] = len(new_connections) + 1
-        connection_data['created_at'] = datetime.now().isoformat()
-        
-        new_connections.append(connection_data)
+        if not isinstance(connection_data, dict):
+            return jsonify({'success': False, 'message': 'Connection must be a JSON object'}), 400
+        if not str(connection_data.get('name') or '').strip() or \
+                not str(connection_data.get('connectionChampion') or '').strip():
+            return jsonify({'success': False, 'message': 'name and connectionChampion are required'}), 400
         
-        print("=" * 60)
-        print("NEW CONNECTION ADDED:")
-        print("=" * 60)
-        print(f"Name: {connection_data.get('name', 'N/A')}")
-        print(f"Email: {connection_data.get('email', 'N/A')}")
-        print(f"Designation: {connection_data.get('designation', 'N/A')}")
-        print(f"Connection Champion: {connection_data.get('connectionChampion', 'N/A')}")
-        print("=" * 60)
+        try:
+            connection = connection_store.add(connection_data)
+        except ConnectionStoreError as e:
+            logger.error(f"Error adding connection: {str(e)}")
+            return jsonify({'success': False, 'message': 'Connections cannot be saved right now',
+                            'error': str(e)}), 503
+        logger.debug(f"Queued connection {connection['id']}: {connection.get('name')} "
+                     f"via {connection.get('connectionChampion')}")
         
         return jsonify({
             'success': True,
             'message': 'Connection added successfully',
-            'data': connection_data,
-            'total_connections': len(new_connections)
+            'data': connection
         })
     
     except Exception as e:
         logger.error(f"Error adding connection: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to add connection', 'error': str(e)}), 500
 
+@app.route('/api/connections')
+def list_connections():
+    """Stored connections, newest first, filtered by champion and/or target name"""
+    try:
+        limit = request.args.get('limit', CONNECTIONS_DEFAULT_LIMIT, type=int)
+        if limit is None or not 1 <= limit <= CONNECTIONS_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {CONNECTIONS_MAX_LIMIT}")
+        cursor = request.args.get('cursor')
+        # Connection cursors are keyed on the last connection, not on a snapshot version
+        before = decode_connection_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results, total, more = connection_store.query(
+        champion=request.args.get('champion', '').strip(),
+        target=request.args.get('target', '').strip(),
+        limit=limit,
+        before=before
+    )
+    next_cursor = encode_connection_cursor(results[-1]) if more else None
+    return jsonify({
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'results': results,
+        'total': total
+    }), 200, {'X-Total-Count': str(total)}
+
 @app.route('/api/stats')
 def get_stats():
     """Get overall statistics about the organization"""
-    total_employees = len(company_data)
-    departments = len(set(person['department'] for person in company_data))
-    countries = len(set(person['country'] for person in company_data))
+    snap = snapshot
+    facets = snap.search_index.facets
+    total_employees = len(snap.records)
+    departments = len(facets['department'])
+    countries = len(facets['country'])
     
-    direct_connections = len([p for p in company_data if p.get('relationship_with_qt', '').lower() == 'direct'])
-    indirect_connections = len([p for p in company_data if p.get('relationship_with_qt', '').lower() == 'indirect'])
+    relationships = defaultdict(int)
+    for value, bitmap in facets['relationship_with_qt'].items():
+        relationships[value.lower()] += bitmap.bit_count()
+    direct_connections = relationships['direct']
+    indirect_connections = relationships['indirect']
     no_connections = total_employees - direct_connections - indirect_connections
     
     return jsonify({
@@ -539,38 +4559,90 @@ def get_stats():
             'indirect': indirect_connections,
             'none': no_connections
         },
-        'last_sync': sharepoint_last_sync.isoformat() if sharepoint_last_sync else None,
-        'data_source': 'SharePoint' if sharepoint_last_sync else 'Fallback Data'
+        'last_sync': snap.last_sync.isoformat() if snap.last_sync else None,
+        'data_source': snap.source
     })
 
 @app.route('/api/system-info')
 def get_system_info():
     """Get system information and data source details"""
+    snap = snapshot
     return jsonify({
         'success': True,
-        'data_source': 'SharePoint' if sharepoint_last_sync else 'Fallback Data',
+        'data_source': snap.source,
         'sharepoint_url': SHAREPOINT_CONFIG['file_url'],
-        'total_employees': len(company_data),
+        'profile_sources': [source_label(source) for source in profile_sources],
+        'last_merge': sync_state['merge'],
+        'last_sync_error': sync_state['last_error'],
+        'total_employees': len(snap.records),
         'last_updated': datetime.now().isoformat(),
-        'last_sync': sharepoint_last_sync.isoformat() if sharepoint_last_sync else None,
+        'last_sync': snap.last_sync.isoformat() if snap.last_sync else None,
+        'last_checked': sync_state['last_checked'].isoformat() if sync_state['last_checked'] else None,
+        'snapshot_version': snap.version,
         'sharepoint_available': SHAREPOINT_AVAILABLE,
-        'qt_representatives': QT_REPRESENTATIVES
+        'qt_representatives': QT_REPRESENTATIVES,
+        'ingestion_timings_ms': {stage: round(seconds * 1000, 1) for stage, seconds in snap.timings.items()},
+        'response_cache': response_cache.report(),
+        'connection_store': connection_store.report()
     })
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return app.response_class(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/profiler/start', methods=['POST'])
+def start_profiler():
+    """Start the sampling profiler; interval_ms sets the sampling interval"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler is disabled, set PROFILER_ENABLED=1 to enable it'}), 403
+    try:
+        interval_ms = float(request.args.get('interval_ms', 5))
+    except ValueError:
+        return jsonify({'error': 'interval_ms must be a number'}), 400
+    if not 1 <= interval_ms <= 1000:
+        return jsonify({'error': 'interval_ms must be between 1 and 1000'}), 400
+    if not profiler.start(interval_ms / 1000):
+        return jsonify({'error': 'Profiler is already running'}), 409
+    return jsonify({'success': True, 'interval_ms': interval_ms})
+
+@app.route('/api/profiler/stop', methods=['POST'])
+def stop_profiler():
+    """Stop the sampling profiler and return its report"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler is disabled, set PROFILER_ENABLED=1 to enable it'}), 403
+    profiler.stop()
+    return jsonify({'success': True, **profiler.report()})
+
+@app.route('/api/profiler')
+def profiler_report():
+    """Samples so far; format=collapsed returns flame graph input"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler is disabled, set PROFILER_ENABLED=1 to enable it'}), 403
+    if request.args.get('format') == 'collapsed':
+        return app.response_class(profiler.collapsed(), mimetype='text/plain')
+    try:
+        limit = max(1, int(request.args.get('limit', 50)))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify(profiler.report(limit))
+
 @app.route('/health')
 def health_check():
+    snap = snapshot
     return jsonify({
         'status': 'healthy',
-        'employees_loaded': len(company_data),
-        'new_connections': len(new_connections),
-        'sharepoint_connected': sharepoint_last_sync is not None,
-        'last_sync': sharepoint_last_sync.isoformat() if sharepoint_last_sync else None,
+        'employees_loaded': len(snap.records),
+        'snapshot_version': snap.version,
+        'new_connections': connection_store.count(),
+        'sharepoint_connected': snap.last_sync is not None,
+        'last_sync': snap.last_sync.isoformat() if snap.last_sync else None,
         'version': '3.0.0-sharepoint'
     })
 
 if __name__ == '__main__':
     logger.info("Starting Smart Stakeholder Search with SharePoint Integration...")
-    logger.info(f"Loaded {len(company_data)} employees")
+    logger.info(f"Loaded {len(snapshot.records)} employees")
     
     print("\n" + "="*60)
     print("SMART STAKEHOLDER SEARCH v3.0 - SHAREPOINT EDITION")
@@ -581,13 +4653,13 @@ if __name__ == '__main__':
     print(f"Add connections: http://localhost:8080/add-connection")
     print(f"Manage structure: http://localhost:8080/manage-structure")
     print(f"SharePoint integration: {'Enabled' if SHAREPOINT_AVAILABLE else 'Disabled - install libraries'}")
-    print(f"Data source: {'SharePoint' if sharepoint_last_sync else 'Fallback data'}")
-    print(f"Last sync: {sharepoint_last_sync or 'Never'}")
+    print(f"Data source: {snapshot.source}")
+    print(f"Last sync: {snapshot.last_sync or 'Never'}")
     print("="*60)
     
     if not SHAREPOINT_AVAILABLE:
         print("\nTo enable SharePoint integration:")
-        print("pip install Office365-REST-Python-Client msal")
+        print("pip install requests Office365-REST-Python-Client")
         print("Then update SHAREPOINT_CONFIG with your credentials")
     
     app.run(debug=True, port=8080)
\ No newline at end of file
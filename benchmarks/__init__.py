@@ -0,0 +1,5 @@
+"""Synthetic data and end-to-end benchmarks for the stakeholder search app.
+
+    python -m benchmarks.synthetic_org --size 50000 --output Profiles.xlsx
+    python -m benchmarks.run --size 50000 --baseline benchmarks/results/previous.json
+"""
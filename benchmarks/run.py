@@ -0,0 +1,200 @@
+# End-to-end benchmark: ingestion and API routes through the Flask test client
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+from benchmarks.synthetic_org import add_org_arguments, generate_org, write_profiles
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize(seconds, total_seconds, errors=0, response_bytes=None):
+    """Latency percentiles (ms) and throughput for one benchmark"""
+    ordered = sorted(seconds)
+    summary = {
+        'count': len(ordered),
+        'errors': errors,
+        'throughput_per_s': round(len(ordered) / total_seconds, 2) if total_seconds else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None
+    }
+    if response_bytes:
+        summary['mean_response_bytes'] = round(sum(response_bytes) / len(response_bytes))
+    return summary
+
+def route_requests(rows, count, rng):
+    """Request URLs per route, drawn deterministically from the generated org"""
+    names = [row['Name'] for row in rows]
+    departments = sorted({row['Department'] for row in rows})
+    countries = sorted({row['Country'] for row in rows})
+    managers = sorted({row['Manager Name'] for row in rows if row['Manager Name']})
+
+    def search_url():
+        name = rng.choice(names)
+        kind = rng.random()
+        if kind < 0.4:
+            params = {'q': name[:rng.randint(2, 6)], 'limit': 20}
+        elif kind < 0.7:
+            params = {'q': name.split()[-1].lower(), 'department': rng.choice(departments), 'limit': 50}
+        elif kind < 0.9:
+            params = {'q': name, 'fields': 'name,department,position'}
+        else:
+            params = {'country': rng.choice(countries), 'limit': 100, 'offset': rng.randrange(0, 500)}
+        return '/api/search?' + urlencode(params)
+
+    return {
+        'search': [search_url() for _ in range(count)],
+        'hierarchy': [f"/api/hierarchy/{quote(rng.choice(managers))}?depth=3&max_children=50"
+                      for _ in range(count)],
+        'hierarchy_full': [f"/api/hierarchy/{quote(rng.choice(managers))}" for _ in range(count)],
+        'map_data': [f"/api/map-data/{quote(rng.choice(managers))}" for _ in range(count)],
+        'stats': ['/api/stats'] * count,
+        'filters': ['/api/filters'] * count
+    }
+
+def bench_routes(app_module, urls_by_route, warmup):
+    """Time each route's URLs through the test client, after warmup untimed ones"""
+    client = app_module.app.test_client()
+    results = {}
+    for route, urls in urls_by_route.items():
+        for url in urls[:warmup]:
+            client.get(url)
+        seconds, sizes, errors = [], [], 0
+        started = time.perf_counter()
+        for url in urls[warmup:]:
+            request_started = time.perf_counter()
+            response = client.get(url)
+            body = response.get_data()
+            seconds.append(time.perf_counter() - request_started)
+            sizes.append(len(body))
+            if response.status_code != 200:
+                errors += 1
+        results[route] = summarize(seconds, time.perf_counter() - started, errors, sizes)
+        print(f"  {route:<15} p50 {results[route]['p50_ms']:>9.3f}ms  p95 {results[route]['p95_ms']:>9.3f}ms  "
+              f"p99 {results[route]['p99_ms']:>9.3f}ms  {results[route]['throughput_per_s']:>10.1f} req/s")
+    return results
+
+def bench_ingestion(app_module, repeats):
+    """Time full loads of the generated workbook.
+
+    Each run starts with no snapshot and no source stamp, as on a cold
+    start, so it goes through every stage including the index build instead
+    of stopping when it finds the source or its rows unchanged.
+    """
+    seconds, stages = [], []
+    started = time.perf_counter()
+    for _ in range(repeats):
+        app_module.sync_state.update(stamp=None, source_hash=None)
+        app_module.snapshot = None
+        load_started = time.perf_counter()
+        result = app_module.load_data_from_sharepoint(force=True)
+        seconds.append(time.perf_counter() - load_started)
+        if result['status'] != 'updated':
+            raise RuntimeError(f"Ingestion did not load the workbook ({result['status']}): {result.get('error')}")
+        stages.append(app_module.snapshot.timings)
+    summary = summarize(seconds, time.perf_counter() - started)
+    summary['stages_ms'] = {stage: round(sum(run.get(stage, 0) for run in stages) / len(stages) * 1000, 3)
+                            for stage in stages[-1]}
+    summary['employees_per_s'] = round(len(app_module.snapshot.records) / (sum(seconds) / len(seconds)))
+    print(f"  ingestion       p50 {summary['p50_ms']:>9.3f}ms  ({summary['employees_per_s']} employees/s)")
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Print p50/p99 and throughput changes against an earlier results file"""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nChange vs {baseline_path} ({baseline['meta'].get('commit')}):")
+    sections = [('ingestion', results['ingestion'], baseline.get('ingestion'))]
+    sections += [(route, summary, baseline.get('routes', {}).get(route))
+                 for route, summary in results['routes'].items()]
+    for name, current, previous in sections:
+        if not previous:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p99_ms', 'throughput_per_s'):
+            if previous.get(metric) and current.get(metric) is not None:
+                changes.append(f"{metric} {(current[metric] - previous[metric]) / previous[metric] * 100:+.1f}%")
+        print(f"  {name:<15} " + "  ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and API routes on a synthetic org')
+    add_org_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests per route first')
+    parser.add_argument('--ingestion-repeats', type=int, default=3)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stakeholder-bench-')
+    print(f"Generating {args.size} employees (depth {args.depth}, skew {args.skew})...")
+    started = time.perf_counter()
+    rows = generate_org(args.size, args.depth, args.skew, args.locations, args.departments, args.seed)
+    generate_seconds = time.perf_counter() - started
+    workbook_path = write_profiles(rows, os.path.join(workdir, 'Profiles.xlsx'))
+
+    # app.py reads its data source and cache locations when it is imported
+    os.environ['PROFILES_SOURCE_FILE'] = workbook_path
+    os.environ['SNAPSHOT_CACHE_PATH'] = os.path.join(workdir, 'snapshot.bin')
+    os.environ['CONNECTIONS_DB_PATH'] = os.path.join(workdir, 'connections.db')
+    print("Loading app...")
+    import app as app_module
+    # Build the lazily built indexes so they do not compete with the timings
+    app_module.snapshot.fuzzy_index
+
+    print("Benchmarking:")
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'generate_s': round(generate_seconds, 3),
+            'workbook_bytes': os.path.getsize(workbook_path)
+        },
+        'ingestion': bench_ingestion(app_module, args.ingestion_repeats)
+    }
+    app_module.snapshot.fuzzy_index
+    urls = route_requests(rows, args.requests + args.warmup, random.Random(args.seed))
+    results['routes'] = bench_routes(app_module, urls, args.warmup)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{args.size}.json")
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# Deterministic synthetic org generator producing Profiles.xlsx-shaped data
+
+import argparse
+import csv
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+from openpyxl import Workbook
+
+# Column headers of the SharePoint profiles sheet, in sheet order
+PROFILE_COLUMNS = [
+    'Name', 'Position', 'Department', 'Country', 'Location', 'Manager Name',
+    'LDAP', 'Phone', 'Hire Date', 'Employee ID'
+]
+
+FIRST_NAMES = [
+    'Aarav', 'Abhijeet', 'Adi', 'Aisha', 'Alex', 'Amit', 'Ana', 'Anna', 'Ariel', 'Avi',
+    'Ben', 'Carla', 'Chen', 'Chris', 'Dana', 'Daniel', 'David', 'Dennis', 'Dina', 'Eitan',
+    'Elena', 'Eli', 'Emma', 'Fatima', 'Gal', 'Gil', 'Hana', 'Hugo', 'Ido', 'Ines',
+    'Jillian', 'John', 'Julia', 'Kavya', 'Kobi', 'Laura', 'Lihi', 'Liam', 'Maria', 'Matt',
+    'Mayank', 'Michael', 'Mike', 'Mira', 'Noa', 'Omri', 'Oren', 'Priya', 'Rahul', 'Raj',
+    'Rina', 'Ronit', 'Sara', 'Shira', 'Sofia', 'Tal', 'Tom', 'Uri', 'Yael', 'Zoe'
+]
+
+LAST_NAMES = [
+    'Arya', 'Bagade', 'Barak', 'Brown', 'Bush', 'Cohen', 'Costa', 'Das', 'Dubois', 'Friedman',
+    'Garcia', 'Gold', 'Gupta', 'Hoffmann', 'Iyer', 'Jones', 'Kapoor', 'Katz', 'Kol', 'Kumar',
+    'Levi', 'Lopez', 'Martin', 'Mehta', 'Mizrahi', 'Muller', 'Nair', 'Nissim', 'OrRico', 'Patel',
+    'Peretz', 'Reddy', 'Rossi', 'Santos', 'Schmidt', 'Segev', 'Shah', 'Sharma', 'Silva', 'Singh',
+    'Smith', 'Stone', 'Taylor', 'Weber', 'Weiss', 'Williams', 'Wilson', 'Yadav', 'Zur', 'Zhou'
+]
+
+COUNTRIES = ['USA', 'UK', 'Germany', 'Portugal', 'India', 'Israel', 'France', 'Japan', 'Brazil', 'Canada']
+
+DEPARTMENT_STEMS = [
+    'Engineering', 'Sales', 'Marketing', 'Finance', 'HR', 'Legal', 'Operations', 'IT',
+    'Product', 'Research', 'Support', 'Security', 'Design', 'Data', 'Partnerships'
+]
+
+POSITIONS_BY_LEVEL = [
+    ['Chief Executive Officer'],
+    ['Vice President', 'Senior Vice President'],
+    ['Director', 'Senior Director'],
+    ['Senior Manager', 'Manager'],
+    ['Team Lead', 'Staff Engineer', 'Principal Analyst'],
+    ['Senior Engineer', 'Senior Analyst', 'Specialist', 'Consultant'],
+    ['Engineer', 'Analyst', 'Associate', 'Coordinator']
+]
+
+def level_sizes(size, depth):
+    """Number of people on each level of an org of size people and depth levels.
+
+    Levels grow geometrically from a single root, with the branching factor
+    chosen so the levels add up to size.
+    """
+    depth = max(1, min(depth, size))
+    if depth == 1:
+        return [size]
+    low, high = 1.0, float(size)
+    for _ in range(100):
+        branching = (low + high) / 2
+        total = sum(branching ** level for level in range(depth))
+        low, high = (branching, high) if total < size else (low, branching)
+    sizes = [max(1, int(round(branching ** level))) for level in range(depth)]
+    sizes[0] = 1
+    sizes[-1] = max(1, size - sum(sizes[:-1]))
+    # Rounding can overshoot on tiny orgs; trim the widest levels first
+    while sum(sizes) > size:
+        widest = max(range(1, depth), key=sizes.__getitem__)
+        sizes[widest] -= 1
+    return [count for count in sizes if count > 0]
+
+def skewed_weights(count, skew):
+    """Cumulative Zipf weights for count items; skew 0 is uniform"""
+    return list(accumulate(1.0 / (rank + 1) ** skew for rank in range(count)))
+
+def pick(rng, items, cumulative):
+    """Weighted choice from items using precomputed cumulative weights"""
+    return items[bisect_left(cumulative, rng.random() * cumulative[-1])]
+
+def person_name(number):
+    """Unique display name for person number"""
+    first = FIRST_NAMES[number % len(FIRST_NAMES)]
+    last = LAST_NAMES[(number // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    generation = number // (len(FIRST_NAMES) * len(LAST_NAMES))
+    return f"{first} {last}" if generation == 0 else f"{first} {last} {generation + 1}"
+
+def generate_org(size=1000, depth=6, skew=1.0, locations=40, departments=20, seed=1):
+    """Rows of a synthetic org, one dict per person keyed by PROFILE_COLUMNS.
+
+    depth is the number of management levels, skew the Zipf exponent of how
+    reports are spread over the managers of the level above (0 = even), and
+    locations/departments the number of distinct values of each. The same
+    arguments always produce the same rows.
+    """
+    rng = random.Random(seed)
+
+    sites = []
+    for number in range(max(1, locations)):
+        country = COUNTRIES[number % len(COUNTRIES)]
+        sites.append((country, f"{country} Office {number // len(COUNTRIES) + 1}"))
+    site_weights = skewed_weights(len(sites), 1.0)
+
+    department_names = []
+    for number in range(max(1, departments)):
+        stem = DEPARTMENT_STEMS[number % len(DEPARTMENT_STEMS)]
+        cycle = number // len(DEPARTMENT_STEMS)
+        department_names.append(stem if cycle == 0 else f"{stem} {cycle + 1}")
+
+    # Names are assigned in shuffled order so they do not follow the levels
+    name_numbers = list(range(size))
+    rng.shuffle(name_numbers)
+
+    rows = []
+    previous_level = []
+    for level, count in enumerate(level_sizes(size, depth)):
+        managers = previous_level[:]
+        rng.shuffle(managers)
+        manager_weights = skewed_weights(len(managers), skew) if managers else None
+        positions = POSITIONS_BY_LEVEL[min(level, len(POSITIONS_BY_LEVEL) - 1)]
+
+        current_level = []
+        for _ in range(count):
+            number = len(rows)
+            name = person_name(name_numbers[number])
+            manager = pick(rng, managers, manager_weights) if managers else None
+            if manager is None or level == 1:
+                department = department_names[number % len(department_names)]
+            elif rng.random() < 0.9:
+                # Most people work in their manager's department
+                department = manager['Department']
+            else:
+                department = rng.choice(department_names)
+            if manager is not None and rng.random() < 0.7:
+                country, location = manager['Country'], manager['Location']
+            else:
+                country, location = pick(rng, sites, site_weights)
+
+            row = {
+                'Name': name,
+                'Position': rng.choice(positions),
+                'Department': department,
+                'Country': country,
+                'Location': location,
+                'Manager Name': manager['Name'] if manager else '',
+                'LDAP': name.lower().replace(' ', '.'),
+                'Phone': f"+1 555 {rng.randrange(10000):04d}",
+                'Hire Date': f"{rng.randrange(2000, 2026)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+                'Employee ID': f"E{number + 1:07d}"
+            }
+            rows.append(row)
+            current_level.append(row)
+        previous_level = current_level
+    return rows
+
+def write_profiles(rows, path):
+    """Write rows as .xlsx (streamed, write-only) or .csv, by path extension"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.DictWriter(output, fieldnames=PROFILE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Profiles')
+    sheet.append(PROFILE_COLUMNS)
+    for row in rows:
+        sheet.append([row[column] for column in PROFILE_COLUMNS])
+    workbook.save(path)
+    return path
+
+def add_org_arguments(parser):
+    """Generator options shared with the benchmark harness"""
+    parser.add_argument('--size', type=int, default=10000, help='number of employees (1k-1M)')
+    parser.add_argument('--depth', type=int, default=7, help='number of management levels')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent for how reports spread over managers; 0 is even')
+    parser.add_argument('--locations', type=int, default=40, help='distinct office locations')
+    parser.add_argument('--departments', type=int, default=25, help='distinct departments')
+    parser.add_argument('--seed', type=int, default=1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Profiles.xlsx')
+    add_org_arguments(parser)
+    parser.add_argument('--output', default='Profiles.xlsx', help='.xlsx or .csv path')
+    args = parser.parse_args()
+
+    rows = generate_org(args.size, args.depth, args.skew, args.locations, args.departments, args.seed)
+    write_profiles(rows, args.output)
+    print(f"Wrote {len(rows)} employees to {args.output}")
+
+if __name__ == '__main__':
+    main()
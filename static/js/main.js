@@ -7,7 +7,8 @@ let globalTree = null;
 let globalRoot = null;
 let globalG = null;
 let i = 0;
-let allEmployees = []; // Store all employees for autocomplete
+let autocompleteRequest = 0; // Sequence number of the latest autocomplete request
+let autocompleteTimer = null;
 
 // Initialize the app
 document.addEventListener('DOMContentLoaded', function() {
@@ -26,28 +27,34 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
-// Load all employees for autocomplete functionality
-async function loadAllEmployees() {
-    try {
-        console.log('Loading all employees for autocomplete...');
-        const response = await fetch('/api/search?q='); // Empty query to get all employees
-        if (!response.ok) {
-            console.error('HTTP error! status:', response.status);
-            throw new Error('HTTP error! status: ' + response.status);
+// Fetch the top autocomplete matches for a query from the server
+async function fetchAutocompleteMatches(query) {
+    const params = new URLSearchParams({ q: query, limit: 8 });
+    const response = await fetch('/api/autocomplete?' + params);
+    if (!response.ok) {
+        throw new Error('HTTP error! status: ' + response.status);
+    }
+    return response.json();
+}
+
+// Request suggestions, ignoring responses that arrive after a newer request
+function updateAutocomplete(query) {
+    clearTimeout(autocompleteTimer);
+    autocompleteTimer = setTimeout(async () => {
+        const requestId = ++autocompleteRequest;
+        try {
+            const matches = await fetchAutocompleteMatches(query);
+            if (requestId === autocompleteRequest) {
+                showAutocomplete(matches);
+            }
+        } catch (error) {
+            console.error('Error loading autocomplete suggestions:', error);
         }
-        const employees = await response.json();
-        allEmployees = employees;
-        console.log('Loaded', employees.length, 'employees for autocomplete');
-    } catch (error) {
-        console.error('Error loading employees:', error);
-        allEmployees = []; // Fallback to empty array
-    }
+    }, 120);
 }
 
 // Setup autocomplete functionality
 function setupAutocomplete() {
-    loadAllEmployees();
-    
     const searchInput = document.getElementById('search');
     if (!searchInput) {
         console.warn('Search input not found');
@@ -70,18 +77,12 @@ function setupAutocomplete() {
         const query = e.target.value.trim().toLowerCase();
         
         if (query.length < 2) {
+            autocompleteRequest++;
             hideAutocomplete();
             return;
         }
         
-        // Filter employees based on name, position, or department
-        const matches = allEmployees.filter(emp => {
-            return emp.name.toLowerCase().includes(query) ||
-                   emp.position.toLowerCase().includes(query) ||
-                   emp.department.toLowerCase().includes(query);
-        }).slice(0, 8); // Limit to 8 results
-        
-        showAutocomplete(matches);
+        updateAutocomplete(query);
     });
     
     // Hide autocomplete when clicking outside
@@ -95,12 +96,7 @@ function setupAutocomplete() {
     searchInput.addEventListener('focus', function(e) {
         const query = e.target.value.trim().toLowerCase();
         if (query.length >= 2) {
-            const matches = allEmployees.filter(emp => {
-                return emp.name.toLowerCase().includes(query) ||
-                       emp.position.toLowerCase().includes(query) ||
-                       emp.department.toLowerCase().includes(query);
-            }).slice(0, 8);
-            showAutocomplete(matches);
+            updateAutocomplete(query);
         }
     });
 }
@@ -205,7 +201,9 @@ async function searchEmployees() {
     }
     
     const params = new URLSearchParams({
-        q: query
+        q: query,
+        limit: 20,
+        fields: 'name'
     });
     
     try {
@@ -217,8 +215,9 @@ async function searchEmployees() {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
-        const results = await response.json();
-        console.log('Search results:', results);
+        const page = await response.json();
+        const results = page.results;
+        console.log('Search results:', page.total, 'matches', results);
         
         if (results.length > 0) {
             // Find exact match first, then fallback to first result
@@ -229,7 +228,20 @@ async function searchEmployees() {
             console.log('Selected person:', selectedPerson);
             selectPerson(selectedPerson.name);
         } else {
-            alert('No results found. Please try a different name.');
+            // Nothing matched as typed, so look for the closest spelling
+            params.set('fuzzy', '1');
+            const fuzzyResponse = await fetch('/api/search?' + params);
+            if (!fuzzyResponse.ok) {
+                throw new Error(`HTTP error! status: ${fuzzyResponse.status}`);
+            }
+            const suggestions = (await fuzzyResponse.json()).results;
+            console.log('Fuzzy suggestions:', suggestions);
+            
+            if (suggestions.length > 0 && confirm(`No exact results. Did you mean ${suggestions[0].name}?`)) {
+                selectPerson(suggestions[0].name);
+            } else if (suggestions.length === 0) {
+                alert('No results found. Please try a different name.');
+            }
         }
     } catch (error) {
         console.error('Error searching:', error);
@@ -1711,12 +1723,12 @@ function renderMap(mapData) {
             'Pune': [18.5204, 73.8567]
         };
         
-        if (!mapData || !Array.isArray(mapData)) {
+        if (!mapData || !Array.isArray(mapData.locations)) {
             console.warn('Invalid map data provided');
             return;
         }
         
-        mapData.forEach(location => {
+        mapData.locations.forEach(location => {
             const coords = locationCoords[location.location];
             
             if (!coords) {
@@ -1725,24 +1737,11 @@ function renderMap(mapData) {
             }
             
             const connectionCounts = {
-                direct: 0,
-                indirect: 0,
-                none: 0
+                direct: location.direct || 0,
+                indirect: location.indirect || 0,
+                none: location.none || 0
             };
             
-            if (location.people && Array.isArray(location.people)) {
-                location.people.forEach(person => {
-                    const relationship = person.relationship_with_qt || 'None';
-                    if (relationship.toLowerCase() === 'direct') {
-                        connectionCounts.direct++;
-                    } else if (relationship.toLowerCase() === 'indirect') {
-                        connectionCounts.indirect++;
-                    } else {
-                        connectionCounts.none++;
-                    }
-                });
-            }
-            
             let circleColor, strokeColor;
             if (connectionCounts.direct > 0) {
                 circleColor = '#00C853';
@@ -1785,14 +1784,24 @@ function renderMap(mapData) {
                         `<div style="background: #F5F5F5; padding: 8px; border-radius: 6px; margin-bottom: 12px; border-left: 4px solid #757575;">
                             <strong style="color: #666;">No Known Connections: ${connectionCounts.none}</strong>
                         </div>` : ''}
+                    
+                    <div class="map-people" style="max-height: 200px; overflow-y: auto; font-size: 0.9rem;"></div>
                 </div>
             `;
             
             circleMarker.bindPopup(popupContent);
+            // People are only fetched once a marker is opened
+            circleMarker.on('popupopen', event => {
+                const container = event.popup.getElement().querySelector('.map-people');
+                if (container && !container.dataset.loaded) {
+                    container.dataset.loaded = 'true';
+                    loadMapPeople(container, location.location, null);
+                }
+            });
         });
         
         // Fit map to show all markers
-        if (mapData.length > 0) {
+        if (mapData.locations.length > 0) {
             const group = new L.featureGroup();
             map.eachLayer(layer => {
                 if (layer instanceof L.CircleMarker) {
@@ -1814,6 +1823,45 @@ function renderMap(mapData) {
     }
 }
 
+// Append one page of the people at a map location to a marker popup
+async function loadMapPeople(container, location, cursor) {
+    const params = new URLSearchParams({ location: location, limit: 20 });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    
+    try {
+        const response = await fetch(`/api/map-data/${encodeURIComponent(currentPerson)}/people?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const page = await response.json();
+        
+        const moreButton = container.querySelector('.map-people-more');
+        if (moreButton) {
+            moreButton.remove();
+        }
+        page.people.forEach(person => {
+            const row = document.createElement('div');
+            row.style.padding = '4px 0';
+            row.style.borderBottom = '1px solid #eee';
+            row.textContent = `${person.name} - ${person.position} (${person.department})`;
+            container.appendChild(row);
+        });
+        
+        if (page.next_cursor) {
+            const button = document.createElement('button');
+            button.className = 'map-people-more';
+            button.textContent = `Show more (${page.total - container.children.length} left)`;
+            button.style.marginTop = '6px';
+            button.addEventListener('click', () => loadMapPeople(container, location, page.next_cursor));
+            container.appendChild(button);
+        }
+    } catch (error) {
+        console.error('Error loading people for location:', error);
+    }
+}
+
 // Error handling wrapper for API calls
 async function safeApiCall(url, errorMessage) {
     try {
@@ -1851,7 +1899,6 @@ window.debugOrgChart = function() {
     console.log('Global root expanded:', globalRoot ? globalRoot.expanded : 'N/A');
     console.log('Global root _children:', globalRoot ? (globalRoot._children ? globalRoot._children.length : 0) : 'N/A');
     console.log('Global root children:', globalRoot ? (globalRoot.children ? globalRoot.children.length : 0) : 'N/A');
-    console.log('All employees loaded:', allEmployees.length);
     console.log('==================');
 };
 
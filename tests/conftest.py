@@ -0,0 +1,30 @@
+# Shared fixtures: the app loaded from a small synthetic org
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_org import generate_org, write_profiles
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported with a generated 1,500 person org as its data source.
+
+    app.py reads its data source and cache locations when it is imported,
+    so they point into a temporary directory first.
+    """
+    workdir = tmp_path_factory.mktemp('app')
+    os.environ['PROFILES_SOURCE_FILE'] = write_profiles(generate_org(size=1500, seed=7),
+                                                       str(workdir / 'Profiles.csv'))
+    os.environ['SNAPSHOT_CACHE_PATH'] = str(workdir / 'snapshot.bin')
+    os.environ['CONNECTIONS_DB_PATH'] = str(workdir / 'connections.db')
+    import app
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,150 @@
+# The connections store: write-behind batches, retries, id blocks and paging
+
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+@pytest.fixture
+def make_store(app_module, tmp_path):
+    """New ConnectionStore on one database file per test, like one per worker
+    process; every store is flushed after the test"""
+    stores = []
+
+    def make(**settings):
+        store = app_module.ConnectionStore(str(tmp_path / 'connections.db'))
+        for name, value in settings.items():
+            setattr(store, name, value)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.flush(5)
+
+def stored_ids(store):
+    with sqlite3.connect(store.path) as db:
+        return [connection_id for connection_id, in db.execute('SELECT id FROM connections ORDER BY id')]
+
+def add(store, name, champion='Dana Cohen'):
+    return store.add({'name': name, 'connectionChampion': champion, 'degreeOfConnection': '1st'})
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_adds_are_written_behind_in_one_batch(make_store):
+    store = make_store(BATCH_INTERVAL=0.5)
+    added = [add(store, f"Person {number}") for number in range(20)]
+
+    # Nothing has been committed yet, but the rows are already counted
+    assert stored_ids(store) == []
+    assert store.pending == 20 and store.count() == 20
+    assert store.flush(10)
+    assert stored_ids(store) == [connection['id'] for connection in added]
+    assert store.stats['batches'] == 1 and store.stats['committed'] == 20
+    assert store.pending == 0 and store.count() == 20
+
+def test_failed_batch_is_retried(app_module, make_store):
+    store = make_store(BATCH_INTERVAL=0.01, RETRY_BACKOFF=0.01, RETRY_BACKOFF_MAX=0.05)
+    add(store, 'Before')
+    assert store.flush(10)
+
+    # Another process takes the table away, so every commit fails
+    with sqlite3.connect(store.path) as db:
+        db.execute('ALTER TABLE connections RENAME TO held')
+    queued = [add(store, 'Queued 1'), add(store, 'Queued 2')]
+    wait_for(lambda: store.stats['write_errors'] >= 2)
+    assert 'no such table' in store.last_error
+    with pytest.raises(app_module.ConnectionStoreError, match='not being saved'):
+        add(store, 'Refused')
+    assert store.pending == 2
+
+    with sqlite3.connect(store.path) as db:
+        db.execute('ALTER TABLE held RENAME TO connections')
+    assert store.flush(10)
+    assert store.last_error is None
+    assert stored_ids(store)[1:] == [connection['id'] for connection in queued]
+    add(store, 'After')
+    assert store.flush(10) and len(stored_ids(store)) == 4
+
+def test_ids_come_from_blocks_per_store(make_store):
+    first, second = make_store(ID_BLOCK_SIZE=3), make_store(ID_BLOCK_SIZE=3)
+    assert [add(first, 'A')['id'], add(second, 'B')['id']] == [1, 4]
+    assert [add(first, f"A{number}")['id'] for number in range(3)] == [2, 3, 7]
+    assert add(second, 'B2')['id'] == 5
+    with sqlite3.connect(first.path) as db:
+        assert db.execute("SELECT next_id FROM id_blocks WHERE name = 'connections'").fetchone() == (10,)
+
+@pytest.fixture
+def listing(app_module, client, monkeypatch):
+    """Every page of GET /api/connections from store, as (names, more) pairs"""
+    def pages(store, limit, **filters):
+        monkeypatch.setattr(app_module, 'connection_store', store)
+        result, cursor = [], None
+        while True:
+            params = {'limit': limit, **filters, **({'cursor': cursor} if cursor else {})}
+            body = client.get('/api/connections', query_string=params).get_json()
+            cursor = body['next_cursor']
+            result.append(([connection['name'] for connection in body['results']], cursor is not None))
+            if cursor is None:
+                return result, body['total']
+    return pages
+
+@pytest.mark.parametrize('count, sizes', [(5, [2, 2, 1]), (4, [2, 2]), (2, [2]), (0, [0])])
+def test_paging_ends_on_the_last_page(make_store, listing, count, sizes):
+    store = make_store()
+    for number in range(count):
+        add(store, f"Person {number}")
+    assert store.flush(10)
+
+    pages, total = listing(store, 2)
+    assert total == count
+    assert [len(names) for names, _ in pages] == sizes
+    assert [more for _, more in pages] == [True] * (len(sizes) - 1) + [False]
+    assert [name for names, _ in pages for name in names] == [f"Person {number}" for number in reversed(range(count))]
+
+def test_paging_is_newest_first_across_id_blocks(make_store, listing):
+    # Two workers taking turns: ids 1, 4, 2, 5, 3, 6, 7, 8 in the order added
+    first, second = make_store(ID_BLOCK_SIZE=3), make_store(ID_BLOCK_SIZE=3)
+    added = []
+    for number in range(8):
+        store = first if number % 2 == 0 or number >= 6 else second
+        added.append(add(store, f"Person {number}", champion='Uri Levi' if number % 3 else 'Dana Cohen'))
+        # Distinct created_at values, so the ids can only break ties
+        time.sleep(0.002)
+    assert first.flush(10) and second.flush(10)
+    assert [connection['id'] for connection in added] == [1, 4, 2, 5, 3, 6, 7, 8]
+
+    pages, total = listing(first, 3)
+    assert total == 8
+    assert [names for names, _ in pages] == [['Person 7', 'Person 6', 'Person 5'],
+                                             ['Person 4', 'Person 3', 'Person 2'],
+                                             ['Person 1', 'Person 0']]
+    pages, total = listing(second, 2, champion='uri levi')
+    assert total == 5
+    assert [name for names, _ in pages for name in names] == ['Person 7', 'Person 5', 'Person 4',
+                                                             'Person 2', 'Person 1']
+
+class FrozenClock(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2026, 1, 1)
+
+def test_same_created_at_falls_back_to_the_id(app_module, make_store, listing, monkeypatch):
+    monkeypatch.setattr(app_module, 'datetime', FrozenClock)
+    store = make_store()
+    for number in range(4):
+        assert add(store, f"Person {number}")['created_at'] == '2026-01-01T00:00:00.000000'
+    assert store.flush(10)
+
+    pages, _ = listing(store, 3)
+    assert [names for names, _ in pages] == [['Person 3', 'Person 2', 'Person 1'], ['Person 0']]
+
+def test_bad_cursor_is_rejected(client):
+    response = client.get('/api/connections', query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
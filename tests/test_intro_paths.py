@@ -0,0 +1,73 @@
+# Warm-introduction paths against a brute force over every contact
+
+import random
+import time
+
+def chain(app, org, i):
+    """i and everyone above i, nearest first"""
+    people = [i]
+    while org.parent[i] != app.NO_PARENT:
+        i = org.parent[i]
+        people.append(i)
+    return people
+
+def brute_force_costs(app, org, intro, target):
+    """Sorted (cost, contact) for every contact in target's tree"""
+    above_target = {person: hops for hops, person in enumerate(chain(app, org, target))}
+    costs = []
+    for contact in range(len(org)):
+        if intro.cost[contact] < 0:
+            continue
+        for hops, person in enumerate(chain(app, org, contact)):
+            if person in above_target:
+                costs.append((hops + above_target[person] + intro.cost[contact], contact))
+                break
+    return sorted(costs)
+
+def assert_best_paths(app, snap, rng, samples=100):
+    org, intro = snap.org_index, snap.intro_index
+    for target in rng.sample(range(len(org)), samples):
+        best = intro.best(org, target, 5)
+        assert [cost for cost, _ in best] == [cost for cost, _ in brute_force_costs(app, org, intro, target)[:5]]
+        for cost, contact in best:
+            _, people = intro.path(org, contact, target)
+            assert people[0] == contact and people[-1] == target
+            assert len(people) - 1 + intro.cost[contact] == cost
+            for a, b in zip(people, people[1:]):
+                assert org.parent[a] == b or org.parent[b] == a
+
+def test_best_paths_match_brute_force(app_module):
+    assert_best_paths(app_module, app_module.snapshot, random.Random(5))
+
+def test_best_paths_after_moves(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'write_snapshot_cache_later', lambda: None)
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    rng = random.Random(6)
+    names = [person['name'] for person in app.snapshot.records]
+    for _ in range(10):
+        app.apply_manager_changes([tuple(names[i] for i in rng.sample(range(len(names)), 2))])
+    assert_best_paths(app, app.snapshot, rng)
+
+def test_moves_build_the_intro_index_in_the_background(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'write_snapshot_cache_later', lambda: None)
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    names = [person['name'] for person in app.snapshot.records]
+    assert app.apply_manager_changes([(names[40], names[3])])['status'] == 'updated'
+
+    moved = app.snapshot
+    deadline = time.monotonic() + 30
+    while moved._intro_index is None:
+        assert time.monotonic() < deadline, 'intro index not built'
+        time.sleep(0.01)
+    assert moved._fuzzy_index is not None
+
+def test_intro_path_route(app_module, client):
+    name = app_module.snapshot.records[77]['name']
+    data = client.get(f"/api/intro-path/{name}").get_json()
+    assert data['target'] == name
+    assert [path['cost'] for path in data['paths']] == sorted(path['cost'] for path in data['paths'])
+    for path in data['paths']:
+        assert path['path'][-1]['name'] == name
+    assert client.get('/api/intro-path/Nobody Here').status_code == 404
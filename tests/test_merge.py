@@ -0,0 +1,133 @@
+# Merging several profiles sources: priority, matching and conflicts
+
+import csv
+
+import pytest
+
+from benchmarks.synthetic_org import PROFILE_COLUMNS
+
+def person(app, **fields):
+    """Employee as a sheet row reads, with 'Unknown' in empty categorical fields"""
+    for field in app.UNKNOWN_DEFAULT_FIELDS:
+        fields.setdefault(field, 'Unknown')
+    return app.Employee(**fields)
+
+def test_earlier_source_wins_and_gaps_are_filled(app_module):
+    app = app_module
+    first = [person(app, name='Dana Cohen', employee_id='E1', position='Director', phone='')]
+    second = [person(app, name='Dana Cohen', employee_id='E1', position='Manager', phone='+1 555',
+                     department='Legal')]
+
+    merged, report = app.dedupe_records([('first', first), ('second', second)])
+    assert len(merged) == 1
+    assert merged[0]['position'] == 'Director'
+    assert merged[0]['phone'] == '+1 555' and merged[0]['department'] == 'Legal'
+    assert report['duplicates'] == 1 and report['conflicts'] == 1
+    assert report['conflict_samples'] == [{'name': 'Dana Cohen', 'field': 'position',
+                                           'kept': 'Director', 'kept_from': 'first',
+                                           'discarded': 'Manager', 'discarded_from': 'second'}]
+    assert [(stats['source'], stats['rows'], stats['duplicates'], stats['conflicts'])
+            for stats in report['sources']] == [('first', 1, 0, 0), ('second', 1, 1, 1)]
+
+def test_empty_values_never_conflict(app_module):
+    app = app_module
+    first = [person(app, name='Dana Cohen', ldap='dana.cohen', country='Israel')]
+    second = [person(app, name='Dana Cohen', ldap='dana.cohen')]
+
+    merged, report = app.dedupe_records([('first', first), ('second', second)])
+    assert merged[0]['country'] == 'Israel'
+    assert report['conflicts'] == 0
+
+@pytest.mark.parametrize('later, matches', [
+    # employee_id decides on its own
+    ({'name': 'D. Cohen', 'employee_id': 'E1', 'ldap': 'other'}, True),
+    ({'name': 'Dana Cohen', 'employee_id': 'E2', 'ldap': 'dana.cohen'}, False),
+    # ldap, then the normalized name, when the ids do not rule it out
+    ({'name': 'D. Cohen', 'ldap': 'dana.cohen'}, True),
+    ({'name': ' dana COHEN '}, True),
+    ({'name': 'Dana Cohen', 'ldap': 'dana.cohen2'}, False),
+])
+def test_matching_rules(app_module, later, matches):
+    app = app_module
+    first = [person(app, name='Dana Cohen', employee_id='E1', ldap='dana.cohen')]
+    merged, report = app.dedupe_records([('first', first), ('second', [person(app, **later)])])
+    assert len(merged) == (1 if matches else 2)
+    assert report['duplicates'] == (1 if matches else 0)
+
+def test_rows_of_one_source_are_not_merged(app_module):
+    app = app_module
+    rows = [person(app, name='Dana Cohen'), person(app, name='Dana Cohen')]
+    later = [person(app, name='Dana Cohen', phone='+1 555')]
+
+    merged, report = app.dedupe_records([('first', rows), ('second', later)])
+    assert len(merged) == 2
+    # A later row folds into the first of them
+    assert [record['phone'] for record in merged] == ['+1 555', '']
+    assert report['duplicates'] == 1
+
+def test_three_sources_in_priority_order(app_module):
+    app = app_module
+    batches = [('a', [person(app, name='Dana Cohen', position='Director')]),
+               ('b', [person(app, name='Dana Cohen', position='Manager', phone='+1 555'),
+                      person(app, name='Uri Levi')]),
+               ('c', [person(app, name='Uri Levi', phone='+2 666'),
+                      person(app, name='Dana Cohen', phone='+3 777')])]
+
+    merged, report = app.dedupe_records(batches)
+    assert [(record['name'], record['position'], record['phone']) for record in merged] == [
+        ('Dana Cohen', 'Director', '+1 555'), ('Uri Levi', 'Unknown', '+2 666')]
+    assert [stats['duplicates'] for stats in report['sources']] == [0, 1, 2]
+    assert report['conflicts'] == 2
+
+def write_sheet(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.DictWriter(output, fieldnames=PROFILE_COLUMNS, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+@pytest.fixture
+def sources(app_module, monkeypatch, tmp_path):
+    """Use the given CSV sheets, in priority order, as the profiles sources"""
+    monkeypatch.setattr(app_module, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app_module, 'snapshot', None)
+    monkeypatch.setattr(app_module, 'sync_state', dict(app_module.sync_state))
+    monkeypatch.setattr(app_module, 'write_snapshot_cache', lambda snap: None)
+
+    def use(*sheets):
+        paths = [write_sheet(tmp_path / f"source{number}.csv", rows) for number, rows in enumerate(sheets)]
+        monkeypatch.setattr(app_module, 'profile_sources', [app_module.LocalFileSource(path) for path in paths])
+
+    return use
+
+def test_missing_ldaps_are_made_up_after_merging(app_module, sources):
+    sources([{'Name': 'Dana Cohen', 'Position': 'Director'}, {'Name': 'Uri Levi'}, {'Name': 'Madonna'}],
+            [{'Name': 'Dana Cohen', 'LDAP': 'dcohen', 'Phone': '+1 555'}])
+
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'updated' and result['merge']['duplicates'] == 1
+    records = {record['name']: record for record in app_module.snapshot.records}
+    # Matched on the name: a made-up LDAP would have kept the rows apart
+    assert records['Dana Cohen']['ldap'] == 'dcohen' and records['Dana Cohen']['phone'] == '+1 555'
+    assert records['Uri Levi']['ldap'] == 'uri.levi'
+    assert records['Madonna']['ldap'] == 'madonna'
+
+def test_parse_sheets_keeps_source_order(app_module, tmp_path):
+    jobs = [(f"sheet{number}", write_sheet(tmp_path / f"sheet{number}.csv", [{'Name': f"Person {number}"}]), None)
+            for number in range(4)]
+    results = app_module.parse_sheets(jobs)
+    assert [[record['name'] for record in records] for records, _ in results] == [
+        ['Person 0'], ['Person 1'], ['Person 2'], ['Person 3']]
+
+def test_parse_sheets_reports_the_failing_sheet(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'INGEST_WORKERS', 2)
+    jobs = [('good', write_sheet(tmp_path / 'good.csv', [{'Name': 'Dana Cohen'}]), None),
+            ('missing', str(tmp_path / 'missing.xlsx'), None)]
+    with pytest.raises(Exception, match='missing'):
+        app_module.parse_sheets(jobs)
+
+def test_empty_source_list_fails_clearly(app_module, sources, monkeypatch):
+    monkeypatch.setattr(app_module, 'profile_sources', [])
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'fallback'
+    assert result['error'] == 'No profiles sources configured: PROFILES_SOURCES lists none'
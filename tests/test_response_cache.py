@@ -0,0 +1,33 @@
+# Cached per-person responses: ETag revalidation and the cache's counters
+
+import threading
+
+def test_revalidation_answers_not_modified(app_module, client):
+    app = app_module
+    name = app.snapshot.records[12]['name']
+    first = client.get(f"/api/hierarchy/{name}")
+    assert first.status_code == 200 and first.headers['ETag']
+
+    before = dict(app.response_cache.stats)
+    again = client.get(f"/api/hierarchy/{name}", headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert app.response_cache.stats['hits'] == before['hits'] + 1
+    assert app.response_cache.stats['not_modified'] == before['not_modified'] + 1
+
+def test_counters_are_exact_under_concurrency(app_module):
+    cache = app_module.ResponseCache(10)
+    cache.put('key', None, ('etag', '{}'))
+    start = threading.Barrier(8)
+
+    def revalidate():
+        start.wait()
+        for _ in range(5000):
+            cache.get('key', None)
+            cache.count_not_modified()
+
+    threads = [threading.Thread(target=revalidate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats['hits'] == cache.stats['not_modified'] == 40000
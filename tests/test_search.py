@@ -0,0 +1,65 @@
+# Search filters and facet counts against filtering every record
+
+import random
+
+def facet_values(app, records):
+    return {field: sorted({person.get(field, '') for person in records}) for field in app.FACET_FIELDS.values()}
+
+def random_filters(app, values, rng):
+    return {field: rng.sample(values[field], min(len(values[field]), rng.randint(1, 3)))
+            for field in rng.sample(list(app.FACET_FIELDS.values()), rng.randint(0, 3))}
+
+def matches(person, filters):
+    return all(person.get(field, '') in selected for field, selected in filters.items())
+
+def test_filters_and_facets_match_brute_force(app_module):
+    app = app_module
+    index = app.snapshot.search_index
+    records = index.records
+    values = facet_values(app, records)
+    rng = random.Random(1)
+    for _ in range(150):
+        filters = random_filters(app, values, rng)
+        query = rng.choice(['', records[rng.randrange(len(records))]['name'][:3].lower(), 'eng', 'xyzq'])
+        unfiltered = index.search_ids(query)
+        assert list(index.search_ids(query, filters)) == [doc_id for doc_id in unfiltered
+                                                          if matches(records[doc_id], filters)]
+
+        counts = index.facet_counts(query, filters)
+        for field in app.FACET_FIELDS.values():
+            # A field's counts ignore its own filter
+            others = {other: selected for other, selected in filters.items() if other != field}
+            expected = {}
+            for doc_id in unfiltered:
+                if matches(records[doc_id], others):
+                    value = records[doc_id].get(field, '')
+                    expected[value] = expected.get(value, 0) + 1
+            assert counts[field] == expected
+
+def test_fuzzy_search_filters_and_facets(app_module, client):
+    app = app_module
+    snap = app.snapshot
+    records = snap.records
+    rng = random.Random(2)
+    for _ in range(60):
+        person = rng.choice(records)
+        last_name = person['name'].split()[1]
+        # One typo in the last name
+        query = last_name[:-1] + ('x' if last_name[-1] != 'x' else 'y')
+        department = person['department']
+        data = client.get('/api/search', query_string={'q': query, 'fuzzy': '1', 'department': department,
+                                                       'limit': 500, 'facets': '1'}).get_json()
+
+        hits = [records[i] for i, _, _ in snap.fuzzy_index.search(query)]
+        expected = [hit['name'] for hit in hits if hit['department'] == department][:app.FUZZY_MAX_RESULTS]
+        assert [result['name'] for result in data['results']] == expected
+        departments = {}
+        for hit in hits:
+            departments[hit['department']] = departments.get(hit['department'], 0) + 1
+        assert data['facets']['department'] == departments
+
+def test_filters_route_lists_every_value(app_module, client):
+    records = app_module.snapshot.records
+    data = client.get('/api/filters').get_json()
+    assert data['departments'] == sorted({person['department'] for person in records if person['department']})
+    assert data['countries'] == sorted({person['country'] for person in records if person['country']})
@@ -0,0 +1,153 @@
+# SharePointClient against a local HTTP stand-in for SharePoint and Azure AD
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+
+FILE_PATH = '/personal/someone/Documents/Profiles.xlsx'
+FILE_BODY = bytes(range(256)) * 64
+# Where the stand-in cuts the first download off: a whole number of the
+# client's 1 KiB chunks, since a chunk cut short is read again
+CUT_OFF = 4096
+
+class StandIn(ThreadingHTTPServer):
+    """Answers each request with the next scripted reply for its path and
+    remembers the requests it got"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.replies = {}
+        self.requests = []
+        self.tokens = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def script(self, path, *replies):
+        self.replies.setdefault(path, []).extend(replies)
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        path = self.path.split('?')[0]
+        self.server.replies[path].pop(0)(self)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        # Every token request gets a new token
+        self.server.tokens += 1
+        reply(self, 200, json.dumps({'access_token': f"token-{self.server.tokens}", 'expires_in': 3600}).encode())
+
+def reply(handler, status, body=b'', headers=None, send=None):
+    """Answer with status and body, sending only the first send bytes of it
+    before closing the connection when send is given"""
+    handler.send_response(status)
+    handler.send_header('Content-Length', str(len(body)))
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(body[:send])
+    handler.wfile.flush()
+
+def status(code):
+    return lambda handler: reply(handler, code)
+
+def partial_content(handler):
+    start = int(handler.headers['Range'].split('=')[1].rstrip('-'))
+    reply(handler, 206, FILE_BODY[start:],
+          {'Content-Range': f"bytes {start}-{len(FILE_BODY) - 1}/{len(FILE_BODY)}"})
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(app_module, stand_in):
+    client = app_module.SharePointClient(
+        stand_in.url, stand_in.url + '/token',
+        {'client_id': 'app', 'username': 'user', 'password': 'secret'},
+        auth='oauth', max_retries=2, chunk_bytes=1024)
+    client.delays = []
+    client.sleep = client.delays.append
+    return client
+
+def file_requests(stand_in):
+    return [(path, headers) for method, path, headers in stand_in.requests if method == 'GET']
+
+def test_server_error_is_retried(client, stand_in):
+    properties = {'ETag': '"{1},7"', 'TimeLastModified': '2024-01-01T00:00:00Z'}
+    url = client.file_url(FILE_PATH)[len(stand_in.url):]
+    stand_in.script(url, status(503), lambda handler: reply(handler, 200, json.dumps(properties).encode()))
+
+    assert client.file_properties(FILE_PATH) == properties
+    assert len(file_requests(stand_in)) == 2
+    assert len(client.delays) == 1 and 0 <= client.delays[0] <= client.backoff
+
+def test_server_errors_give_up_after_max_retries(app_module, client, stand_in):
+    url = client.file_url(FILE_PATH)[len(stand_in.url):]
+    stand_in.script(url, status(500), status(502), status(504))
+
+    with pytest.raises(app_module.SharePointError, match='after 3 attempts'):
+        client.file_properties(FILE_PATH)
+    assert len(client.delays) == 2
+
+def test_rejected_token_is_renewed(client, stand_in):
+    url = client.file_url(FILE_PATH)[len(stand_in.url):]
+    stand_in.script(url, status(401), lambda handler: reply(handler, 200, b'{"ETag": "\\"{1},8\\""}'))
+
+    assert client.file_properties(FILE_PATH) == {'ETag': '"{1},8"'}
+    assert stand_in.tokens == 2
+    (_, first), (_, second) = file_requests(stand_in)
+    assert first['Authorization'] == 'Bearer token-1'
+    assert second['Authorization'] == 'Bearer token-2'
+    # A renewal is not a retry
+    assert client.delays == []
+
+def test_interrupted_download_resumes_with_range(client, stand_in, tmp_path):
+    url = client.file_url(FILE_PATH)[len(stand_in.url):] + '/$value'
+    stand_in.script(url, lambda handler: reply(handler, 200, FILE_BODY, send=CUT_OFF), partial_content)
+    dest_path = str(tmp_path / 'Profiles.xlsx')
+
+    assert client.download(FILE_PATH, dest_path) == dest_path
+    with open(dest_path, 'rb') as downloaded:
+        assert downloaded.read() == FILE_BODY
+    (_, first), (_, second) = file_requests(stand_in)
+    assert 'Range' not in first
+    assert second['Range'] == f"bytes={CUT_OFF}-"
+    assert not (tmp_path / 'Profiles.xlsx.part').exists()
+
+def test_download_restarts_when_range_is_ignored(client, stand_in, tmp_path):
+    url = client.file_url(FILE_PATH)[len(stand_in.url):] + '/$value'
+    stand_in.script(url, lambda handler: reply(handler, 200, FILE_BODY, send=CUT_OFF),
+                    lambda handler: reply(handler, 200, FILE_BODY))
+    dest_path = str(tmp_path / 'Profiles.xlsx')
+
+    client.download(FILE_PATH, dest_path)
+    with open(dest_path, 'rb') as downloaded:
+        assert downloaded.read() == FILE_BODY
+    assert file_requests(stand_in)[1][1]['Range'] == f"bytes={CUT_OFF}-"
+
+def test_failed_download_leaves_no_files(app_module, client, stand_in, tmp_path):
+    url = client.file_url(FILE_PATH)[len(stand_in.url):] + '/$value'
+    stand_in.script(url, status(404))
+
+    with pytest.raises(app_module.SharePointError, match='status 404'):
+        client.download(FILE_PATH, str(tmp_path / 'Profiles.xlsx'))
+    assert list(tmp_path.iterdir()) == []
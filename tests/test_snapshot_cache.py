@@ -0,0 +1,52 @@
+# Snapshot cache writes shared between worker processes
+
+import threading
+
+import pytest
+
+# The snapshot file lock is an flock, unavailable on Windows
+pytest.importorskip('fcntl')
+
+def test_background_write_during_sync_does_not_deadlock(app_module, monkeypatch):
+    """A sync that starts while the background writer is still serializing
+    the snapshot takes the snapshot file lock, then _cache_write_lock; the
+    writer must take them in the same order or the two wait on each other"""
+    app = app_module
+    monkeypatch.setattr(app, 'SHARED_SNAPSHOT', True)
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    monkeypatch.setattr(app, 'sync_state', dict(app.sync_state))
+
+    serializing, synced = threading.Event(), threading.Event()
+    write_buffers = app.SnapshotLayoutWriter.write
+
+    def slow_write(self, output):
+        if threading.current_thread().name == 'snapshot-cache':
+            serializing.set()
+            # Hold the writer here until the sync, holding the snapshot file
+            # lock, goes to write the cache itself
+            synced.wait(10)
+        return write_buffers(self, output)
+
+    write_snapshot_cache = app.write_snapshot_cache
+
+    def sync_write(snap):
+        synced.set()
+        return write_snapshot_cache(snap)
+
+    monkeypatch.setattr(app.SnapshotLayoutWriter, 'write', slow_write)
+
+    writer = threading.Thread(target=app.write_snapshot_cache, args=(app.snapshot,),
+                              name='snapshot-cache', daemon=True)
+    writer.start()
+    assert serializing.wait(10)
+    monkeypatch.setattr(app, 'write_snapshot_cache', sync_write)
+    results = []
+    syncer = threading.Thread(target=lambda: results.append(app.load_data_from_sharepoint(force=True)),
+                              daemon=True)
+    syncer.start()
+
+    syncer.join(30)
+    writer.join(30)
+    assert not syncer.is_alive() and not writer.is_alive()
+    assert results[0]['status'] in ('updated', 'unchanged')
+    assert app.read_snapshot_header()['version'] == app.snapshot.version == results[0]['version']
@@ -0,0 +1,127 @@
+# Structure changes: incremental org index updates against full rebuilds
+
+import random
+
+import pytest
+
+def random_forest(app, size, rng):
+    """Employees in shuffled order, each reporting to an earlier one or to
+    nobody, so the structure has no cycles"""
+    records = []
+    for i in range(size):
+        manager = '' if i == 0 or rng.random() < 0.02 else f"Person {rng.randrange(i)}"
+        records.append(app.Employee(name=f"Person {i}", manager_name=manager))
+    rng.shuffle(records)
+    return records
+
+def random_moves(org, count, rng, no_parent):
+    """Up to count {person: manager} moves that keep the structure acyclic"""
+    moves = {}
+    for _ in range(count):
+        i = rng.randrange(len(org))
+        manager = no_parent if rng.random() < 0.1 else rng.randrange(len(org))
+        j = manager
+        while j != no_parent and j != i:
+            j = moves.get(j, org.parent[j])
+        if j == no_parent:
+            moves[i] = manager
+    return {i: manager for i, manager in moves.items() if org.parent[i] != manager}
+
+def moved_records(app, org, records, moves):
+    records = list(records)
+    for i, manager in moves.items():
+        records[i] = records[i].replace(manager_name=org.names[manager] if manager != app.NO_PARENT else '')
+    return records
+
+def assert_same_structure(got, want, people=None):
+    assert list(got.parent) == list(want.parent)
+    assert [list(reports) for reports in got.children] == [list(reports) for reports in want.children]
+    assert sorted(got.roots) == sorted(want.roots)
+    assert list(got.depth) == list(want.depth)
+    assert list(got.order) == list(want.order)
+    assert list(got.entries) == sorted(got.entries) == [got.entry[i] for i in got.order]
+    for i in people if people is not None else range(len(got)):
+        assert got.subtree(i) == want.subtree(i)
+        assert got.subtree_size(i) == want.subtree_size(i)
+        for name in got.rollups:
+            assert got.rollups[name].counts(got, i) == want.rollups[name].counts(want, i)
+
+@pytest.mark.parametrize('label_gap', [None, 4])
+def test_with_managers_matches_rebuild(app_module, monkeypatch, label_gap):
+    app = app_module
+    if label_gap:
+        # Small gaps run out quickly, exercising relabelling and renumbering
+        monkeypatch.setattr(app.OrgIndex, 'LABEL_GAP', label_gap)
+    rng = random.Random(3)
+    for _ in range(200):
+        records = random_forest(app, rng.randint(2, 60), rng)
+        org = app.OrgIndex(records)
+        before = (list(org.parent), [list(reports) for reports in org.children], list(org.order),
+                  list(org.entry), list(org.entries))
+        moves = random_moves(org, rng.choice([1, 2, 5, 100]), rng, app.NO_PARENT)
+        new_records = moved_records(app, org, records, moves)
+
+        moved, rebuilt = org.with_managers(new_records, moves), app.OrgIndex(new_records)
+        assert_same_structure(moved, rebuilt)
+        for i in range(len(moved)):
+            for manager in range(len(moved)):
+                assert moved.is_under(i, manager) == rebuilt.is_under(i, manager)
+        # The original index is left as it was
+        assert before == (list(org.parent), [list(reports) for reports in org.children], list(org.order),
+                          list(org.entry), list(org.entries))
+
+def test_resolve_manager_changes(app_module):
+    app = app_module
+    org = app.OrgIndex([app.Employee(name='A'), app.Employee(name='B', manager_name='A'),
+                        app.Employee(name='C', manager_name='B')])
+
+    moves, errors = app.resolve_manager_changes(org, [('A', 'C')])
+    assert errors == ['Moving A under C would create a reporting cycle']
+
+    # Valid once the whole batch is applied
+    assert app.resolve_manager_changes(org, [('A', 'C'), ('C', '')]) == ({0: 2, 2: app.NO_PARENT}, [])
+
+    moves, errors = app.resolve_manager_changes(org, [('A', 'Zed'), ('Q', 'A'), ('B', 'B'), ('B', 'A'), ('B', 'C')])
+    assert moves == {}
+    assert errors == ["Row 1: manager 'Zed' not found", "Row 2: employee 'Q' not found",
+                      'Row 3: B cannot report to themselves', 'Row 5: B is assigned to more than one manager']
+
+def apply_random_changes(app, rng, batches):
+    for _ in range(batches):
+        org = app.snapshot.org_index
+        changes = [(org.names[rng.randrange(len(org))],
+                    org.names[rng.randrange(len(org))] if rng.random() > 0.05 else '')
+                   for _ in range(rng.choice([1, 3, 10]))]
+        result = app.apply_manager_changes(changes)
+        assert result['status'] in ('updated', 'unchanged', 'rejected')
+        if result['status'] == 'updated':
+            current = app.snapshot
+            assert current.version == result['version']
+            assert_same_structure(current.org_index, app.OrgIndex(list(current.records)),
+                                  rng.sample(range(len(org)), 100))
+
+def test_apply_manager_changes_matches_rebuild(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'write_snapshot_cache_later', lambda: None)
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    apply_random_changes(app, random.Random(5), 20)
+
+def test_apply_manager_changes_to_cached_snapshot(app_module, monkeypatch, tmp_path):
+    """Moves made on a snapshot read from the cache, whose records and
+    indexes are views of the file, match a rebuild and survive a round trip"""
+    app = app_module
+    monkeypatch.setattr(app, 'write_snapshot_cache_later', lambda: None)
+    path = str(tmp_path / 'snapshot.bin')
+    app.save_snapshot_cache(app.snapshot, 'stamp', 'hash', path)
+    cached, header = app.read_snapshot_cache(path)
+    assert header['version'] == app.snapshot.version
+    monkeypatch.setattr(app, 'snapshot', cached)
+    apply_random_changes(app, random.Random(6), 20)
+
+    current = app.snapshot
+    app.save_snapshot_cache(current, 'stamp', 'hash', path)
+    reloaded, _ = app.read_snapshot_cache(path)
+    assert [person.to_tuple() for person in reloaded.records] == [person.to_tuple() for person in current.records]
+    assert_same_structure(reloaded.org_index, app.OrgIndex(list(current.records)), range(0, len(current.records), 7))
+    for query in ('an', 'kol', 'xyzq'):
+        assert reloaded.search_index.search_ids(query) == current.search_index.search_ids(query)
@@ -0,0 +1,163 @@
+# Syncs from a local profiles source: skips, forced syncs, failures and jobs
+
+import os
+import time
+
+import pytest
+
+from benchmarks.synthetic_org import generate_org, write_profiles
+
+@pytest.fixture
+def source(app_module, monkeypatch, tmp_path):
+    """A 200 person CSV as the only profiles source, counting downloads.
+
+    The current snapshot and sync state are restored after the test.
+    """
+    app = app_module
+    path = write_profiles(generate_org(size=200, seed=3), str(tmp_path / 'Profiles.csv'))
+    source = app.LocalFileSource(path)
+    source.downloads = 0
+    download = source.download
+
+    def counted_download(dest_path):
+        source.downloads += 1
+        return download(dest_path)
+
+    source.download = counted_download
+    monkeypatch.setattr(app, 'profile_sources', [source])
+    monkeypatch.setattr(app, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    monkeypatch.setattr(app, 'sync_state', dict(app.sync_state))
+    monkeypatch.setattr(app, 'write_snapshot_cache', lambda snap: None)
+    return source
+
+@pytest.fixture
+def parses(app_module, monkeypatch):
+    """Number of parse_sheets calls, as a one-item list"""
+    calls = [0]
+    parse_sheets = app_module.parse_sheets
+
+    def counted_parse(jobs):
+        calls[0] += 1
+        return parse_sheets(jobs)
+
+    monkeypatch.setattr(app_module, 'parse_sheets', counted_parse)
+    return calls
+
+def touch(path):
+    """Change path's modification time and so its source stamp, keeping its content"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_first_sync_loads_the_source(app_module, source, parses):
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'updated'
+    assert result['employees_count'] == 200 == len(app_module.snapshot.records)
+    assert app_module.snapshot.version == result['version']
+    assert source.downloads == 1 and parses[0] == 1
+
+def test_unchanged_stamp_skips_the_download(app_module, source, parses):
+    first = app_module.load_data_from_sharepoint()
+    result = app_module.load_data_from_sharepoint()
+    assert result == {'status': 'unchanged', 'version': first['version'], 'employees_count': 200}
+    assert source.downloads == 1 and parses[0] == 1
+
+def test_unchanged_content_skips_the_parse(app_module, source, parses):
+    first = app_module.load_data_from_sharepoint()
+    touch(source.file_path)
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'unchanged' and result['version'] == first['version']
+    assert source.downloads == 2 and parses[0] == 1
+    # The new stamp is remembered, so the next check skips the download again
+    assert app_module.load_data_from_sharepoint()['status'] == 'unchanged'
+    assert source.downloads == 2
+
+def test_forced_sync_reads_unchanged_source(app_module, source, parses):
+    first = app_module.load_data_from_sharepoint()
+    result = app_module.load_data_from_sharepoint(force=True)
+    # Every row was read again and matched the current snapshot
+    assert result['status'] == 'unchanged' and result['version'] == first['version']
+    assert result['diff'] == {'added': 0, 'changed': 0, 'removed': 0, 'kept': 200}
+    assert source.downloads == 2 and parses[0] == 2
+
+def test_changed_rows_publish_a_new_snapshot(app_module, source):
+    first = app_module.load_data_from_sharepoint()
+    rows = generate_org(size=200, seed=3)
+    rows[5]['Position'] = 'Chief Tester'
+    write_profiles(rows[:-1], source.file_path)
+    touch(source.file_path)
+
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'updated' and result['version'] > first['version']
+    assert result['diff'] == {'added': 0, 'changed': 1, 'removed': 1, 'kept': 198}
+    snap = app_module.snapshot
+    assert snap.records[snap.org_index.find(rows[5]['Name'])]['position'] == 'Chief Tester'
+
+def test_parse_error_keeps_the_current_snapshot(app_module, source, monkeypatch):
+    first = app_module.load_data_from_sharepoint()
+    current = app_module.snapshot
+
+    def broken_parse(jobs):
+        raise ValueError('not a workbook')
+
+    monkeypatch.setattr(app_module, 'parse_sheets', broken_parse)
+    result = app_module.load_data_from_sharepoint(force=True)
+    assert result['status'] == 'failed' and result['version'] == first['version']
+    assert result['error'] == 'not a workbook'
+    assert app_module.snapshot is current
+    assert app_module.sync_state['last_error']['error'] == 'not a workbook'
+
+def test_parse_error_without_data_falls_back(app_module, source, monkeypatch):
+    def broken_parse(jobs):
+        raise ValueError('not a workbook')
+
+    monkeypatch.setattr(app_module, 'parse_sheets', broken_parse)
+    monkeypatch.setattr(app_module, 'snapshot', None)
+    result = app_module.load_data_from_sharepoint()
+    assert result['status'] == 'fallback'
+    assert app_module.snapshot.source == 'Fallback Data'
+    assert result['employees_count'] == len(app_module.snapshot.records)
+    assert app_module.sync_state['stamp'] is None
+
+def poll(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Sync job still {job['status']} after {timeout}s")
+
+def test_sync_route_runs_a_background_job(app_module, source, client):
+    response = client.post('/api/sync-sharepoint?force=1')
+    assert response.status_code == 202
+    started = response.get_json()
+    assert started['success'] and started['status'] in ('queued', 'running', 'completed')
+    assert started['status_url'] == f"/api/sync-sharepoint/{started['job_id']}"
+
+    job = poll(client, started['status_url'])
+    assert job['status'] == 'completed' and job['force'] is True
+    assert job['result']['status'] == 'updated'
+    assert job['result']['employees_count'] == 200
+    assert job['started_at'] and job['finished_at']
+
+    # Nothing changed since, so a normal sync skips the download
+    job = poll(client, client.post('/api/sync-sharepoint').get_json()['status_url'])
+    assert job['result']['status'] == 'unchanged'
+    assert source.downloads == 1
+
+def test_sync_route_reports_failed_jobs(app_module, source, client, monkeypatch):
+    app_module.load_data_from_sharepoint()
+
+    def broken_parse(jobs):
+        raise ValueError('not a workbook')
+
+    monkeypatch.setattr(app_module, 'parse_sheets', broken_parse)
+    job = poll(client, client.post('/api/sync-sharepoint?force=1').get_json()['status_url'])
+    assert job['status'] == 'failed'
+    assert job['result']['status'] == 'failed' and job['result']['error'] == 'not a workbook'
+
+def test_unknown_sync_job(client):
+    response = client.get('/api/sync-sharepoint/nope')
+    assert response.status_code == 404
+    assert response.get_json()['success'] is False